@@ -8,25 +8,48 @@ from graphene_django.types import DjangoObjectType
 # NEW → helper that builds a proper dict payload for JWT
 from graphql_jwt.shortcuts import get_token
 
+from django.db.models import Prefetch
+
 from .models import Profile, Invite, Friendship, Group, GroupMember
 from graphene.types.generic import GenericScalar
+from files import derivatives
 from files.models import File
+from vault.deletion import delete_groups
 
 User = get_user_model()
 
+# ─── Helpers ───────────────────────────────────────────────────────────────
+
+def avatar_prefetch(profile="profile"):
+    """Prefetch of the avatar files behind ``profile``, with their newest versions."""
+    return Prefetch(
+        f"{profile}__avatar_file",
+        queryset=derivatives.with_latest_version(File.all_objects.all()),
+    )
+
+
+def with_profiles(users):
+    """``users`` with the profiles and avatars ``ProfileType`` reads, in two queries."""
+    return users.select_related("profile").prefetch_related(avatar_prefetch())
+
+
 # ─── GraphQL Types ─────────────────────────────────────────────────────────
 
 class ProfileType(DjangoObjectType):
-    avatar_url = graphene.String()
+    avatar_url = graphene.String(
+        size=graphene.Int(default_value=64, description="Display width in pixels")
+    )
     preferences = GenericScalar()
 
     class Meta:
         model = Profile
         fields = ("avatar_url", "bio", "preferences")
 
-    def resolve_avatar_url(self, info):
-        if self.avatar_file:
-            return info.context.build_absolute_uri(self.avatar_file.upload.url)
+    def resolve_avatar_url(self, info, size):
+        avatar = self.avatar_file
+        if avatar and avatar.deleted_at is None:
+            resized = derivatives.resize_url(avatar, size, info.context)
+            return resized or info.context.build_absolute_uri(avatar.upload.url)
         return self.avatar_url
 
 
@@ -128,7 +151,7 @@ class AccountsQuery(graphene.ObjectType):
         qs = User.objects.filter(id__in=set(sent) | set(recv))
         if username_contains:
             qs = qs.filter(username__icontains=username_contains)
-        return qs[offset : offset + limit]
+        return with_profiles(qs)[offset : offset + limit]
 
     def resolve_my_groups(self, info, limit, offset, name_contains=None):
         user = info.context.user
@@ -146,7 +169,7 @@ class AccountsQuery(graphene.ObjectType):
         grp = Group.objects.filter(pk=group_id, members__user=user).first()
         if not grp:
             raise GraphQLError("No access to this group.")
-        return User.objects.filter(groupmember__group=grp)
+        return with_profiles(User.objects.filter(group_memberships__group=grp))
 
 
 # ─── Mutations ──────────────────────────────────────────────────────────────
@@ -308,7 +331,7 @@ class DeleteGroup(graphene.Mutation):
         grp = Group.objects.filter(pk=group_id, owner=user).first()
         if not grp:
             raise GraphQLError("Only the group owner can delete the group.")
-        grp.delete()
+        delete_groups([grp.pk])
         return DeleteGroup(ok=True)
 
 
@@ -1,7 +1,7 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
 
-from .models import Group
+from .models import Group, GroupMember
 
 
 class GroupInviteRotationTests(TestCase):
@@ -107,3 +107,71 @@ class DeleteGroupTests(TestCase):
         with self.assertRaises(GraphQLError):
             DeleteGroup().mutate(self._info_other, group_id=self.grp.id)
         self.assertTrue(Group.objects.filter(id=self.grp.id).exists())
+
+    def test_delete_removes_memberships_shares_and_channel(self):
+        from chat.models import Channel
+        from graph.models import Node, NodeShare
+        from .schema import DeleteGroup
+
+        GroupMember.objects.create(user=self.other, group=self.grp)
+        node = Node.objects.create(owner=self.owner, name="n")
+        NodeShare.objects.create(node=node, shared_with_group=self.grp, permission=NodeShare.READ)
+        Channel.objects.create(channel_type=Channel.GROUP, group=self.grp)
+
+        DeleteGroup().mutate(self._info_owner, group_id=self.grp.id)
+        self.assertFalse(GroupMember.objects.filter(group_id=self.grp.id).exists())
+        self.assertFalse(NodeShare.objects.exists())
+        self.assertFalse(Channel.objects.exists())
+
+
+class AvatarListTests(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+
+        from django.test import override_settings
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = get_user_model().objects.create_user(username="owner", password="pw")
+        self.grp = Group.objects.create(name="g", owner=self.owner)
+        self._add_member(self.owner)
+
+    def _add_member(self, user):
+        from django.core.files.base import ContentFile
+        from files.models import File, Version
+
+        file = File.objects.create(owner=user, name="a.png", upload=ContentFile(b"png", "a.png"))
+        Version.objects.create(file=file, upload=file.upload.name, sha256=f"{file.pk:064d}", content_type="image/png")
+        user.profile.avatar_file = file
+        user.profile.save()
+        GroupMember.objects.create(user=user, group=self.grp)
+
+    def _members(self):
+        from types import SimpleNamespace
+
+        from vault.schema import schema
+
+        context = SimpleNamespace(user=self.owner, build_absolute_uri=lambda path="": f"http://testserver{path}")
+        result = schema.execute(
+            "query($id: ID!) { groupMembers(groupId: $id) { username profile { avatarUrl(size: 32) } } }",
+            variables={"id": str(self.grp.pk)},
+            context_value=context,
+        )
+        self.assertIsNone(result.errors)
+        return result.data["groupMembers"]
+
+    def test_member_avatars_take_a_fixed_number_of_queries(self):
+        with self.assertNumQueries(3):
+            self._members()
+        for i in range(3):
+            self._add_member(get_user_model().objects.create_user(username=f"m{i}", password="pw"))
+        with self.assertNumQueries(3):
+            members = self._members()
+        self.assertEqual(len(members), 4)
+        for member in members:
+            self.assertIn("/media/resize/", member["profile"]["avatarUrl"])
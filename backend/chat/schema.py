@@ -2,13 +2,17 @@ import graphene
 from graphql import GraphQLError
 from graphene_django import DjangoObjectType
 from graphene_file_upload.scalars import Upload
+from django.db import transaction
 from django.db.models import Q
 from django.utils import timezone
 
 from .models import Channel, ChannelMembership, Message
-from accounts.schema import UserType
+from accounts.schema import UserType, avatar_prefetch
 from accounts.models import Group
-from files.schema import VersionType
+from files import derivatives, usage
+from files.schema import (
+    VersionType, can_read_version, discard_uploads, find_readable_version, resolve_upload,
+)
 from graph.models import Node
 
 # ── Types ────────────────────────────────────────────────────────────────────
@@ -44,6 +48,8 @@ class MessageType(DjangoObjectType):
         return self.sender
 
     def resolve_attachment(self, info):
+        if self.attachment and self.attachment.is_trashed:
+            return None
         return self.attachment
 
 
@@ -63,7 +69,8 @@ class ChatQuery(graphene.ObjectType):
         user = info.context.user
         if user.is_anonymous:
             raise GraphQLError("Authentication required.")
-        return Channel.objects.filter(memberships__user=user)
+        # channels of trashed nodes come back if the node is restored
+        return Channel.objects.filter(memberships__user=user).exclude(node__deleted_at__isnull=False)
 
     def resolve_channel_messages(self, info, channel_id, limit, offset):
         user = info.context.user
@@ -72,7 +79,11 @@ class ChatQuery(graphene.ObjectType):
         ch = Channel.objects.filter(pk=channel_id).first()
         if not ch or not ch.memberships.filter(user=user).exists():
             raise GraphQLError("No access to that channel.")
-        return ch.messages.order_by("created_at")[offset : offset + limit]
+        return (
+            ch.messages.select_related("sender__profile", "attachment__file")
+            .prefetch_related(avatar_prefetch("sender__profile"))
+            .order_by("created_at")[offset : offset + limit]
+        )
 
 
 # ── Mutations ────────────────────────────────────────────────────────────────
@@ -185,8 +196,13 @@ class SendMessage(graphene.Mutation):
         channel_id = graphene.ID(required=True)
         text = graphene.String()
         upload = Upload()
+        version_id = graphene.ID(description="Attach an existing version you can read")
+        sha256 = graphene.String(
+            description="Content hash; skips storing the upload when the bytes are already known"
+        )
+        size = graphene.BigInt(description="Byte size the known content must have; defaults to the upload's")
 
-    def mutate(self, info, channel_id, text=None, upload=None):
+    def mutate(self, info, channel_id, text=None, upload=None, version_id=None, sha256=None, size=None):
         user = info.context.user
         if user.is_anonymous:
             raise GraphQLError("Authentication required.")
@@ -194,13 +210,38 @@ class SendMessage(graphene.Mutation):
         if not ch or not ch.memberships.filter(user=user).exists():
             raise GraphQLError("No access to that channel.")
 
+        from files.models import File, Version
+
         version = None
-        if upload:
+        if version_id:
+            version = Version.objects.filter(pk=version_id).first()
+            if not version:
+                raise GraphQLError("Version not found.")
+            # also forwards attachments from the sender's other chats
+            if not can_read_version(user, version):
+                raise GraphQLError("Permission denied.")
+        elif sha256:
+            # known content is attached as-is: one message row, no file copy
+            version = find_readable_version(user, sha256)
+            if size is None and upload:
+                size = upload.size
+            if version and size is not None and version.size != size:
+                version = None
+            if not version and not upload:
+                raise GraphQLError("Unknown content hash; upload the file instead.")
+
+        if upload and version:
+            # the attachment is already stored; drop the copy sent along
+            discard_uploads([upload])
+        elif upload:
             # treat upload as a new Version in a File owned by user
-            from files.models import File, Version
-
-            f = File.objects.create(owner=user, name=upload.name, upload=upload)
-            version = Version.objects.create(file=f, upload=upload)
+            blob, metadata = resolve_upload(user, upload)
+            with transaction.atomic():
+                f = File.objects.create(owner=user, name=upload.name, upload=blob)
+                # the version shares the blob just written instead of storing a second copy
+                version = Version.objects.create(file=f, upload=f.upload.name, **metadata)
+                usage.versions_added([version.pk])
+                derivatives.schedule(version)
 
         msg = Message.objects.create(
             channel=ch, sender=user, text=text or "", attachment=version
@@ -1,3 +1,134 @@
-from django.test import TestCase
+import hashlib
+import shutil
+import tempfile
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from graphql import GraphQLError
+
+from files.models import File, Version
+from .models import Channel, ChannelMembership, Message
+from .schema import SendMessage
+
+
+class SendMessageAttachmentTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+
+        User = get_user_model()
+        self.sender = User.objects.create_user(username="sender", password="pw")
+        self.stranger = User.objects.create_user(username="stranger", password="pw")
+        self.channel = Channel.objects.create(channel_type=Channel.PUBLIC)
+        ChannelMembership.objects.create(channel=self.channel, user=self.sender)
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def _info(self):
+        return SimpleNamespace(
+            context=SimpleNamespace(
+                user=self.sender,
+                build_absolute_uri=lambda path="": f"http://testserver{path}",
+            )
+        )
+
+    def _send(self, **kwargs):
+        return SendMessage().mutate(self._info(), channel_id=self.channel.id, **kwargs)
+
+    def test_upload_stores_single_blob_with_hash(self):
+        result = self._send(upload=SimpleUploadedFile("a.txt", b"hello"))
+
+        version = result.message.attachment
+        self.assertEqual(version.sha256, hashlib.sha256(b"hello").hexdigest())
+        self.assertEqual(version.size, 5)
+        self.assertEqual(version.upload.name, version.file.upload.name)
+
+    def test_attach_existing_version_reuses_row(self):
+        first = self._send(upload=SimpleUploadedFile("a.txt", b"hello")).message.attachment
+
+        result = self._send(version_id=first.id)
+
+        self.assertEqual(result.message.attachment, first)
+        self.assertEqual(Version.objects.count(), 1)
+        self.assertEqual(File.objects.count(), 1)
+
+    def test_known_hash_skips_upload(self):
+        first = self._send(upload=SimpleUploadedFile("a.txt", b"hello")).message.attachment
+
+        result = self._send(
+            sha256=first.sha256, upload=SimpleUploadedFile("a.txt", b"hello")
+        )
+
+        self.assertEqual(result.message.attachment, first)
+        self.assertEqual(Version.objects.count(), 1)
+
+    def test_reused_content_drops_the_streamed_copy(self):
+        from files.uploadhandlers import StreamingUploadHandler
+
+        first = self._send(upload=SimpleUploadedFile("a.txt", b"hello")).message.attachment
+
+        def streamed(content):
+            handler = StreamingUploadHandler()
+            handler.stream = True
+            handler.new_file("file", "b.txt", "text/plain", len(content))
+            handler.receive_data_chunk(content, 0)
+            return handler.file_complete(len(content))
+
+        for kwargs in ({"version_id": first.id}, {"sha256": first.sha256}):
+            upload = streamed(b"hello")
+            result = self._send(upload=upload, **kwargs)
+            self.assertEqual(result.message.attachment, first)
+            self.assertFalse(first.upload.storage.exists(upload.stored_name))
+
+        # a hash whose stored size differs is not trusted
+        result = self._send(sha256=first.sha256, upload=SimpleUploadedFile("c.txt", b"hello!"))
+        self.assertNotEqual(result.message.attachment, first)
+        with self.assertRaises(GraphQLError):
+            self._send(sha256=first.sha256, size=6)
+
+    def test_unknown_hash_without_upload_is_rejected(self):
+        with self.assertRaises(GraphQLError):
+            self._send(sha256="0" * 64)
+        self.assertFalse(Message.objects.exists())
+
+    def test_cannot_attach_unreadable_version(self):
+        private = File.objects.create(
+            owner=self.stranger, name="p.txt", upload=SimpleUploadedFile("p.txt", b"secret")
+        )
+        version = Version.objects.create(
+            file=private,
+            upload=private.upload.name,
+            sha256=hashlib.sha256(b"secret").hexdigest(),
+            size=6,
+        )
+
+        with self.assertRaises(GraphQLError):
+            self._send(version_id=version.id)
+        with self.assertRaises(GraphQLError):
+            self._send(sha256=version.sha256)
+
+    def test_forwards_attachment_from_another_chat(self):
+        private = File.objects.create(
+            owner=self.stranger, name="p.txt", upload=SimpleUploadedFile("p.txt", b"shown")
+        )
+        version = Version.objects.create(
+            file=private,
+            upload=private.upload.name,
+            sha256=hashlib.sha256(b"shown").hexdigest(),
+            size=5,
+        )
+        elsewhere = Channel.objects.create(channel_type=Channel.PUBLIC)
+        ChannelMembership.objects.create(channel=elsewhere, user=self.stranger)
+        Message.objects.create(channel=elsewhere, sender=self.stranger, attachment=version)
+        with self.assertRaises(GraphQLError):
+            self._send(version_id=version.id)
+
+        # readable once the sender is in the chat it was posted to
+        ChannelMembership.objects.create(channel=elsewhere, user=self.sender)
+        result = self._send(version_id=version.id)
+        self.assertEqual(result.message.attachment, version)
@@ -5,7 +5,13 @@ echo "⏳  Waiting for MySQL (${MYSQL_HOST:-db}:3306)…"
 until mysqladmin ping -h"${MYSQL_HOST:-db}" -P"${MYSQL_PORT:-3306}" --silent; do
     sleep 1
 done
-echo "✅  MySQL is up – running migrations"
+echo "✅  MySQL is up"
 
+# Any other command (e.g. the job worker) runs as-is; migrations belong to the web container
+if [ "$#" -gt 0 ]; then
+    exec "$@"
+fi
+
+echo "⏳  Running migrations"
 python manage.py migrate --noinput
 exec daphne -b 0.0.0.0 -p 8000 vault.asgi:application
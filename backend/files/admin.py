@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import File, Version
+from .models import File, RetentionPolicy, StorageUsage, Version
 
 admin.site.register(File)
 admin.site.register(Version)
+admin.site.register(StorageUsage)
+admin.site.register(RetentionPolicy)
@@ -0,0 +1,119 @@
+"""Reference-aware helpers for the blobs behind ``File.upload``/``Version.upload``."""
+
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from files.models import File, Version
+from files.storage import blob_storage
+from jobs.queue import task
+
+
+def is_referenced(name):
+    """True while any file or version row, trashed or not, still points at the blob."""
+    return (
+        File.all_objects.filter(upload=name).exists()
+        or Version.all_objects.filter(upload=name).exists()
+    )
+
+
+@task(queue="blobs")
+def release(names):
+    """
+    Delete the given blobs from storage unless something still uses them.
+
+    Blob names are shared between rows (``KeepFile`` copies and content
+    dedupe), so a blob only goes once its last reference is gone.
+    """
+    storage = blob_storage()
+    for name in set(names):
+        if name and not is_referenced(name):
+            storage.delete(name)
+
+
+def release_later(names):
+    """
+    Queue the release of blobs for a worker, keeping storage I/O off the
+    request path. The job commits or rolls back with the caller's rows.
+    """
+    names = sorted({name for name in names if name})
+    if names:
+        release.delay(names)
+
+
+def walk(storage, path):
+    """Every file name below ``path`` in ``storage``."""
+    try:
+        dirs, names = storage.listdir(path)
+    except FileNotFoundError:
+        return
+    for name in names:
+        yield f"{path}/{name}"
+    for directory in dirs:
+        yield from walk(storage, f"{path}/{directory}")
+
+
+def find_orphans(grace=timedelta(hours=1), prefix="uploads"):
+    """
+    Mark every blob name a file or version references, then sweep storage
+    for blobs outside that set.
+
+    Blobs modified within ``grace`` are skipped: the streaming upload handler
+    writes bytes before the mutation creates the rows that reference them.
+    """
+    storage = blob_storage()
+    cutoff = timezone.now() - grace
+    marked = set(File.all_objects.values_list("upload", flat=True).iterator())
+    marked.update(Version.all_objects.values_list("upload", flat=True).iterator())
+
+    for name in walk(storage, prefix):
+        if name in marked:
+            continue
+        try:
+            if storage.get_modified_time(name) >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        yield name
+
+
+def _sweep(storage, names, dry_run, report):
+    # references may have appeared since the mark phase (dedupe, KeepFile)
+    live = set(File.all_objects.filter(upload__in=names).values_list("upload", flat=True))
+    live.update(Version.all_objects.filter(upload__in=names).values_list("upload", flat=True))
+    for name in names:
+        if name in live:
+            continue
+        try:
+            size = storage.size(name)
+            if not dry_run:
+                storage.delete(name)
+        except FileNotFoundError:
+            continue
+        report["count"] += 1
+        report["bytes"] += size
+        report["names"].append(name)
+
+
+def collect_orphans(batch_size=100, pause=0.0, grace=timedelta(hours=1), dry_run=False):
+    """
+    Delete blobs no live file or version references, ``batch_size`` at a
+    time with ``pause`` seconds between batches to bound the I/O it causes.
+
+    Returns a report dict with the ``count``, ``bytes`` and ``names`` of the
+    orphans removed (or, with ``dry_run``, that would be).
+    """
+    storage = blob_storage()
+    report = {"count": 0, "bytes": 0, "names": []}
+    batch = []
+    for name in find_orphans(grace=grace):
+        batch.append(name)
+        if len(batch) >= batch_size:
+            _sweep(storage, batch, dry_run, report)
+            batch = []
+            if pause:
+                time.sleep(pause)
+    if batch:
+        _sweep(storage, batch, dry_run, report)
+    return report
@@ -0,0 +1,148 @@
+"""
+Many uploads in one request.
+
+Hashing and storage writes run on a bounded thread pool, since they are I/O
+(and, with the chunked storage, mostly hashing outside the GIL). Everything
+that touches the database stays on the calling thread: one query finds
+content that is already stored, and the rows are inserted in bulk inside a
+single transaction.
+
+MySQL does not report the ids of a multi-row insert. Files are then tagged
+with a temporary ``import_key`` and read back by it, and their versions are
+found again by file, as ``graph.bulk`` does for nodes and edges.
+"""
+
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from files import derivatives, usage
+from files.models import File, Version
+from files.storage import blob_storage
+
+
+def _pool_map(func, items):
+    def run(item):
+        try:
+            return func(item)
+        finally:
+            # storages such as the chunked one query from the worker thread
+            close_old_connections()
+
+    workers = max(1, min(settings.UPLOAD_WRITE_CONCURRENCY, len(items)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload") as pool:
+        return list(pool.map(run, items))
+
+
+def write_blob(upload, twin=None):
+    """
+    Storage name holding the bytes of ``upload``: ``twin`` if that identical
+    blob still exists, the name the streaming handler already wrote to, or a
+    fresh copy written here.
+    """
+    stored = getattr(upload, "stored_name", None)
+    storage = blob_storage()
+    if twin and twin != stored and storage.exists(twin):
+        if stored:
+            storage.delete(stored)
+        return twin
+    if stored:
+        return stored
+    name = File._meta.get_field("upload").generate_filename(None, upload.name)
+    return storage.save(name, upload, max_length=File._meta.get_field("upload").max_length)
+
+
+def store_uploads(uploads, user):
+    """
+    Hash and store ``uploads`` concurrently; return ``(blob name, metadata)``
+    per upload, in order. Identical content, within the batch or already
+    stored, ends up as one blob. Nothing is written when the batch would not
+    fit in the quota of ``user``.
+    """
+    from files.schema import check_quota, upload_metadata
+
+    metadata = _pool_map(upload_metadata, uploads)
+    check_quota(user, sum(m["size"] for m in metadata), uploads)
+    hashes = {m["sha256"] for m in metadata}
+    twins = dict(
+        Version.objects.filter(sha256__in=hashes, delta_base__isnull=True)
+        .exclude(upload="")
+        .values_list("sha256", "upload")
+    )
+
+    leaders = {}
+    for index, m in enumerate(metadata):
+        leaders.setdefault(m["sha256"], index)
+    names = dict(zip(
+        leaders.values(),
+        _pool_map(lambda i: write_blob(uploads[i], twins.get(metadata[i]["sha256"])), list(leaders.values())),
+    ))
+
+    storage = blob_storage()
+    results = []
+    for index, (upload, m) in enumerate(zip(uploads, metadata)):
+        name = names[leaders[m["sha256"]]]
+        stored = getattr(upload, "stored_name", None)
+        if stored and stored != name:
+            storage.delete(stored)
+        results.append((name, m))
+    return results
+
+
+def _insert_files(files):
+    if connection.features.can_return_rows_from_bulk_insert:
+        return File.objects.bulk_create(files)
+    token = uuid.uuid4().hex
+    for i, file in enumerate(files):
+        file.import_key = f"{token}:{i}"
+    File.objects.bulk_create(files)
+    ids = dict(File.all_objects.filter(import_key__startswith=f"{token}:").values_list("import_key", "pk"))
+    for file in files:
+        file.pk = ids[file.import_key]
+        file.import_key = None
+    File.all_objects.filter(pk__in=ids.values()).update(import_key=None)
+    return files
+
+
+def _insert_versions(versions):
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Version.objects.bulk_create(versions)
+    Version.objects.bulk_create(versions)
+    # every file is new and has exactly this one version
+    ids = dict(
+        Version.all_objects.filter(file_id__in=[v.file_id for v in versions]).values_list("file_id", "pk")
+    )
+    for version in versions:
+        version.pk = ids[version.file_id]
+    return versions
+
+
+def create_files(owner, stored, node=None):
+    """
+    Insert a ``File`` with an initial ``Version`` for every ``(name, blob,
+    metadata)`` triple, linking them to ``node`` if given. Returns the files
+    and versions in order.
+    """
+    from graph.models import NodeFile
+    from vault.subscriptions import FileUpdates, NodeUpdates
+
+    with transaction.atomic():
+        files = _insert_files([File(owner=owner, name=name, upload=blob) for name, blob, _ in stored])
+        versions = _insert_versions([
+            Version(file=file, upload=blob, note="Initial upload", **metadata)
+            for file, (_, blob, metadata) in zip(files, stored)
+        ])
+        # bulk_create skips the per-row signals; notify once instead
+        transaction.on_commit(lambda: FileUpdates.notify(owner.pk))
+        if node is not None:
+            NodeFile.objects.bulk_create([NodeFile(node=node, file=file) for file in files])
+            transaction.on_commit(lambda: NodeUpdates.notify(node.pk))
+        usage.versions_added([version.pk for version in versions])
+        scheduled = set()
+        for version in versions:
+            if version.sha256 not in scheduled:
+                scheduled.add(version.sha256)
+                derivatives.schedule(version)
+    return files, versions
@@ -0,0 +1,108 @@
+"""Size-bounded LRU cache of generated files on local disk."""
+
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+# a full scan of a cache directory at least this often, in seconds
+SCAN_INTERVAL = 5 * 60
+
+# directory -> [estimated bytes, monotonic time of the last scan], per process
+_scans = {}
+
+
+class DiskCache:
+    """
+    Files keyed by a string, evicted least-recently-used once the directory
+    grows past ``max_bytes``.
+
+    Recency is tracked through the file mtime, which ``open`` refreshes, so
+    the cache keeps working on filesystems mounted with ``noatime``.
+
+    Writes do not scan the directory. Each process keeps an estimate of its
+    size from the last scan plus what it wrote since, and scans again once
+    that estimate passes the limit or ``SCAN_INTERVAL`` has gone by, which
+    catches up with what other processes wrote.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def open(self, key):
+        """Open a cached entry for reading, or return ``None`` on a miss."""
+        path = self.path(key)
+        try:
+            fh = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return fh
+
+    @contextmanager
+    def writer(self, key):
+        """
+        Write a new entry. It only becomes visible once the block exits
+        cleanly; partial writes (errors, abandoned generators) are discarded.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        fh = open(tmp, "wb")
+        try:
+            yield fh
+        except BaseException:
+            fh.close()
+            os.unlink(tmp)
+            raise
+        size = fh.tell()
+        fh.close()
+        os.replace(tmp, path)
+        self._written(size)
+
+    def _written(self, size):
+        now = time.monotonic()
+        scan = _scans.get(self.directory)
+        if scan is None or scan[0] + size > self.max_bytes or now - scan[1] > SCAN_INTERVAL:
+            _scans[self.directory] = [self.prune(), now]
+        else:
+            scan[0] += size
+
+    def prune(self):
+        """
+        Evict the least recently used entries until under the size limit;
+        returns the bytes left in the cache.
+        """
+        entries = []
+        total = 0
+        for root, _dirs, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        if total <= self.max_bytes:
+            return total
+        # drop a little extra so every write past the limit doesn't re-scan
+        target = self.max_bytes * 0.9
+        for _mtime, size, path in sorted(entries):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            if total <= target:
+                break
+        return total
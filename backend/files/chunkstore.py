@@ -0,0 +1,334 @@
+"""
+Content-defined chunk storage for file blobs.
+
+``ChunkedStorage`` cuts every saved blob into variable-size chunks with the
+FastCDC gear hash, stores each distinct chunk once under ``chunks/`` and
+writes a small JSON manifest in place of the blob. Near-identical versions of
+large files (VM images, datasets, archives) then share nearly all of their
+chunks. Chunks are reference counted in the ``Chunk`` table; ``delete`` only
+drops references and ``manage.py gc_chunks`` removes chunks nobody uses.
+"""
+
+import bisect
+import hashlib
+import io
+import json
+import random
+
+import numpy as np
+from django.conf import settings
+from django.core.files.base import ContentFile, File as DjangoFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.urls import reverse
+from django.utils.deconstruct import deconstructible
+
+MIN_CHUNK = 16 * 1024
+AVG_CHUNK = 64 * 1024
+MAX_CHUNK = 256 * 1024
+READ_SIZE = 4 * MAX_CHUNK
+
+MANIFEST_FORMAT = "vault-chunks/1"
+
+_MASK64 = (1 << 64) - 1
+# normalized chunking: harder to cut before the average size, easier after;
+# masks sit in the high bits, which depend on the last 64 bytes of input
+_MASK_S = ((1 << 18) - 1) << (64 - 18)
+_MASK_L = ((1 << 14) - 1) << (64 - 14)
+# fixed seed so chunk boundaries are identical in every process
+_gear_rng = random.Random(0x5EED)
+_GEAR = [_gear_rng.getrandbits(64) for _ in range(256)]
+_GEAR_TABLE = np.array(_GEAR, dtype=np.uint64)
+# bytes that make up a gear hash; shifts past 64 bits fall off
+_WINDOW = 64
+
+
+# ── Chunking ─────────────────────────────────────────────────────────────────
+
+def _candidates(data):
+    """
+    Positions in ``data`` where a cut is allowed under the strict and the
+    loose mask, as two sorted arrays.
+
+    The gear hash at each position only depends on the ``_WINDOW`` bytes
+    ending there, so it is built for the whole buffer at once by doubling:
+    the hash over ``2m`` bytes is the hash over the last ``m`` plus the one
+    over the ``m`` before, shifted by ``m``. Uint64 arithmetic wraps like the
+    masked Python integers would.
+    """
+    h = _GEAR_TABLE[np.frombuffer(data, dtype=np.uint8)]
+    width = 1
+    while width < _WINDOW:
+        h[width:] += h[:-width] << np.uint64(width)
+        width *= 2
+    return (
+        np.flatnonzero((h & np.uint64(_MASK_S)) == 0),
+        np.flatnonzero((h & np.uint64(_MASK_L)) == 0),
+    )
+
+
+def _cut_point(data, start, end, candidates):
+    """Length of the next chunk in ``data[start:end]``, given ``_candidates(data)``."""
+    length = end - start
+    if length <= MIN_CHUNK:
+        return length
+    limit = min(length, MAX_CHUNK)
+    normal = min(AVG_CHUNK, limit)
+    # the hash restarts at MIN_CHUNK, so its first bytes see a shorter window
+    gear, h, i = _GEAR, 0, MIN_CHUNK
+    while i < min(MIN_CHUNK + _WINDOW - 1, limit):
+        h = ((h << 1) + gear[data[start + i]]) & _MASK64
+        if not h & (_MASK_S if i < normal else _MASK_L):
+            return i + 1
+        i += 1
+    for positions, stop in zip(candidates, (normal, limit)):
+        index = np.searchsorted(positions, start + i)
+        if index < len(positions) and positions[index] < start + stop:
+            return int(positions[index]) - start + 1
+        i = max(i, stop)
+    return limit
+
+
+def iter_chunks(fileobj):
+    """Yield the content-defined chunks of a readable file object."""
+    buf = b""
+    pos = 0
+    eof = False
+    candidates = None
+    while True:
+        if not eof and len(buf) - pos < MAX_CHUNK:
+            data = fileobj.read(READ_SIZE)
+            if data:
+                # one copy of the unchunked tail per read, not per chunk
+                buf = buf[pos:] + data
+                pos = 0
+                candidates = None
+                continue
+            eof = True
+        if pos >= len(buf):
+            return
+        if candidates is None:
+            candidates = _candidates(buf)
+        cut = _cut_point(buf, pos, len(buf), candidates)
+        yield buf[pos:pos + cut]
+        pos += cut
+
+
+# ── Reading ──────────────────────────────────────────────────────────────────
+
+class _ManifestReader(io.RawIOBase):
+    """Seekable raw stream over the chunks listed in a manifest."""
+
+    def __init__(self, chunks, open_chunk):
+        self._chunks = chunks
+        self._open_chunk = open_chunk
+        self._starts = []
+        offset = 0
+        for _digest, size in chunks:
+            self._starts.append(offset)
+            offset += size
+        self.size = offset
+        self._pos = 0
+        self._current = (None, b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position.")
+        self._pos = offset
+        return self._pos
+
+    def _chunk(self, index):
+        if self._current[0] != index:
+            self._current = (index, self._open_chunk(self._chunks[index][0]))
+        return self._current[1]
+
+    def readinto(self, buffer):
+        if self._pos >= self.size:
+            return 0
+        index = bisect.bisect_right(self._starts, self._pos) - 1
+        data = self._chunk(index)
+        skip = self._pos - self._starts[index]
+        piece = data[skip:skip + len(buffer)]
+        buffer[:len(piece)] = piece
+        self._pos += len(piece)
+        return len(piece)
+
+
+# ── Storage ──────────────────────────────────────────────────────────────────
+
+@deconstructible
+class ChunkedStorage(Storage):
+    """
+    Storage backend that keeps blobs as chunk manifests over a shared,
+    deduplicated chunk pool. Chunks and manifests live in ``inner``, a plain
+    filesystem storage under ``MEDIA_ROOT`` by default.
+    """
+
+    chunk_prefix = "chunks"
+
+    def __init__(self, location=None, inner=None):
+        self._location = location
+        self._inner = inner
+
+    @property
+    def inner(self):
+        if self._inner is None:
+            self._inner = FileSystemStorage(location=self._location or settings.MEDIA_ROOT)
+        return self._inner
+
+    def chunk_name(self, digest):
+        return f"{self.chunk_prefix}/{digest[:2]}/{digest[2:4]}/{digest}"
+
+    # -- manifests --
+
+    def read_manifest(self, name):
+        with self.inner.open(name, "rb") as fh:
+            manifest = json.load(fh)
+        if manifest.get("format") != MANIFEST_FORMAT:
+            raise ValueError(f"{name} is not a chunk manifest.")
+        return manifest
+
+    def _add_chunk(self, data):
+        from files.models import Chunk
+
+        digest = hashlib.sha256(data).hexdigest()
+        while True:
+            if Chunk.objects.filter(pk=digest).update(refcount=F("refcount") + 1):
+                return digest
+            try:
+                with transaction.atomic():
+                    Chunk.objects.create(sha256=digest, size=len(data), refcount=1)
+                    # written while the new row is uncommitted, so a concurrent
+                    # gc_chunks cannot be deleting the same chunk file
+                    name = self.chunk_name(digest)
+                    if self.inner.exists(name):
+                        self.inner.delete(name)
+                    self.inner.save(name, ContentFile(data))
+                return digest
+            except IntegrityError:
+                # another writer created it first; take a reference instead
+                continue
+
+    def release_chunks(self, digests):
+        from files.models import Chunk
+
+        for digest in digests:
+            Chunk.objects.filter(pk=digest, refcount__gt=0).update(refcount=F("refcount") - 1)
+
+    # -- Storage API --
+
+    def _save(self, name, content):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        chunks = []
+        size = 0
+        try:
+            for data in iter_chunks(content):
+                chunks.append([self._add_chunk(data), len(data)])
+                size += len(data)
+            manifest = {"format": MANIFEST_FORMAT, "size": size, "chunks": chunks}
+            return self.inner.save(name, ContentFile(json.dumps(manifest).encode()))
+        except Exception:
+            # no manifest will point at the chunks taken so far
+            self.release_chunks([digest for digest, _size in chunks])
+            raise
+
+    def _open(self, name, mode="rb"):
+        if "w" in mode or "a" in mode:
+            raise ValueError("Chunked blobs are read-only; save a new blob instead.")
+        manifest = self.read_manifest(name)
+
+        def open_chunk(digest):
+            with self.inner.open(self.chunk_name(digest), "rb") as fh:
+                return fh.read()
+
+        reader = _ManifestReader(manifest["chunks"], open_chunk)
+        fh = DjangoFile(io.BufferedReader(reader, buffer_size=AVG_CHUNK), name)
+        fh.size = reader.size
+        return fh
+
+    def delete(self, name):
+        if not self.inner.exists(name):
+            return
+        try:
+            digests = [digest for digest, _size in self.read_manifest(name)["chunks"]]
+        except ValueError:
+            digests = []
+        self.inner.delete(name)
+        self.release_chunks(digests)
+
+    def exists(self, name):
+        return self.inner.exists(name)
+
+    def size(self, name):
+        return self.read_manifest(name)["size"]
+
+    def listdir(self, path):
+        return self.inner.listdir(path)
+
+    def get_available_name(self, name, max_length=None):
+        return self.inner.get_available_name(name, max_length=max_length)
+
+    def get_valid_name(self, name):
+        return self.inner.get_valid_name(name)
+
+    def get_accessed_time(self, name):
+        return self.inner.get_accessed_time(name)
+
+    def get_created_time(self, name):
+        return self.inner.get_created_time(name)
+
+    def get_modified_time(self, name):
+        return self.inner.get_modified_time(name)
+
+    def url(self, name):
+        return reverse("files:blob", args=[name])
+
+
+def collect_chunks(storage=None, batch_size=500, dry_run=False):
+    """
+    Remove chunks whose reference count dropped to zero.
+
+    Each chunk row is locked while its file is deleted so a concurrent save
+    that wants to reuse it waits and then writes a fresh copy.
+    Returns ``(count, bytes)`` of chunks removed (or that would be).
+    """
+    from files.models import Chunk
+
+    if dry_run:
+        totals = Chunk.objects.filter(refcount=0).aggregate(count=Count("pk"), size=Sum("size"))
+        return totals["count"], totals["size"] or 0
+
+    storage = storage or ChunkedStorage()
+    removed = freed = 0
+    while True:
+        digests = list(
+            Chunk.objects.filter(refcount=0)
+            .order_by("sha256")
+            .values_list("sha256", flat=True)[:batch_size]
+        )
+        for digest in digests:
+            with transaction.atomic():
+                chunk = Chunk.objects.select_for_update().filter(pk=digest, refcount=0).first()
+                if not chunk:
+                    continue
+                storage.inner.delete(storage.chunk_name(digest))
+                chunk.delete()
+                removed += 1
+                freed += chunk.size
+        if len(digests) < batch_size:
+            return removed, freed
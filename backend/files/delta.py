@@ -0,0 +1,388 @@
+"""
+Delta-compressed version storage.
+
+Files in ``File.DELTA`` mode keep their newest version whole and store older
+versions as binary deltas against the next newer one, so a long edit history
+costs roughly one full copy plus the changed bytes. Deltas are computed the
+rsync way: the base is cut into fixed blocks indexed by a weak rolling
+Adler-32 and a strong MD5, and the target is scanned byte by byte for blocks
+it can copy instead of storing. The scan runs in Python at a few MB/s, so
+versions above ``DELTA_MAX_BYTES`` are kept whole.
+
+Reconstruction streams; reconstructed versions are kept in a bounded LRU disk
+cache so a chain of deltas is only replayed once.
+"""
+
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+
+from django.conf import settings
+from django.core.files.base import File as DjangoFile
+from django.db import transaction
+from django.db.models import Q
+
+from files import blobs
+from files.cache import DiskCache
+from files.models import File, Version
+from jobs.queue import task
+
+MAGIC = b"VDELTA1\n"
+BLOCK_SIZE = 4096
+READ_SIZE = 1 << 20
+MAX_LITERAL = 1 << 20
+STREAM_CHUNK = 64 * 1024
+
+# keep a version whole when its delta would not save at least this much
+MIN_SAVING = 0.5
+
+_MOD = 65521
+_COPY = b"C"
+_INSERT = b"I"
+_COPY_STRUCT = struct.Struct(">QI")
+_LEN_STRUCT = struct.Struct(">I")
+
+
+# ── Codec ────────────────────────────────────────────────────────────────────
+
+def _signature(base, block_size):
+    """Map weak checksum → {strong digest: offset} for every full base block."""
+    table = {}
+    offset = 0
+    while True:
+        block = base.read(block_size)
+        if len(block) < block_size:
+            break
+        table.setdefault(zlib.adler32(block), {}).setdefault(hashlib.md5(block).digest(), offset)
+        offset += block_size
+    return table
+
+
+class _OpWriter:
+    """Serialises copy/insert operations, merging adjacent copies."""
+
+    def __init__(self, out):
+        self.out = out
+        self.out.write(MAGIC)
+        self.copy_offset = None
+        self.copy_length = 0
+
+    def copy(self, offset, length):
+        if self.copy_offset is not None and self.copy_offset + self.copy_length == offset:
+            self.copy_length += length
+            return
+        self._flush_copy()
+        self.copy_offset, self.copy_length = offset, length
+
+    def insert(self, data):
+        if not data:
+            return
+        self._flush_copy()
+        self.out.write(_INSERT + _LEN_STRUCT.pack(len(data)))
+        self.out.write(data)
+
+    def _flush_copy(self):
+        if self.copy_offset is not None:
+            self.out.write(_COPY + _COPY_STRUCT.pack(self.copy_offset, self.copy_length))
+            self.copy_offset = None
+
+    def finish(self):
+        self._flush_copy()
+
+
+def diff(base, target, out, block_size=BLOCK_SIZE):
+    """
+    Write a delta turning ``base`` into ``target`` to ``out``.
+
+    ``base`` is read once to build block signatures; ``target`` is streamed
+    with a bounded buffer, so memory stays proportional to the block index
+    rather than to the file sizes.
+    """
+    table = _signature(base, block_size)
+    writer = _OpWriter(out)
+    buf = bytearray()
+    start = lit = 0
+    eof = False
+    a = b = None
+
+    while True:
+        if not eof and len(buf) - start <= block_size:
+            # drop bytes already emitted, keep the pending literal run
+            del buf[:lit]
+            start -= lit
+            lit = 0
+            chunk = target.read(READ_SIZE)
+            if chunk:
+                buf += chunk
+            else:
+                eof = True
+            continue
+        if len(buf) - start < block_size:
+            break
+
+        if a is None:
+            weak = zlib.adler32(buf[start:start + block_size])
+            a, b = weak & 0xFFFF, weak >> 16
+        candidates = table.get((b << 16) | a)
+        if candidates:
+            offset = candidates.get(hashlib.md5(buf[start:start + block_size]).digest())
+            if offset is not None:
+                writer.insert(bytes(buf[lit:start]))
+                writer.copy(offset, block_size)
+                start += block_size
+                lit = start
+                a = None
+                continue
+
+        if len(buf) - start == block_size:
+            # at end of input with nothing left to roll in
+            break
+        out_byte, in_byte = buf[start], buf[start + block_size]
+        a = (a - out_byte + in_byte) % _MOD
+        b = (b - block_size * out_byte + a - 1) % _MOD
+        start += 1
+        if start - lit >= MAX_LITERAL:
+            writer.insert(bytes(buf[lit:start]))
+            lit = start
+
+    writer.insert(bytes(buf[lit:]))
+    writer.finish()
+
+
+def patch(base, delta, chunk_size=STREAM_CHUNK):
+    """Yield the target bytes described by ``delta`` applied to seekable ``base``."""
+    if delta.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a version delta.")
+    while True:
+        op = delta.read(1)
+        if not op:
+            return
+        if op == _COPY:
+            offset, length = _COPY_STRUCT.unpack(delta.read(_COPY_STRUCT.size))
+            base.seek(offset)
+            source = base
+        elif op == _INSERT:
+            (length,) = _LEN_STRUCT.unpack(delta.read(_LEN_STRUCT.size))
+            source = delta
+        else:
+            raise ValueError("Corrupt version delta.")
+        while length:
+            data = source.read(min(length, chunk_size))
+            if not data:
+                raise ValueError("Truncated version delta.")
+            length -= len(data)
+            yield data
+
+
+# ── Reconstruction ───────────────────────────────────────────────────────────
+
+def _cache():
+    return DiskCache(settings.VERSION_CACHE_DIR, settings.VERSION_CACHE_MAX_BYTES)
+
+
+def _cache_key(version):
+    return f"{version.sha256 or 'v'}-{version.pk}"
+
+
+def iter_version(version, chunk_size=STREAM_CHUNK):
+    """Stream the full content of a version, replaying deltas when needed."""
+    if version.delta_base_id is None:
+        with version.upload.storage.open(version.upload.name, "rb") as fh:
+            yield from iter(lambda: fh.read(chunk_size), b"")
+        return
+
+    cache = _cache()
+    key = _cache_key(version)
+    cached = cache.open(key)
+    if cached is not None:
+        with cached:
+            yield from iter(lambda: cached.read(chunk_size), b"")
+        return
+
+    with cache.writer(key) as sink, open_version(version.delta_base) as base, \
+            version.upload.storage.open(version.upload.name, "rb") as delta:
+        for data in patch(base, delta, chunk_size):
+            sink.write(data)
+            yield data
+
+
+def open_version(version):
+    """Seekable file object with the full content of a version."""
+    if version.delta_base_id is None:
+        return version.upload.storage.open(version.upload.name, "rb")
+    cache = _cache()
+    key = _cache_key(version)
+    cached = cache.open(key)
+    if cached is None:
+        for _ in iter_version(version):
+            pass
+        cached = cache.open(key)
+    if cached is None:
+        # evicted straight away by a tiny cache; fall back to a private copy
+        cached = tempfile.TemporaryFile()
+        for data in iter_version(version):
+            cached.write(data)
+        cached.seek(0)
+    return cached
+
+
+# ── Storage policy ───────────────────────────────────────────────────────────
+
+def _stem(version):
+    name = os.path.basename(version.upload.name)
+    return name[: -len(".vdelta")] if name.endswith(".vdelta") else name
+
+
+def _write_delta(version, base):
+    """
+    Save a delta of ``version`` against ``base`` as its upload without
+    touching the row; False, with nothing written, if not worth it.
+    """
+    if max(version.size or 0, base.size or 0) > settings.DELTA_MAX_BYTES:
+        # too slow to diff on a worker; stays whole
+        return False
+    with tempfile.TemporaryFile() as delta:
+        with open_version(base) as base_fh, open_version(version) as target_fh:
+            diff(base_fh, target_fh, delta)
+        if version.size and delta.tell() > version.size * MIN_SAVING:
+            return False
+        delta.seek(0)
+        # re-deltaed against a new base keeps its original name
+        version.upload.save(_stem(version) + ".vdelta", DjangoFile(delta), save=False)
+    return True
+
+
+def _write_whole(version):
+    """Save the full content of ``version`` as its upload without touching the row."""
+    with open_version(version) as fh:
+        version.upload.save(_stem(version), DjangoFile(fh), save=False)
+
+
+def _store_delta(version, base):
+    """
+    Replace a version's whole blob with a delta against ``base``; False if
+    not worth it. The old blob is released once the new row has committed.
+    """
+    old_name = version.upload.name
+    if not _write_delta(version, base):
+        return False
+    version.delta_base = base
+    version.save(update_fields=["upload", "delta_base"])
+    blobs.release_later([old_name])
+    return True
+
+
+def compact_previous(head):
+    """
+    Turn the version before a freshly added ``head`` into a delta.
+
+    Every ``delta_rebase_every``-th version of a file stays whole as a
+    keyframe, which bounds how many deltas a reconstruction has to replay.
+    """
+    file = head.file
+    if file.version_storage != File.DELTA:
+        return None
+    older = list(
+        file.versions.exclude(pk=head.pk)
+        .filter(created_at__lte=head.created_at)
+        .order_by("created_at", "id")
+    )
+    if not older:
+        return None
+    previous = older[-1]
+    if previous.delta_base_id is not None:
+        return None
+    rebase_every = max(file.delta_rebase_every, 1)
+    if (len(older) - 1) % rebase_every == 0:
+        return None
+    return previous if _store_delta(previous, head) else None
+
+
+@task(queue="versions")
+def compact_after(version_id):
+    """
+    ``compact_previous`` for the version with ``version_id``, run by a
+    worker. The file's row stays locked meanwhile, so compactions of one
+    file never overlap, whichever workers run them.
+    """
+    file_id = Version.objects.filter(pk=version_id).values_list("file_id", flat=True).first()
+    if file_id is None:
+        return
+    with transaction.atomic():
+        File.objects.select_for_update().filter(pk=file_id).first()
+        # read after the lock, so an earlier compaction's result is seen
+        head = Version.objects.select_related("file").filter(pk=version_id).first()
+        if head is not None:
+            compact_previous(head)
+
+
+def materialize(version):
+    """Store a delta version whole again, detaching it from its base."""
+    if version.delta_base_id is None:
+        return version
+    old_name = version.upload.name
+    _write_whole(version)
+    version.delta_base = None
+    version.save(update_fields=["upload", "delta_base"])
+    blobs.release_later([old_name])
+    return version
+
+
+def detach_dependents(versions):
+    """
+    Materialize deltas that use any of ``versions`` as their base and are not
+    themselves among them. Call before deleting individual versions.
+    """
+    ids = {v.pk for v in versions}
+    for child in Version.all_objects.filter(delta_base_id__in=ids).exclude(pk__in=ids):
+        materialize(child)
+
+
+def plan_rebase(version_ids):
+    """
+    Prepare the deltas based on ``version_ids`` (and not among them) for
+    those versions going away: re-delta each against the nearest newer
+    version that stays, so pruning the middle of a chain does not turn its
+    older deltas back into full copies, or else store it whole.
+
+    Only the new blobs are written, so this needs no lock however long the
+    diffs take. Returns plans for ``apply_rebase``.
+    """
+    ids = set(version_ids)
+    plans = []
+    for child in Version.all_objects.filter(delta_base_id__in=ids).exclude(pk__in=ids):
+        old_name, old_base_id = child.upload.name, child.delta_base_id
+        base = (
+            Version.objects.filter(file_id=child.file_id)
+            .filter(Q(created_at__gt=child.created_at) | Q(created_at=child.created_at, pk__gt=child.pk))
+            .exclude(pk__in=ids)
+            .order_by("created_at", "id")
+            .first()
+        )
+        if base is not None and _write_delta(child, base):
+            new_base_id = base.pk
+        else:
+            _write_whole(child)
+            new_base_id = None
+        plans.append((child.pk, old_name, old_base_id, child.upload.name, new_base_id))
+    return plans
+
+
+def apply_rebase(plans):
+    """
+    Switch the versions planned by ``plan_rebase`` to their new blobs. Call
+    with the file's row locked. A version whose blob or base changed since,
+    or whose new base is gone, keeps what it has and the new blob is
+    dropped; returns how many were switched.
+    """
+    switched = 0
+    for pk, old_name, old_base_id, new_name, new_base_id in plans:
+        done = (new_base_id is None or Version.all_objects.filter(pk=new_base_id).exists()) and (
+            Version.all_objects.filter(pk=pk, upload=old_name, delta_base_id=old_base_id)
+            .update(upload=new_name, delta_base_id=new_base_id)
+        )
+        blobs.release_later([old_name if done else new_name])
+        switched += bool(done)
+    return switched
@@ -0,0 +1,319 @@
+"""
+Thumbnails, PDF first-page previews and text snippets of version content.
+
+Derivatives are stored in the blob storage under the content hash, so
+every version, ``KeepFile`` copy and chat attachment with the same bytes
+shares one set. A worker generates them after upload; the thumbnail view
+generates them on a miss. ``Version.has_thumbnails`` records that they
+exist, so listing previews costs no storage round trip per version.
+
+Arbitrary widths for avatars and previews are resized on request instead
+and kept in a bounded LRU disk cache (``RESIZE_CACHE_DIR``).
+"""
+
+import io
+import logging
+import time
+from datetime import timedelta
+
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import OuterRef, Subquery
+from django.urls import reverse
+from django.utils import timezone
+
+from files.blobs import walk
+from files.cache import DiskCache
+from files.delta import open_version
+from files.models import Version
+from files.storage import blob_storage
+from jobs.queue import task
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "derivatives"
+THUMBNAIL_SIZES = (64, 256, 1024)
+SNIPPET_CHARS = 500
+
+# widths requested from the resize endpoint are rounded up to one of these
+RESIZE_WIDTHS = (16, 32, 48, 64, 96, 128, 256, 512, 1024, 2048)
+RESIZE_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+
+_TEXT_TYPES = {"application/json", "application/xml", "application/javascript"}
+
+
+def preview_kind(content_type):
+    """``"image"``, ``"pdf"`` or ``"text"`` for content we can preview, else ``None``."""
+    content_type = content_type or ""
+    if content_type.startswith("image/") and content_type != "image/svg+xml":
+        return "image"
+    if content_type == "application/pdf":
+        return "pdf"
+    if content_type.startswith("text/") or content_type in _TEXT_TYPES:
+        return "text"
+    return None
+
+
+def _snap(requested, sizes):
+    for size in sizes:
+        if size >= requested:
+            return size
+    return sizes[-1]
+
+
+def thumbnail_size(requested):
+    """The smallest fixed size at least as large as ``requested``."""
+    return _snap(requested, THUMBNAIL_SIZES)
+
+
+def resize_width(requested):
+    """The smallest supported resize width at least as large as ``requested``."""
+    return _snap(requested, RESIZE_WIDTHS)
+
+
+def thumbnail_name(sha256, size):
+    return f"{PREFIX}/{sha256[:2]}/{sha256}/thumb-{size}.webp"
+
+
+def snippet_name(sha256):
+    return f"{PREFIX}/{sha256[:2]}/{sha256}/snippet.txt"
+
+
+def _save(name, data):
+    storage = blob_storage()
+    if storage.exists(name):
+        return
+    saved = storage.save(name, ContentFile(data))
+    if saved != name:
+        # another generator got there first
+        storage.delete(saved)
+
+
+# ── Generation ───────────────────────────────────────────────────────────────
+
+def _open_image(version, largest=THUMBNAIL_SIZES[-1]):
+    from PIL import Image, ImageOps
+
+    with open_version(version) as fh:
+        if preview_kind(version.content_type) == "pdf":
+            import pypdfium2
+
+            pdf = pypdfium2.PdfDocument(fh.read())
+            try:
+                page = pdf[0]
+                image = page.render(scale=largest / max(page.get_size())).to_pil()
+            finally:
+                pdf.close()
+        else:
+            image = Image.open(fh)
+            # lets JPEG decode straight at a reduced scale
+            image.draft("RGB", (largest, largest))
+            image.load()
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info or "A" in image.getbands() else "RGB")
+    return image
+
+
+def _mark_thumbnails(sha256):
+    # every version with these bytes shares the thumbnails
+    Version.all_objects.filter(sha256=sha256, has_thumbnails=False).update(has_thumbnails=True)
+
+
+def _generate_thumbnails(version):
+    storage = blob_storage()
+    missing = [s for s in THUMBNAIL_SIZES if not storage.exists(thumbnail_name(version.sha256, s))]
+    if not missing:
+        _mark_thumbnails(version.sha256)
+        return True
+    try:
+        image = _open_image(version)
+    except Exception:
+        # undecodable, truncated, encrypted or oversized (decompression bomb)
+        logger.warning("Cannot render a preview of version %s", version.pk, exc_info=True)
+        return False
+    for size in sorted(missing, reverse=True):
+        image.thumbnail((size, size))
+        out = io.BytesIO()
+        image.save(out, "WEBP", quality=80)
+        _save(thumbnail_name(version.sha256, size), out.getvalue())
+    _mark_thumbnails(version.sha256)
+    return True
+
+
+def _generate_snippet(version):
+    name = snippet_name(version.sha256)
+    if not blob_storage().exists(name):
+        with open_version(version) as fh:
+            # UTF-8 needs at most four bytes per character
+            text = fh.read(SNIPPET_CHARS * 4).decode("utf-8", errors="replace")[:SNIPPET_CHARS]
+        _save(name, text.encode("utf-8"))
+    return True
+
+
+def generate(version):
+    """Create whatever derivatives of ``version`` are missing; False if it has none."""
+    kind = preview_kind(version.content_type)
+    if not kind or not version.sha256:
+        return False
+    if kind == "text":
+        return _generate_snippet(version)
+    return _generate_thumbnails(version)
+
+
+@task(queue="derivatives")
+def generate_for(version_id):
+    version = Version.all_objects.filter(pk=version_id).first()
+    if version is not None:
+        generate(version)
+
+
+def schedule(version):
+    """Queue derivative generation unless identical content already has them."""
+    kind = preview_kind(version.content_type)
+    if not kind or not version.sha256:
+        return
+    done = (
+        snippet_name(version.sha256) if kind == "text"
+        else thumbnail_name(version.sha256, THUMBNAIL_SIZES[-1])
+    )
+    if not blob_storage().exists(done):
+        generate_for.delay(version.pk)
+    elif kind != "text":
+        _mark_thumbnails(version.sha256)
+        version.has_thumbnails = True
+
+
+# ── Lookup ───────────────────────────────────────────────────────────────────
+
+def thumbnail_url(version, requested, request):
+    """
+    Absolute URL of a thumbnail of about ``requested`` pixels, or ``None`` if
+    the content has no visual preview. Thumbnails not generated yet point at
+    the view that generates them.
+    """
+    if preview_kind(version.content_type) not in ("image", "pdf") or not version.sha256:
+        return None
+    size = thumbnail_size(requested)
+    if version.has_thumbnails:
+        return request.build_absolute_uri(blob_storage().url(thumbnail_name(version.sha256, size)))
+    return request.build_absolute_uri(reverse("files:version-thumbnail", args=[version.pk, size]))
+
+
+def text_snippet(version):
+    """The first ``SNIPPET_CHARS`` characters of text content, or ``None``."""
+    if preview_kind(version.content_type) != "text" or not version.sha256:
+        return None
+    _generate_snippet(version)
+    with blob_storage().open(snippet_name(version.sha256), "rb") as fh:
+        return fh.read().decode("utf-8")
+
+
+# ── On-the-fly resizing ──────────────────────────────────────────────────────
+
+def _resize_cache():
+    return DiskCache(settings.RESIZE_CACHE_DIR, settings.RESIZE_CACHE_MAX_BYTES)
+
+
+def version_tag(version):
+    """Short token that changes whenever the content behind a URL does."""
+    return (version.sha256 or f"v{version.pk}")[:12]
+
+
+def resized(version, width, fmt="webp"):
+    """
+    Readable file with the version scaled down to ``width`` pixels across in
+    format ``fmt``, rendered into the LRU cache on a miss. ``None`` if the
+    content is not an image or cannot be decoded.
+    """
+    from PIL import Image
+
+    if preview_kind(version.content_type) not in ("image", "pdf"):
+        return None
+    key = f"{version.sha256 or f'v{version.pk}'}-{width}.{fmt}"
+    cache = _resize_cache()
+    cached = cache.open(key)
+    if cached is not None:
+        return cached
+    try:
+        image = _open_image(version, largest=width)
+    except Exception:
+        logger.warning("Cannot resize version %s", version.pk, exc_info=True)
+        return None
+    if image.width > width:
+        image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+    pil_format, _content_type = RESIZE_FORMATS[fmt]
+    if pil_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    out = io.BytesIO()
+    image.save(out, pil_format, **({"quality": 85} if pil_format != "PNG" else {"optimize": True}))
+    with cache.writer(key) as sink:
+        sink.write(out.getvalue())
+    out.seek(0)
+    return out
+
+
+def with_latest_version(files):
+    """
+    Annotate a ``File`` queryset with what ``resize_url`` needs of each
+    file's newest version, so lists of avatars do not query it per file.
+    """
+    newest = Version.objects.filter(file_id=OuterRef("pk")).order_by("-created_at", "-id")
+    return files.annotate(
+        latest_version_id=Subquery(newest.values("pk")[:1]),
+        latest_sha256=Subquery(newest.values("sha256")[:1]),
+        latest_content_type=Subquery(newest.values("content_type")[:1]),
+    )
+
+
+def resize_url(file, width, request, fmt="webp"):
+    """
+    Absolute URL of the latest version of ``file`` resized to about ``width``
+    pixels, or ``None`` when it is not an image.
+    """
+    if hasattr(file, "latest_version_id"):
+        latest = file.latest_version_id and Version(
+            pk=file.latest_version_id, sha256=file.latest_sha256, content_type=file.latest_content_type
+        )
+    else:
+        latest = file.versions.order_by("-created_at", "-id").first()
+    if latest is None or preview_kind(latest.content_type) not in ("image", "pdf"):
+        return None
+    query = urlencode({"w": resize_width(width), "fmt": fmt, "v": version_tag(latest)})
+    return request.build_absolute_uri(f"{reverse('media-resize', args=[file.pk])}?{query}")
+
+
+# ── Cleanup ──────────────────────────────────────────────────────────────────
+
+def collect_orphans(grace=timedelta(hours=1), pause=0.0, dry_run=False):
+    """
+    Delete derivatives of content no version has any more. Returns a report
+    dict like ``blobs.collect_orphans``.
+    """
+    cutoff = timezone.now() - grace
+    live = set(Version.all_objects.exclude(sha256="").values_list("sha256", flat=True).iterator())
+    report = {"count": 0, "bytes": 0, "names": []}
+    storage = blob_storage()
+    for name in walk(storage, PREFIX):
+        if name.split("/")[2] in live:
+            continue
+        try:
+            if storage.get_modified_time(name) >= cutoff:
+                continue
+            size = storage.size(name)
+            if not dry_run:
+                storage.delete(name)
+        except FileNotFoundError:
+            continue
+        report["count"] += 1
+        report["bytes"] += size
+        report["names"].append(name)
+        if pause:
+            time.sleep(pause)
+    return report
@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from files import derivatives
+from files.blobs import collect_orphans
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete upload blobs that no File or Version references any more, and "
+        "previews of content no version has. Safe to run while uploads are in progress."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.5,
+            help="Seconds to sleep between batches.",
+        )
+        parser.add_argument(
+            "--grace-minutes",
+            type=int,
+            default=60,
+            help="Ignore blobs modified more recently than this.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report orphans without deleting them.",
+        )
+
+    def handle(self, *args, batch_size, pause, grace_minutes, dry_run, **options):
+        report = collect_orphans(
+            batch_size=batch_size,
+            pause=pause,
+            grace=timedelta(minutes=grace_minutes),
+            dry_run=dry_run,
+        )
+        previews = derivatives.collect_orphans(
+            grace=timedelta(minutes=grace_minutes),
+            dry_run=dry_run,
+        )
+        if options["verbosity"] > 1:
+            for name in report["names"] + previews["names"]:
+                self.stdout.write(name)
+        verb = "Would remove" if dry_run else "Removed"
+        self.stdout.write(f"{verb} {report['count']} orphan blob(s), {report['bytes']} byte(s).")
+        self.stdout.write(
+            f"{verb} {previews['count']} orphan preview(s), {previews['bytes']} byte(s)."
+        )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from files.chunkstore import collect_chunks
+
+
+class Command(BaseCommand):
+    help = "Delete content-defined chunks that no blob manifest references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be removed without deleting anything.",
+        )
+
+    def handle(self, *args, batch_size, dry_run, **options):
+        count, size = collect_chunks(batch_size=batch_size, dry_run=dry_run)
+        verb = "Would remove" if dry_run else "Removed"
+        self.stdout.write(f"{verb} {count} chunk(s), {size} byte(s).")
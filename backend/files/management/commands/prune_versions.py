@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from files.retention import sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete old versions that their file's retention policy no longer keeps. "
+        "Run it daily so time-based windows expire for files nobody edits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.5,
+            help="Seconds to sleep between batches of files.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be pruned without deleting it.",
+        )
+
+    def handle(self, *args, batch_size, pause, dry_run, **options):
+        report = sweep(batch_size=batch_size, pause=pause, dry_run=dry_run)
+        verb = "Would prune" if dry_run else "Pruned"
+        self.stdout.write(f"{verb} {report['versions']} version(s) of {report['files']} file(s).")
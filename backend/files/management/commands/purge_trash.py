@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from vault.deletion import purge_trash
+
+
+class Command(BaseCommand):
+    help = (
+        "Permanently delete nodes, files and versions that have been in the "
+        "trash longer than the retention period. Meant to run off-peak."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.TRASH_RETENTION_DAYS,
+            help="Only purge items trashed more than this many days ago.",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.5,
+            help="Seconds to sleep between batches.",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be purged without deleting it.",
+        )
+
+    def handle(self, *args, days, batch_size, pause, dry_run, **options):
+        report = purge_trash(
+            retention=timedelta(days=days),
+            batch_size=batch_size,
+            pause=pause,
+            dry_run=dry_run,
+        )
+        verb = "Would purge" if dry_run else "Purged"
+        self.stdout.write(
+            f"{verb} {report['nodes']} node(s), {report['files']} file(s), "
+            f"{report['versions']} version(s)."
+        )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from files import usage
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute per-user and per-node storage counters from version metadata. "
+        "Reads only the database; no storage is scanned."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report counters that are off without fixing them.",
+        )
+
+    def handle(self, *args, dry_run, **options):
+        report = usage.reconcile(dry_run=dry_run)
+        if options["verbosity"] > 1:
+            for scope, old, new in report["fixed"]:
+                self.stdout.write(f"{scope}: logical {old[0]} -> {new[0]}, physical {old[1]} -> {new[1]}")
+        verb = "Would fix" if dry_run else "Fixed"
+        self.stdout.write(f"{verb} {len(report['fixed'])} of {report['checked']} counter(s).")
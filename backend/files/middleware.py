@@ -0,0 +1,39 @@
+"""Request middleware for the files app."""
+
+from files.storage import blob_storage
+
+
+class DiscardUnusedUploadsMiddleware:
+    """
+    Delete streamed uploads that nothing references once the view is done.
+
+    ``StreamingUploadHandler`` writes signed-in users' uploads straight into
+    blob storage before any permission or quota check runs. Uploads the
+    view refused, deduplicated or copied elsewhere (the admin saves through
+    the storage API) would otherwise stay behind as orphans.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            self.discard(request)
+
+    @staticmethod
+    def discard(request):
+        # only look at handlers the request actually created while parsing
+        names = set()
+        for handler in getattr(request, "_upload_handlers", None) or ():
+            names.update(getattr(handler, "written", ()))
+        if not names:
+            return
+
+        from files.blobs import is_referenced
+
+        storage = blob_storage()
+        for name in names:
+            if not is_referenced(name):
+                storage.delete(name)
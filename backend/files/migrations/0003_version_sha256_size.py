@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0002_alter_file_upload_alter_version_upload_fileshare'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='version',
+            name='sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
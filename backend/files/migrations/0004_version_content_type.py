@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0003_version_sha256_size'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='version',
+            name='content_type',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='version',
+            name='size',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0004_version_content_type'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='delta_rebase_every',
+            field=models.PositiveSmallIntegerField(default=10, help_text='Keep every Nth version whole so delta chains stay short'),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='version_storage',
+            field=models.CharField(choices=[('FULL', 'Every version stored whole'), ('DELTA', 'Older versions stored as deltas')], default='FULL', max_length=5),
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='delta_base',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='delta_children', to='files.version'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:24
+
+from django.db import migrations, models
+import files.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_delta_version_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('sha256', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.PositiveIntegerField()),
+                ('refcount', models.PositiveIntegerField(db_index=True, default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='file',
+            name='upload',
+            field=models.FileField(max_length=500, storage=files.storage.blob_storage, upload_to='uploads/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='version',
+            name='upload',
+            field=models.FileField(max_length=500, storage=files.storage.blob_storage, upload_to='uploads/%Y/%m/%d/versions/'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_chunked_blob_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='version',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('graph', '0002_soft_delete'),
+        ('files', '0007_soft_delete'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('logical_bytes', models.BigIntegerField(default=0)),
+                ('physical_bytes', models.BigIntegerField(default=0)),
+                ('quota_bytes', models.BigIntegerField(blank=True, help_text='Overrides STORAGE_QUOTA_BYTES for this user', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('node', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='storage_usage', to='graph.node')),
+                ('user', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='storage_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='storageusage',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('node__isnull', True), ('user__isnull', False)), models.Q(('node__isnull', False), ('user__isnull', True)), _connector='OR'), name='storage_usage_one_scope'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:51
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('files', '0008_storage_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionPolicy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keep_last', models.PositiveIntegerField(default=10, help_text='Newest versions always kept')),
+                ('keep_daily_days', models.PositiveIntegerField(blank=True, default=0, help_text='Days to keep one version per day; empty keeps them forever', null=True)),
+                ('keep_weekly_weeks', models.PositiveIntegerField(blank=True, default=0, help_text='Weeks to keep one version per week; empty keeps them forever', null=True)),
+                ('keep_monthly_months', models.PositiveIntegerField(blank=True, default=0, help_text='Months to keep one version per month; empty keeps them forever', null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='version',
+            index=models.Index(fields=['file', '-created_at'], name='version_file_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='retentionpolicy',
+            name='file',
+            field=models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='retention_policy', to='files.file'),
+        ),
+        migrations.AddField(
+            model_name='retentionpolicy',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='retention_policies', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0009_version_retention'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='download_key',
+            field=models.PositiveIntegerField(default=0, help_text='Bumped to invalidate signed download links'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_download_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='import_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+    ]
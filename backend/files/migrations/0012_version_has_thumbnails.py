@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0011_file_import_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='version',
+            name='has_thumbnails',
+            field=models.BooleanField(default=False),
+        ),
+    ]
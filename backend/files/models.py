@@ -1,9 +1,33 @@
 from django.conf import settings
 from django.db import models
 
+from files.storage import blob_storage
+
 User = settings.AUTH_USER_MODEL
 
+
+class LiveFileManager(models.Manager):
+    """Files that are not in the trash."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class LiveVersionManager(models.Manager):
+    """Versions that are not in the trash, of files that are not either."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True, file__deleted_at__isnull=True)
+
+
 class File(models.Model):
+    FULL  = "FULL"
+    DELTA = "DELTA"
+    VERSION_STORAGE_CHOICES = [
+        (FULL, "Every version stored whole"),
+        (DELTA, "Older versions stored as deltas"),
+    ]
+
     owner      = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -12,9 +36,30 @@ class File(models.Model):
     name       = models.CharField(max_length=255)
     upload     = models.FileField(
         upload_to='uploads/%Y/%m/%d/',
+        storage=blob_storage,
         max_length=500
     )
+    version_storage    = models.CharField(
+        max_length=5,
+        choices=VERSION_STORAGE_CHOICES,
+        default=FULL
+    )
+    delta_rebase_every = models.PositiveSmallIntegerField(
+        default=10,
+        help_text="Keep every Nth version whole so delta chains stay short"
+    )
+    download_key       = models.PositiveIntegerField(
+        default=0,
+        help_text="Bumped to invalidate signed download links"
+    )
+    # set only while a bulk upload resolves the ids of the rows it inserted
+    import_key = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # set while the file sits in the trash; purge_trash removes it for good
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects     = LiveFileManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return f"{self.name} (#{self.id})"
@@ -28,14 +73,41 @@ class Version(models.Model):
     )
     upload     = models.FileField(
         upload_to='uploads/%Y/%m/%d/versions/',
+        storage=blob_storage,
         max_length=500
     )
     note       = models.TextField(blank=True)
+    sha256     = models.CharField(max_length=64, blank=True, db_index=True)
+    size       = models.BigIntegerField(null=True, blank=True, db_index=True)
+    content_type = models.CharField(max_length=100, blank=True, db_index=True)
+    # set when ``upload`` holds a delta against this newer version
+    delta_base = models.ForeignKey(
+        "self",
+        null=True, blank=True,
+        on_delete=models.RESTRICT,
+        related_name="delta_children"
+    )
+    # thumbnails of the content are in blob storage, so URLs can point at them
+    has_thumbnails = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects     = LiveVersionManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # history listings and retention walk one file's versions newest first
+            models.Index(fields=["file", "-created_at"], name="version_file_created_idx"),
+        ]
 
     def __str__(self):
         return f"Version #{self.id} of File #{self.file_id}"
 
+    @property
+    def is_trashed(self):
+        return self.deleted_at is not None or self.file.deleted_at is not None
+
 
 class FileShare(models.Model):
     READ  = "R"
@@ -84,3 +156,96 @@ class FileShare(models.Model):
         else:
             target = f"group={self.shared_with_group_id}"
         return f"Share(file={self.file_id},to={target},perm={self.permission})"
+
+
+class Chunk(models.Model):
+    """A content-defined chunk shared by every blob manifest that lists it."""
+    sha256     = models.CharField(max_length=64, primary_key=True)
+    size       = models.PositiveIntegerField()
+    refcount   = models.PositiveIntegerField(default=0, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Chunk {self.sha256[:12]} ({self.size} B, refs={self.refcount})"
+
+
+class StorageUsage(models.Model):
+    """
+    Running byte totals of the live versions of one user's files, or of the
+    files linked to one node. ``files.usage`` keeps them current in the same
+    transaction as the rows they count; ``reconcile_usage`` rebuilds them.
+    """
+    user           = models.OneToOneField(
+        User,
+        null=True, blank=True,
+        on_delete=models.CASCADE,
+        related_name="storage_usage"
+    )
+    node           = models.OneToOneField(
+        "graph.Node",
+        null=True, blank=True,
+        on_delete=models.CASCADE,
+        related_name="storage_usage"
+    )
+    # every version counted at its full size
+    logical_bytes  = models.BigIntegerField(default=0)
+    # identical content counted once
+    physical_bytes = models.BigIntegerField(default=0)
+    quota_bytes    = models.BigIntegerField(
+        null=True, blank=True,
+        help_text="Overrides STORAGE_QUOTA_BYTES for this user"
+    )
+    updated_at     = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.CheckConstraint(
+                check=models.Q(user__isnull=False, node__isnull=True)
+                | models.Q(user__isnull=True, node__isnull=False),
+                name="storage_usage_one_scope",
+            ),
+        ]
+
+    def __str__(self):
+        scope = f"user={self.user_id}" if self.user_id else f"node={self.node_id}"
+        return f"Usage({scope}, logical={self.logical_bytes}, physical={self.physical_bytes})"
+
+
+class RetentionPolicy(models.Model):
+    """
+    Which versions ``files.retention`` keeps: a user's default when ``file``
+    is empty, otherwise an override for one file. Windows count back from
+    now; within each, the newest version of every day, week or month stays.
+    """
+    owner             = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="retention_policies"
+    )
+    file              = models.OneToOneField(
+        File,
+        null=True, blank=True,
+        on_delete=models.CASCADE,
+        related_name="retention_policy"
+    )
+    keep_last         = models.PositiveIntegerField(
+        default=10,
+        help_text="Newest versions always kept"
+    )
+    keep_daily_days   = models.PositiveIntegerField(
+        null=True, blank=True, default=0,
+        help_text="Days to keep one version per day; empty keeps them forever"
+    )
+    keep_weekly_weeks = models.PositiveIntegerField(
+        null=True, blank=True, default=0,
+        help_text="Weeks to keep one version per week; empty keeps them forever"
+    )
+    keep_monthly_months = models.PositiveIntegerField(
+        null=True, blank=True, default=0,
+        help_text="Months to keep one version per month; empty keeps them forever"
+    )
+    updated_at        = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        scope = f"file={self.file_id}" if self.file_id else f"default of user={self.owner_id}"
+        return f"Retention({scope}, last={self.keep_last})"
@@ -0,0 +1,155 @@
+"""
+Version retention.
+
+A ``RetentionPolicy`` says which old versions of a file are worth keeping,
+in the style of backup rotation: the newest ``keep_last``, plus the newest
+version of each day, week and month inside the configured windows.
+Everything else is pruned: rows are deleted through ``delete_versions`` and
+their blobs are released in the background.
+
+Versions attached to chat messages are never pruned. Pruning runs as a job
+after every new version of a file with a policy, and the ``prune_versions``
+command sweeps all such files so time-based windows expire without edits.
+"""
+
+import time
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from files import delta
+from files.models import File, RetentionPolicy, Version
+from jobs.queue import task
+
+BATCH_SIZE = 100
+
+
+def policy_for(file):
+    """The file's own policy, else its owner's default, else ``None``."""
+    policies = {
+        p.file_id: p
+        for p in RetentionPolicy.objects.filter(Q(file=file) | Q(owner_id=file.owner_id, file__isnull=True))
+    }
+    return policies.get(file.pk) or policies.get(None)
+
+
+def _within(window, age):
+    # None keeps forever, 0 disables the bucket
+    return window is None or (window and age < window)
+
+
+def select_prunable(versions, policy, now=None):
+    """
+    Ids of ``(id, created_at)`` pairs, newest first, that ``policy`` does not
+    keep. The newest version is always kept.
+    """
+    now = timezone.localtime(now or timezone.now())
+    keep = {pk for pk, _ in versions[: max(policy.keep_last, 1)]}
+    buckets = (
+        (policy.keep_daily_days, lambda d: d.date(), lambda d: (now.date() - d.date()).days),
+        (policy.keep_weekly_weeks, lambda d: d.isocalendar()[:2], lambda d: (now.date() - d.date()).days // 7),
+        (
+            policy.keep_monthly_months,
+            lambda d: (d.year, d.month),
+            lambda d: (now.year - d.year) * 12 + now.month - d.month,
+        ),
+    )
+    for window, bucket, age in buckets:
+        if window == 0:
+            continue
+        seen = set()
+        for pk, created_at in versions:
+            created_at = timezone.localtime(created_at)
+            key = bucket(created_at)
+            if key in seen:
+                continue
+            # the newest version of each bucket stands for it
+            seen.add(key)
+            if _within(window, age(created_at)):
+                keep.add(pk)
+    return [pk for pk, _ in versions if pk not in keep]
+
+
+def _prunable(file, policy, now):
+    versions = list(
+        Version.objects.filter(file=file).order_by("-created_at", "-id").values_list("pk", "created_at")
+    )
+    pinned = set(
+        Version.all_objects.filter(file=file, attached_messages__isnull=False).values_list("pk", flat=True)
+    )
+    return [pk for pk in select_prunable(versions, policy, now) if pk not in pinned]
+
+
+def prune_file(file, policy=None, now=None, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Delete the versions of ``file`` its policy does not keep; returns their ids.
+
+    Each batch commits on its own. Deltas built on a batch are rebased first
+    without any lock (``delta.plan_rebase``); then the file's row is locked
+    as in ``delta.compact_after`` only to re-read what to prune, switch the
+    rebased deltas and delete the rows. Uploads and reads of the file wait
+    for one batch at most, and a compaction of the same file never
+    interleaves with the switch, whether pruning runs on a worker or from
+    the ``prune_versions`` command.
+    """
+    from vault.deletion import delete_versions
+
+    policy = policy or policy_for(file)
+    if policy is None:
+        return []
+    prunable = _prunable(file, policy, now)
+    if dry_run:
+        return prunable
+    pruned = []
+    for i in range(0, len(prunable), batch_size):
+        batch = prunable[i:i + batch_size]
+        plans = delta.plan_rebase(batch)
+        with transaction.atomic():
+            File.objects.select_for_update().filter(pk=file.pk).first()
+            # read after the lock: edits, attachments or a compaction may
+            # have changed what to prune since
+            still = set(_prunable(file, policy, now))
+            batch = [pk for pk in batch if pk in still]
+            delta.apply_rebase(plans)
+            # deltas that changed since they were planned are stored whole here
+            delete_versions(batch)
+        pruned.extend(batch)
+    return pruned
+
+
+@task(queue="versions")
+def apply_retention(file_id):
+    file = File.objects.filter(pk=file_id).first()
+    if file is not None:
+        prune_file(file)
+
+
+def schedule(file):
+    """Queue pruning of ``file`` if a policy covers it."""
+    if policy_for(file) is not None:
+        apply_retention.delay(file.pk)
+
+
+def sweep(batch_size=BATCH_SIZE, pause=0.0, dry_run=False, now=None):
+    """
+    Prune every file covered by a policy, ``batch_size`` files at a time with
+    ``pause`` seconds in between. Returns how many files and versions were
+    (or, with ``dry_run``, would be) pruned.
+    """
+    owners = RetentionPolicy.objects.filter(file__isnull=True).values("owner_id")
+    covered = File.objects.filter(Q(retention_policy__isnull=False) | Q(owner_id__in=owners))
+    report = {"files": 0, "versions": 0}
+    last_pk = 0
+    while True:
+        files = list(covered.filter(pk__gt=last_pk).order_by("pk")[:batch_size])
+        if not files:
+            return report
+        for file in files:
+            pruned = prune_file(file, now=now, batch_size=batch_size, dry_run=dry_run)
+            if pruned:
+                report["files"] += 1
+                report["versions"] += len(pruned)
+        last_pk = files[-1].pk
+        if pause:
+            time.sleep(pause)
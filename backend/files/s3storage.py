@@ -0,0 +1,213 @@
+"""
+Blob storage on any S3-protocol service (AWS S3, MinIO, Ceph RGW…).
+
+Selected with ``VAULT_BLOB_STORAGE=s3`` and configured by ``VAULT_S3``.
+Large uploads are sent as multipart uploads whose parts go up in parallel;
+reads stream one ranged ``GET`` from the current position and reopen it
+only on a seek, so delta reconstruction never downloads a whole blob first.
+Downloads of whole blobs are redirected to presigned URLs, so app workers
+never proxy the bytes.
+
+One client per process is shared by all threads: botocore clients are
+thread safe, and its connection pool is sized by ``MAX_POOL_CONNECTIONS``.
+"""
+
+import io
+import mimetypes
+import posixpath
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File as DjangoFile
+from django.core.files.storage import Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+READ_BUFFER = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def _client(endpoint_url, region, access_key, secret_key, addressing_style, max_pool_connections):
+    try:
+        import boto3
+        from botocore.config import Config
+    except ImportError as exc:
+        raise ImproperlyConfigured("VAULT_BLOB_STORAGE=s3 needs the boto3 package.") from exc
+
+    return boto3.session.Session().client(
+        "s3",
+        endpoint_url=endpoint_url,
+        region_name=region,
+        aws_access_key_id=access_key,
+        aws_secret_access_key=secret_key,
+        config=Config(
+            signature_version="s3v4",
+            max_pool_connections=max_pool_connections,
+            retries={"max_attempts": 5, "mode": "standard"},
+            s3={"addressing_style": addressing_style},
+        ),
+    )
+
+
+def _not_found(exc):
+    error = getattr(exc, "response", {}).get("Error", {})
+    return error.get("Code") in ("404", "NoSuchKey", "NotFound")
+
+
+class S3File(io.RawIOBase):
+    """Seekable read-only view of an object, fetched with ranged ``GET``s."""
+
+    def __init__(self, client, bucket, key, size):
+        super().__init__()
+        self._client = client
+        self._bucket = bucket
+        self._key = key
+        self._size = size
+        self._pos = 0
+        self._body = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self._size
+        offset = max(offset, 0)
+        if offset != self._pos:
+            self._drop_body()
+            self._pos = offset
+        return self._pos
+
+    def readinto(self, buffer):
+        if self._pos >= self._size:
+            return 0
+        if self._body is None:
+            self._body = self._client.get_object(
+                Bucket=self._bucket, Key=self._key, Range=f"bytes={self._pos}-"
+            )["Body"]
+        data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def _drop_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self):
+        self._drop_body()
+        super().close()
+
+
+@deconstructible
+class S3Storage(Storage):
+    # the download view sends clients to ``url()`` instead of streaming
+    redirect_downloads = True
+
+    def __init__(self, options=None):
+        self.options = {**settings.VAULT_S3, **(options or {})}
+
+    def _make_client(self, endpoint_url):
+        o = self.options
+        return _client(
+            endpoint_url,
+            o["REGION"],
+            o["ACCESS_KEY"],
+            o["SECRET_KEY"],
+            o["ADDRESSING_STYLE"],
+            o["MAX_POOL_CONNECTIONS"],
+        )
+
+    @property
+    def client(self):
+        return self._make_client(self.options["ENDPOINT_URL"])
+
+    @property
+    def bucket(self):
+        return self.options["BUCKET"]
+
+    def _key(self, name):
+        return posixpath.join(self.options["LOCATION"], name) if self.options["LOCATION"] else name
+
+    def _head(self, name):
+        return self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+
+    def _transfer_config(self):
+        from boto3.s3.transfer import TransferConfig
+
+        o = self.options
+        return TransferConfig(
+            multipart_threshold=o["MULTIPART_THRESHOLD"],
+            multipart_chunksize=o["MULTIPART_CHUNKSIZE"],
+            max_concurrency=o["MAX_CONCURRENCY"],
+            use_threads=True,
+        )
+
+    def _open(self, name, mode="rb"):
+        if "w" in mode or "a" in mode or "+" in mode:
+            raise ValueError("S3 blobs are written through save().")
+        size = self._head(name)["ContentLength"]
+        raw = S3File(self.client, self.bucket, self._key(name), size)
+        return DjangoFile(io.BufferedReader(raw, buffer_size=READ_BUFFER), name)
+
+    def _save(self, name, content):
+        if hasattr(content, "seek"):
+            content.seek(0)
+        content_type = getattr(content, "content_type", None) or mimetypes.guess_type(name)[0]
+        self.client.upload_fileobj(
+            content,
+            self.bucket,
+            self._key(name),
+            ExtraArgs={"ContentType": content_type or "application/octet-stream"},
+            Config=self._transfer_config(),
+        )
+        return name
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def exists(self, name):
+        try:
+            self._head(name)
+        except Exception as exc:
+            if _not_found(exc):
+                return False
+            raise
+        return True
+
+    def size(self, name):
+        return self._head(name)["ContentLength"]
+
+    def get_modified_time(self, name):
+        modified = self._head(name)["LastModified"]
+        return modified if settings.USE_TZ else timezone.make_naive(modified)
+
+    def listdir(self, path):
+        prefix = self._key(path).rstrip("/")
+        prefix = f"{prefix}/" if prefix else ""
+        dirs, files = [], []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter="/"):
+            dirs.extend(p["Prefix"][len(prefix):].rstrip("/") for p in page.get("CommonPrefixes", ()))
+            files.extend(o["Key"][len(prefix):] for o in page.get("Contents", ()))
+        return dirs, files
+
+    def url(self, name, filename=None):
+        """Presigned ``GET`` URL, signed for the endpoint browsers can reach."""
+        params = {"Bucket": self.bucket, "Key": self._key(name)}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        client = self._make_client(self.options["PUBLIC_ENDPOINT_URL"] or self.options["ENDPOINT_URL"])
+        return client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=self.options["PRESIGN_SECONDS"]
+        )
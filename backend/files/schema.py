@@ -1,27 +1,205 @@
 # files/schema.py
 
 import os
+import hashlib
+from urllib.parse import urlencode
+
 import graphene
 from graphql import GraphQLError
 from graphene_django import DjangoObjectType
 from graphene_file_upload.scalars import Upload
+from django.db import transaction
 from django.db.models import Q
+from django.urls import reverse
 
-from files.models import File, Version, FileShare
+from files import bulk, delta, derivatives, retention, tokens, usage
+from files.models import File, Version, FileShare, RetentionPolicy, StorageUsage
+from files.storage import blob_storage
+from files.uploadhandlers import SNIFF_BYTES, sniff_content_type
 from accounts.schema import UserType
+from vault.deletion import trash_files, trash_versions
+
+
+# ── Helpers ──────────────────────────────────────────────────────────────────
+
+def readable_files(user):
+    """Files the user owns or has READ access to through a share."""
+    if user.is_anonymous:
+        return File.objects.filter(
+            shares__is_public=True, shares__permission=FileShare.READ
+        ).distinct()
+    group_ids = user.group_memberships.values_list("group", flat=True)
+    return File.objects.filter(
+        Q(owner=user)
+        | Q(shares__is_public=True, shares__permission=FileShare.READ)
+        | Q(shares__shared_with_user=user, shares__permission=FileShare.READ)
+        | Q(shares__shared_with_group__in=group_ids, shares__permission=FileShare.READ)
+    ).distinct()
+
+
+def can_read_version(user, version):
+    """Readable through the file's shares, or attached in a chat the user is in."""
+    if readable_files(user).filter(pk=version.file_id).exists():
+        return True
+    return not user.is_anonymous and version.attached_messages.filter(
+        channel__memberships__user=user
+    ).exists()
+
+
+def upload_metadata(upload):
+    """
+    Content metadata for an upload as ``Version`` field values.
+
+    Uploads that came through ``StreamingUploadHandler`` already carry their
+    hash, size and type; anything else is read once here and rewound.
+    """
+    if getattr(upload, "sha256", None):
+        return {"sha256": upload.sha256, "size": upload.size, "content_type": upload.content_type}
+    digest = hashlib.sha256()
+    size = 0
+    head = b""
+    for chunk in upload.chunks():
+        digest.update(chunk)
+        size += len(chunk)
+        if len(head) < SNIFF_BYTES:
+            head += chunk[: SNIFF_BYTES - len(head)]
+    upload.seek(0)
+    return {
+        "sha256": digest.hexdigest(),
+        "size": size,
+        "content_type": sniff_content_type(head, upload.name),
+    }
+
+
+def store_upload(upload, sha256):
+    """
+    What to assign to a ``FileField`` for an upload with the given hash.
+
+    Identical bytes that are already stored are reused and the new copy is
+    dropped; otherwise the name the streaming handler wrote to is used, and
+    only uploads that were not streamed get written by the field itself.
+    """
+    stored = getattr(upload, "stored_name", None)
+    twin = (
+        Version.objects.filter(sha256=sha256, delta_base__isnull=True)
+        .exclude(upload="")
+        .values_list("upload", flat=True)
+        .first()
+    )
+    storage = blob_storage()
+    if twin and twin != stored and storage.exists(twin):
+        if stored:
+            storage.delete(stored)
+        return twin
+    return stored or upload
+
+
+def find_readable_version(user, sha256):
+    """
+    Newest version with the given content hash that the user can already read.
+
+    Lookups are scoped to readable files so a hash can never be used to pull
+    someone else's private content.
+    """
+    if not sha256:
+        return None
+    return (
+        Version.objects.filter(
+            sha256=sha256.lower(), delta_base__isnull=True, file__in=readable_files(user)
+        )
+        .select_related("file")
+        .order_by("-created_at")
+        .first()
+    )
+
+
+def signed_download_url(info, kind, obj, file_id):
+    """Absolute link to download a file or version, signed for the requesting user."""
+    name = "files:file-download" if kind == "file" else "files:version-download"
+    token = tokens.issue(kind, obj.pk, file_id, info.context.user)
+    return info.context.build_absolute_uri(f"{reverse(name, args=[obj.pk])}?{urlencode({'t': token})}")
+
+
+def discard_uploads(uploads):
+    """Remove what the streaming handler already wrote for rejected uploads."""
+    storage = blob_storage()
+    for upload in uploads:
+        stored = getattr(upload, "stored_name", None)
+        if stored:
+            storage.delete(stored)
+
+
+def check_quota(user, size, uploads=()):
+    """Refuse ``size`` more bytes over the user's quota, dropping ``uploads``."""
+    if not usage.has_room(user, size):
+        discard_uploads(uploads)
+        raise GraphQLError("Storage quota exceeded.")
+
+
+def resolve_upload(user, upload=None, sha256=None, size=None):
+    """
+    Decide what to store for an ``upload``/``sha256`` argument pair.
+
+    Returns ``(blob, metadata)`` where ``blob`` is either the upload to be
+    written or the name of an already stored blob with identical content, and
+    ``metadata`` holds the ``Version`` content fields. Content that would
+    not fit in the user's quota is refused before it is stored.
+    """
+    known = find_readable_version(user, sha256)
+    if known and (size is None or known.size == size):
+        # the bytes are stored already; a copy sent along is not needed
+        sent = [upload] if upload else []
+        check_quota(user, known.size, sent)
+        discard_uploads(sent)
+        return known.upload.name, {
+            "sha256": known.sha256,
+            "size": known.size,
+            "content_type": known.content_type,
+        }
+    if not upload:
+        raise GraphQLError("Unknown content hash; upload the file instead.")
+    metadata = upload_metadata(upload)
+    check_quota(user, metadata["size"], [upload])
+    return store_upload(upload, metadata["sha256"]), metadata
 
 
 # ── Types ────────────────────────────────────────────────────────────────────
 
 class VersionType(DjangoObjectType):
-    file_name = graphene.String()
+    file_name     = graphene.String()
+    download_url  = graphene.String()
+    is_delta      = graphene.Boolean()
+    thumbnail_url = graphene.String(
+        size=graphene.Int(default_value=256),
+        description="Preview image about `size` pixels across, for images and PDFs",
+    )
+    text_snippet  = graphene.String(description="Start of the content, for text files")
 
     class Meta:
         model = Version
-        fields = ("id", "upload", "note", "created_at")
+        # no raw "upload": its MEDIA_URL would bypass the signed downloadUrl
+        fields = (
+            "id", "note", "sha256", "size", "content_type", "created_at", "deleted_at",
+        )
 
     def resolve_file_name(self, info):
-        return os.path.basename(self.upload.name)
+        name = os.path.basename(self.upload.name)
+        return name[: -len(".vdelta")] if name.endswith(".vdelta") else name
+
+    def resolve_download_url(self, info):
+        # the view rebuilds deltas on the fly
+        if not can_read_version(info.context.user, self):
+            raise GraphQLError("Permission denied.")
+        return signed_download_url(info, "version", self, self.file_id)
+
+    def resolve_is_delta(self, info):
+        return self.delta_base_id is not None
+
+    def resolve_thumbnail_url(self, info, size):
+        return derivatives.thumbnail_url(self, size, info.context)
+
+    def resolve_text_snippet(self, info):
+        return derivatives.text_snippet(self)
 
 
 class FileShareType(DjangoObjectType):
@@ -30,44 +208,85 @@ class FileShareType(DjangoObjectType):
         fields = "__all__"
 
 
+class RetentionPolicyType(DjangoObjectType):
+    class Meta:
+        model  = RetentionPolicy
+        fields = (
+            "id", "file", "keep_last", "keep_daily_days", "keep_weekly_weeks",
+            "keep_monthly_months", "updated_at",
+        )
+
+
 class FileType(DjangoObjectType):
-    owner        = graphene.Field(UserType, description="Owner of the file")
-    download_url = graphene.String()
-    shares       = graphene.List(FileShareType, description="Shares on this file")
+    owner         = graphene.Field(UserType, description="Owner of the file")
+    download_url  = graphene.String()
+    thumbnail_url = graphene.String(
+        size=graphene.Int(default_value=256),
+        description="Preview of the latest version",
+    )
+    shares        = graphene.List(FileShareType, description="Shares on this file")
+    versions_export_url = graphene.String(description="ZIP of every version of the file")
+    retention_policy    = graphene.Field(
+        RetentionPolicyType,
+        description="Policy pruning old versions (the file's own or the owner's default); owner only",
+    )
 
     class Meta:
         model  = File
-        fields = ("id", "name", "upload", "created_at", "owner", "shares")
+        # no raw "upload": its MEDIA_URL would bypass the signed downloadUrl
+        fields = (
+            "id",
+            "name",
+            "created_at",
+            "owner",
+            "shares",
+            "version_storage",
+            "delta_rebase_every",
+            "deleted_at",
+        )
 
     def resolve_owner(self, info):
         return self.owner
 
+    def resolve_retention_policy(self, info):
+        if self.owner_id != info.context.user.id:
+            return None
+        return retention.policy_for(self)
+
     def resolve_download_url(self, info):
         user = info.context.user
         group_ids = [] if user.is_anonymous else list(user.group_memberships.values_list("group", flat=True))
 
         # 1) Owner
         if not user.is_anonymous and self.owner_id == user.id:
-            return info.context.build_absolute_uri(self.upload.url)
+            return signed_download_url(info, "file", self, self.pk)
 
         # 2) Public READ
         if FileShare.objects.filter(file=self, is_public=True, permission=FileShare.READ).exists():
-            return info.context.build_absolute_uri(self.upload.url)
+            return signed_download_url(info, "file", self, self.pk)
 
         # 3) Shared with user READ
         if not user.is_anonymous and FileShare.objects.filter(
             file=self, shared_with_user=user, permission=FileShare.READ
         ).exists():
-            return info.context.build_absolute_uri(self.upload.url)
+            return signed_download_url(info, "file", self, self.pk)
 
         # 4) Shared with group READ
         if FileShare.objects.filter(
             file=self, shared_with_group__in=group_ids, permission=FileShare.READ
         ).exists():
-            return info.context.build_absolute_uri(self.upload.url)
+            return signed_download_url(info, "file", self, self.pk)
 
         raise GraphQLError("Permission denied.")
 
+    def resolve_thumbnail_url(self, info, size):
+        FileType.resolve_download_url(self, info)
+        latest = self.versions.order_by("-created_at", "-id").first()
+        return derivatives.thumbnail_url(latest, size, info.context) if latest else None
+
+    def resolve_versions_export_url(self, info):
+        return info.context.build_absolute_uri(reverse("files:versions-export", args=[self.pk]))
+
     def resolve_shares(self, info):
         user = info.context.user
         if user.is_anonymous or self.owner_id != user.id:
@@ -75,6 +294,13 @@ class FileType(DjangoObjectType):
         return FileShare.objects.filter(file=self)
 
 
+class StorageUsageType(graphene.ObjectType):
+    logical_bytes   = graphene.BigInt(description="Every live version at full size")
+    physical_bytes  = graphene.BigInt(description="Identical content counted once")
+    quota_bytes     = graphene.BigInt(description="Empty when there is no limit")
+    remaining_bytes = graphene.BigInt()
+
+
 # ── Queries ─────────────────────────────────────────────────────────────────
 
 class FilesQuery(graphene.ObjectType):
@@ -98,18 +324,17 @@ class FilesQuery(graphene.ObjectType):
         limit=graphene.Int(default_value=20),
         offset=graphene.Int(default_value=0),
     )
+    storage_usage = graphene.Field(
+        StorageUsageType,
+        node_id=graphene.ID(),
+        description="Bytes stored by you, or in a node you can read"
+    )
 
     def resolve_my_files(self, info, limit, offset, name_contains=None):
         user = info.context.user
         if user.is_anonymous:
             raise GraphQLError("Authentication required.")
-        group_ids = user.group_memberships.values_list("group", flat=True)
-        qs = File.objects.filter(
-            Q(owner=user)
-            | Q(shares__is_public=True, shares__permission=FileShare.READ)
-            | Q(shares__shared_with_user=user, shares__permission=FileShare.READ)
-            | Q(shares__shared_with_group__in=group_ids, shares__permission=FileShare.READ)
-        ).distinct()
+        qs = readable_files(user)
         if name_contains:
             qs = qs.filter(name__icontains=name_contains)
         return qs[offset : offset + limit]
@@ -133,40 +358,123 @@ class FilesQuery(graphene.ObjectType):
         qs = Version.objects.filter(file=file).order_by("-created_at")
         return qs[offset : offset + limit]
 
+    def resolve_storage_usage(self, info, node_id=None):
+        from graph.schema import readable_nodes
+
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        if node_id is not None:
+            if not readable_nodes(user).filter(pk=node_id).exists():
+                raise GraphQLError("Node not found.")
+            row = StorageUsage.objects.filter(node_id=node_id).first() or StorageUsage()
+            return StorageUsageType(logical_bytes=row.logical_bytes, physical_bytes=row.physical_bytes)
+        row = StorageUsage.objects.filter(user=user).first() or StorageUsage()
+        return StorageUsageType(
+            logical_bytes=row.logical_bytes,
+            physical_bytes=row.physical_bytes,
+            quota_bytes=usage.quota(user),
+            remaining_bytes=usage.remaining(user),
+        )
+
 
 # ── Mutations ────────────────────────────────────────────────────────────────
 
+class PrepareUpload(graphene.Mutation):
+    """Tell the client whether it can skip sending the bytes of an upload."""
+
+    exists = graphene.Boolean()
+
+    class Arguments:
+        sha256 = graphene.String(required=True)
+        size   = graphene.BigInt(required=True)
+
+    def mutate(self, info, sha256, size):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        known = find_readable_version(user, sha256)
+        return PrepareUpload(exists=bool(known and known.size == size))
+
+
 class UploadFile(graphene.Mutation):
     file    = graphene.Field(FileType)
     version = graphene.Field(VersionType)
 
     class Arguments:
         name   = graphene.String(required=True)
-        upload = Upload(required=True)
+        upload = Upload()
+        sha256 = graphene.String(description="Content hash confirmed by prepareUpload")
 
-    def mutate(self, info, name, upload):
+    def mutate(self, info, name, upload=None, sha256=None):
         user = info.context.user
         if user.is_anonymous:
             raise GraphQLError("Authentication required.")
-        file = File.objects.create(owner=user, name=name, upload=upload)
-        version = Version.objects.create(file=file, upload=upload, note="Initial upload")
+        blob, metadata = resolve_upload(user, upload, sha256)
+        with transaction.atomic():
+            file = File.objects.create(owner=user, name=name, upload=blob)
+            version = Version.objects.create(
+                file=file, upload=file.upload.name, note="Initial upload", **metadata
+            )
+            usage.versions_added([version.pk])
+            derivatives.schedule(version)
         return UploadFile(file=file, version=version)
 
 
+class UploadFiles(graphene.Mutation):
+    """Upload many files in one request, optionally straight into a node."""
+
+    files    = graphene.List(FileType)
+    versions = graphene.List(VersionType)
+
+    class Arguments:
+        uploads = graphene.List(graphene.NonNull(Upload), required=True)
+        node_id = graphene.ID(description="Node the new files are added to")
+
+    def mutate(self, info, uploads, node_id=None):
+        from graph.models import Node
+
+        user = info.context.user
+        if user.is_anonymous:
+            discard_uploads(uploads)
+            raise GraphQLError("Authentication required.")
+        node = None
+        if node_id is not None:
+            node = Node.objects.filter(pk=node_id, owner=user).first()
+            if not node:
+                discard_uploads(uploads)
+                raise GraphQLError("Permission denied.")
+        if not uploads:
+            return UploadFiles(files=[], versions=[])
+        stored = bulk.store_uploads(uploads, user)
+        files, versions = bulk.create_files(
+            user, [(upload.name, blob, metadata) for upload, (blob, metadata) in zip(uploads, stored)], node
+        )
+        return UploadFiles(files=files, versions=versions)
+
+
 class AddFileVersion(graphene.Mutation):
     version = graphene.Field(VersionType)
 
     class Arguments:
         file_id = graphene.ID(required=True)
-        upload  = Upload(required=True)
+        upload  = Upload()
+        sha256  = graphene.String(description="Content hash confirmed by prepareUpload")
         note    = graphene.String()
 
-    def mutate(self, info, file_id, upload, note=""):
+    def mutate(self, info, file_id, upload=None, sha256=None, note=""):
         user = info.context.user
         file = File.objects.filter(pk=file_id, owner=user).first()
         if not file:
             raise GraphQLError("Only file owner can add versions.")
-        version = Version.objects.create(file=file, upload=upload, note=note)
+        blob, metadata = resolve_upload(user, upload, sha256)
+        with transaction.atomic():
+            version = Version.objects.create(file=file, upload=blob, note=note, **metadata)
+            usage.versions_added([version.pk])
+            derivatives.schedule(version)
+            if file.version_storage == File.DELTA:
+                delta.compact_after.delay(version.pk)
+            retention.schedule(file)
         return AddFileVersion(version=version)
 
 
@@ -255,8 +563,11 @@ class UpdateFileShare(graphene.Mutation):
         share = FileShare.objects.filter(pk=share_id, file__owner=user).first()
         if not share:
             raise GraphQLError("Share not found or you are not the owner.")
-        share.permission = permission
-        share.save()
+        with transaction.atomic():
+            share.permission = permission
+            share.save()
+            # links issued under the old permission stop working
+            tokens.rotate([share.file_id])
         return UpdateFileShare(share=share)
 
 
@@ -271,7 +582,9 @@ class RevokeFileShare(graphene.Mutation):
         share = FileShare.objects.filter(pk=share_id, file__owner=user).first()
         if not share:
             raise GraphQLError("Share not found or you are not the owner.")
-        share.delete()
+        with transaction.atomic():
+            share.delete()
+            tokens.rotate([share.file_id])
         return RevokeFileShare(ok=True)
 
 
@@ -293,20 +606,123 @@ class KeepFile(graphene.Mutation):
             raise GraphQLError("File not found.")
         FileType.resolve_download_url(orig, info)
 
-        new_name = copy_name or f"{orig.name} (copy)"
-        new_file = File.objects.create(owner=user, name=new_name, upload=orig.upload)
-
         versions_qs = orig.versions.order_by("created_at")
         if not all_versions:
             versions_qs = versions_qs.reverse()[:1]
-        new_versions = []
-        for v in versions_qs:
-            nv = Version.objects.create(file=new_file, upload=v.upload, note=v.note)
-            new_versions.append(nv)
+        originals = list(versions_qs)
+        check_quota(user, sum(v.size or 0 for v in originals))
+
+        new_name = copy_name or f"{orig.name} (copy)"
+        with transaction.atomic():
+            new_file = File.objects.create(owner=user, name=new_name, upload=orig.upload)
+            new_versions = []
+            for v in originals:
+                nv = Version.objects.create(
+                    file=new_file,
+                    upload=v.upload,
+                    note=v.note,
+                    sha256=v.sha256,
+                    size=v.size,
+                    content_type=v.content_type,
+                )
+                new_versions.append(nv)
+
+            # deltas follow the copy of their base; without one they are stored whole
+            copies = {v.pk: nv for v, nv in zip(originals, new_versions)}
+            for v, nv in zip(originals, new_versions):
+                if v.delta_base_id is None:
+                    continue
+                if v.delta_base_id in copies:
+                    nv.delta_base = copies[v.delta_base_id]
+                    nv.save(update_fields=["delta_base"])
+                else:
+                    nv.delta_base_id = v.delta_base_id
+                    delta.materialize(nv)
+            usage.versions_added([nv.pk for nv in new_versions])
 
         return KeepFile(file=new_file, versions=new_versions)
 
 
+class SetVersionStorage(graphene.Mutation):
+    """Choose how older versions of a file are stored."""
+
+    file = graphene.Field(FileType)
+
+    class Arguments:
+        file_id      = graphene.ID(required=True)
+        mode         = graphene.String(required=True, description="FULL or DELTA")
+        rebase_every = graphene.Int(description="Keep every Nth version whole")
+
+    def mutate(self, info, file_id, mode, rebase_every=None):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        file = File.objects.filter(pk=file_id, owner=user).first()
+        if not file:
+            raise GraphQLError("Only the owner can change version storage.")
+        if mode not in (File.FULL, File.DELTA):
+            raise GraphQLError("Invalid version storage mode.")
+        if rebase_every is not None and rebase_every < 1:
+            raise GraphQLError("rebase_every must be at least 1.")
+        file.version_storage = mode
+        if rebase_every is not None:
+            file.delta_rebase_every = rebase_every
+        file.save()
+        return SetVersionStorage(file=file)
+
+
+class SetRetentionPolicy(graphene.Mutation):
+    """
+    Choose which old versions are kept: for one file, or without ``fileId``
+    as the default for all your files. An explicit null window keeps that
+    kind of version forever; an omitted one keeps its current value.
+    """
+
+    policy = graphene.Field(RetentionPolicyType)
+
+    class Arguments:
+        file_id             = graphene.ID()
+        keep_last           = graphene.Int()
+        keep_daily_days     = graphene.Int()
+        keep_weekly_weeks   = graphene.Int()
+        keep_monthly_months = graphene.Int()
+
+    def mutate(self, info, file_id=None, **windows):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        file = None
+        if file_id is not None:
+            file = File.objects.filter(pk=file_id, owner=user).first()
+            if not file:
+                raise GraphQLError("Only the owner can set a retention policy.")
+        if "keep_last" in windows and (windows["keep_last"] is None or windows["keep_last"] < 1):
+            raise GraphQLError("keep_last must be at least 1.")
+        if any(value is not None and value < 0 for value in windows.values()):
+            raise GraphQLError("Retention windows cannot be negative.")
+        with transaction.atomic():
+            policy, _ = RetentionPolicy.objects.update_or_create(owner=user, file=file, defaults=windows)
+            if file is not None:
+                retention.schedule(file)
+        return SetRetentionPolicy(policy=policy)
+
+
+class ClearRetentionPolicy(graphene.Mutation):
+    """Keep every version again (of one file, or your default)."""
+
+    ok = graphene.Boolean()
+
+    class Arguments:
+        file_id = graphene.ID()
+
+    def mutate(self, info, file_id=None):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        RetentionPolicy.objects.filter(owner=user, file_id=file_id).delete()
+        return ClearRetentionPolicy(ok=True)
+
+
 class RenameFile(graphene.Mutation):
     file = graphene.Field(FileType)
 
@@ -339,12 +755,35 @@ class DeleteFile(graphene.Mutation):
         file = File.objects.filter(pk=file_id, owner=user).first()
         if not file:
             raise GraphQLError("Only the owner can delete this file.")
-        file.delete()
+        trash_files([file.pk])
         return DeleteFile(ok=True)
 
 
+class DeleteVersion(graphene.Mutation):
+    """Move a single version to the trash."""
+
+    ok = graphene.Boolean()
+
+    class Arguments:
+        version_id = graphene.ID(required=True)
+
+    def mutate(self, info, version_id):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        version = Version.objects.filter(pk=version_id, file__owner=user).first()
+        if not version:
+            raise GraphQLError("Only the owner can delete this version.")
+        if not Version.objects.filter(file_id=version.file_id).exclude(pk=version.pk).exists():
+            raise GraphQLError("A file needs at least one version; delete the file instead.")
+        trash_versions([version.pk])
+        return DeleteVersion(ok=True)
+
+
 class FilesMutation(graphene.ObjectType):
+    prepare_upload         = PrepareUpload.Field()
     upload_file            = UploadFile.Field()
+    upload_files           = UploadFiles.Field()
     add_file_version       = AddFileVersion.Field()
     share_file_with_user   = ShareFileWithUser.Field()
     share_file_with_group  = ShareFileWithGroup.Field()
@@ -352,5 +791,9 @@ class FilesMutation(graphene.ObjectType):
     update_file_share      = UpdateFileShare.Field()
     revoke_file_share      = RevokeFileShare.Field()
     keep_file              = KeepFile.Field()
+    set_version_storage    = SetVersionStorage.Field()
+    set_retention_policy   = SetRetentionPolicy.Field()
+    clear_retention_policy = ClearRetentionPolicy.Field()
     rename_file            = RenameFile.Field()
     delete_file            = DeleteFile.Field()
+    delete_version         = DeleteVersion.Field()
@@ -0,0 +1,18 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from accounts.models import GroupMember
+from chat.models import ChannelMembership
+from . import tokens
+
+
+@receiver(post_delete, sender=GroupMember)
+def rotate_links_on_group_leave(sender, instance, **kwargs):
+    """A member leaving a group may lose files shared with it; kill their links."""
+    tokens.rotate_for_groups([instance.group_id])
+
+
+@receiver(post_delete, sender=ChannelMembership)
+def rotate_links_on_channel_leave(sender, instance, **kwargs):
+    """A member leaving a channel may lose its attachments; kill their links."""
+    tokens.rotate_for_channels([instance.channel_id])
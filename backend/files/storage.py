@@ -0,0 +1,24 @@
+"""Selection of the storage backend behind ``File.upload``/``Version.upload``."""
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+
+def blob_storage():
+    """
+    Storage for file blobs, chosen by ``VAULT_BLOB_STORAGE``.
+
+    ``local`` is the plain ``MEDIA_ROOT`` filesystem; ``chunked`` stores
+    content-defined chunks with cross-version dedupe; ``s3`` keeps blobs in
+    an S3-protocol bucket configured by ``VAULT_S3``.
+    """
+    backend = getattr(settings, "VAULT_BLOB_STORAGE", "local")
+    if backend == "chunked":
+        from files.chunkstore import ChunkedStorage
+
+        return ChunkedStorage()
+    if backend == "s3":
+        from files.s3storage import S3Storage
+
+        return S3Storage()
+    return default_storage
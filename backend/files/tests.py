@@ -1,3 +1,1191 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from graphql import GraphQLError
+
+from jobs.queue import run_pending
+from .models import File, Version
+from .schema import AddFileVersion, PrepareUpload, UploadFile
+
+
+def edited_contents(count):
+    """``count`` successive 64 KiB versions, each a small edit of the last."""
+    import random
+
+    rng = random.Random(3)
+    data = bytearray(rng.getrandbits(8) for _ in range(64 * 1024))
+    contents = []
+    for i in range(count):
+        data[i * 1000:i * 1000 + 4] = b"edit"
+        contents.append(bytes(data))
+    return contents
+
+
+class MediaRootMixin:
+    """Point MEDIA_ROOT at a throwaway directory for the duration of a test."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.override = override_settings(MEDIA_ROOT=self.media_root)
+        self.override.enable()
+
+    def tearDown(self):
+        self.override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super().tearDown()
+
+    def _streamed(self, name, content):
+        """An upload as the streaming handler leaves it: already in storage."""
+        from .uploadhandlers import StreamingUploadHandler
+
+        handler = StreamingUploadHandler()
+        handler.stream = True
+        handler.new_file("file", name, "application/octet-stream", len(content))
+        handler.receive_data_chunk(content, 0)
+        return handler.file_complete(len(content))
+
+    def _stored(self):
+        return [name for _root, _dirs, names in os.walk(self.media_root) for name in names]
+
+    def _info_for(self, user):
+        return SimpleNamespace(
+            context=SimpleNamespace(
+                user=user,
+                build_absolute_uri=lambda path="": f"http://testserver{path}",
+            )
+        )
+
+
+class HashFirstUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User = get_user_model()
+        self.user = User.objects.create_user(username="user", password="pw")
+        self.other = User.objects.create_user(username="other", password="pw")
+        self.digest = hashlib.sha256(b"payload").hexdigest()
+
+    def _upload(self, user, **kwargs):
+        return UploadFile().mutate(self._info_for(user), name="doc.txt", **kwargs)
+
+    def test_prepare_upload_reports_known_content(self):
+        info = self._info_for(self.user)
+        self.assertFalse(PrepareUpload().mutate(info, sha256=self.digest, size=7).exists)
+
+        self._upload(self.user, upload=SimpleUploadedFile("doc.txt", b"payload"))
+
+        self.assertTrue(PrepareUpload().mutate(info, sha256=self.digest, size=7).exists)
+        self.assertFalse(PrepareUpload().mutate(info, sha256=self.digest, size=8).exists)
+
+    def test_prepare_upload_ignores_content_user_cannot_read(self):
+        self._upload(self.other, upload=SimpleUploadedFile("doc.txt", b"payload"))
+
+        result = PrepareUpload().mutate(self._info_for(self.user), sha256=self.digest, size=7)
+        self.assertFalse(result.exists)
+
+    def test_upload_by_hash_reuses_blob(self):
+        first = self._upload(self.user, upload=SimpleUploadedFile("doc.txt", b"payload"))
+
+        second = self._upload(self.user, sha256=self.digest)
+
+        self.assertNotEqual(second.file.id, first.file.id)
+        self.assertEqual(second.file.upload.name, first.file.upload.name)
+        self.assertEqual(second.version.upload.name, first.version.upload.name)
+        self.assertEqual(second.version.size, 7)
+
+        # a copy streamed along with a known hash is dropped
+        third = self._upload(self.user, sha256=self.digest, upload=self._streamed("doc.txt", b"payload"))
+        self.assertEqual(third.version.upload.name, first.version.upload.name)
+        self.assertEqual(len(self._stored()), 1)
+
+    def test_add_version_by_hash(self):
+        first = self._upload(self.user, upload=SimpleUploadedFile("doc.txt", b"payload"))
+
+        result = AddFileVersion().mutate(
+            self._info_for(self.user), file_id=first.file.id, sha256=self.digest, note="again"
+        )
+
+        self.assertEqual(result.version.upload.name, first.version.upload.name)
+        self.assertEqual(Version.objects.filter(file=first.file).count(), 2)
+
+    def test_unknown_hash_requires_upload(self):
+        with self.assertRaises(GraphQLError):
+            self._upload(self.user, sha256=self.digest)
+        self.assertFalse(File.objects.exists())
+
+
+class StreamingUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.client.force_login(self.user)
+
+    def _post_upload(self, name, content):
+        operations = {
+            "query": (
+                "mutation($name: String!, $upload: Upload!) {"
+                " uploadFile(name: $name, upload: $upload) { version { id } } }"
+            ),
+            "variables": {"name": name, "upload": None},
+        }
+        return self.client.post(
+            "/graphql/",
+            data={
+                "operations": json.dumps(operations),
+                "map": json.dumps({"0": ["variables.upload"]}),
+                "0": SimpleUploadedFile(name, content),
+            },
+        )
+
+    def test_upload_records_metadata_in_one_pass(self):
+        content = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+        response = self._post_upload("pic.bin", content)
+        self.assertNotIn("errors", response.json())
+
+        version = Version.objects.get()
+        self.assertEqual(version.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(version.size, len(content))
+        self.assertEqual(version.content_type, "image/png")
+        self.assertEqual(version.upload.name, version.file.upload.name)
+        with version.upload.open("rb") as fh:
+            self.assertEqual(fh.read(), content)
+
+    def test_duplicate_upload_shares_blob(self):
+        self._post_upload("a.txt", b"same bytes")
+        self._post_upload("b.txt", b"same bytes")
+
+        names = set(Version.objects.values_list("upload", flat=True))
+        self.assertEqual(len(names), 1)
+        stored = []
+        for _root, _dirs, files in os.walk(self.media_root):
+            stored.extend(files)
+        self.assertEqual(len(stored), 1)
+
+    def test_refused_uploads_leave_nothing_in_storage(self):
+        owner = get_user_model().objects.create_user(username="owner", password="pw")
+        file = File.objects.create(owner=owner, name="theirs.txt", upload="uploads/theirs.txt")
+        operations = {
+            "query": (
+                "mutation($id: ID!, $upload: Upload!) {"
+                " addFileVersion(fileId: $id, upload: $upload) { version { id } } }"
+            ),
+            "variables": {"id": str(file.pk), "upload": None},
+        }
+        response = self.client.post(
+            "/graphql/",
+            data={
+                "operations": json.dumps(operations),
+                "map": json.dumps({"0": ["variables.upload"]}),
+                "0": SimpleUploadedFile("mine.txt", b"not yours"),
+            },
+        )
+        self.assertIn("errors", response.json())
+        self.assertEqual(self._stored(), [])
+
+        self.client.logout()
+        response = self._post_upload("anon.txt", b"no account")
+        self.assertIn("errors", response.json())
+        self.assertEqual(self._stored(), [])
+
+    def test_bulk_upload_into_node(self):
+        from graph.models import Node, NodeFile
+        from jobs.models import Job
+
+        node = Node.objects.create(owner=self.user, name="Photos")
+        contents = [b"one", b"two", b"one", b"\x89PNG\r\n\x1a\n" + b"\x00" * 10]
+        operations = {
+            "query": (
+                "mutation($uploads: [Upload!]!, $node: ID) {"
+                " uploadFiles(uploads: $uploads, nodeId: $node) { files { name } } }"
+            ),
+            "variables": {"uploads": [None] * len(contents), "node": str(node.pk)},
+        }
+        data = {
+            "operations": json.dumps(operations),
+            "map": json.dumps({str(i): [f"variables.uploads.{i}"] for i in range(len(contents))}),
+        }
+        for i, content in enumerate(contents):
+            data[str(i)] = SimpleUploadedFile(f"f{i}.txt", content)
+        response = self.client.post("/graphql/", data=data)
+        body = response.json()
+        self.assertNotIn("errors", body)
+
+        self.assertEqual([f["name"] for f in body["data"]["uploadFiles"]["files"]], ["f0.txt", "f1.txt", "f2.txt", "f3.txt"])
+        self.assertEqual(NodeFile.objects.filter(node=node).count(), 4)
+        versions = {v.file.name: v for v in Version.objects.select_related("file")}
+        self.assertEqual(versions["f0.txt"].upload.name, versions["f2.txt"].upload.name)
+        self.assertEqual(versions["f3.txt"].content_type, "image/png")
+        stored = []
+        for _root, _dirs, files in os.walk(self.media_root):
+            stored.extend(files)
+        self.assertEqual(len(stored), 3)
+        # one derivative job per distinct content
+        self.assertEqual(Job.objects.filter(task__endswith="generate_for").count(), 3)
+
+
+class BulkUploadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+
+    def test_writes_unstreamed_uploads_and_reuses_stored_content(self):
+        from .schema import UploadFiles
+
+        first = UploadFile().mutate(self.info, name="old.txt", upload=SimpleUploadedFile("old.txt", b"kept"))
+        result = UploadFiles().mutate(self.info, uploads=[
+            SimpleUploadedFile("a.txt", b"kept"),
+            SimpleUploadedFile("b.txt", b"fresh"),
+        ])
+
+        self.assertEqual([f.name for f in result.files], ["a.txt", "b.txt"])
+        self.assertEqual(result.versions[0].upload.name, first.version.upload.name)
+        with result.versions[1].upload.open("rb") as fh:
+            self.assertEqual(fh.read(), b"fresh")
+        self.assertEqual(Version.objects.get(pk=result.versions[1].pk).file_id, result.files[1].pk)
+
+    def test_bulk_inserts_without_returned_ids(self):
+        from django.db import connection
+
+        from vault.subscriptions import FileUpdates
+        from .schema import UploadFiles
+
+        uploads = [SimpleUploadedFile(f"{i}.txt", f"body {i}".encode()) for i in range(3)]
+        # as on MySQL
+        with mock.patch.dict(connection.features.__dict__, {"can_return_rows_from_bulk_insert": False}), \
+                mock.patch.object(FileUpdates, "notify") as notify, \
+                self.captureOnCommitCallbacks(execute=True):
+            result = UploadFiles().mutate(self.info, uploads=uploads)
+
+        notify.assert_called_once_with(self.user.pk)
+        self.assertEqual([f.name for f in result.files], ["0.txt", "1.txt", "2.txt"])
+        for file, version in zip(result.files, result.versions):
+            self.assertEqual(Version.objects.get(pk=version.pk).file_id, file.pk)
+            self.assertEqual(File.objects.get(pk=file.pk).name, file.name)
+        self.assertFalse(File.objects.filter(import_key__isnull=False).exists())
+
+    def test_rejects_foreign_node_before_storing(self):
+        from graph.models import Node
+        from .schema import UploadFiles
+
+        stranger = get_user_model().objects.create_user(username="stranger", password="pw")
+        node = Node.objects.create(owner=stranger, name="Theirs")
+        with self.assertRaises(GraphQLError):
+            UploadFiles().mutate(self.info, uploads=[SimpleUploadedFile("a.txt", b"x")], node_id=node.pk)
+        self.assertFalse(File.all_objects.exists())
+
+        # streamed uploads were written before the mutation ran
+        upload = self._streamed("b.txt", b"y")
+        self.assertEqual(self._stored(), ["b.txt"])
+        with self.assertRaises(GraphQLError):
+            UploadFiles().mutate(self.info, uploads=[upload], node_id=node.pk)
+        self.assertEqual(self._stored(), [])
+
+
+class StorageUsageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+
+    def _usage(self, **scope):
+        from .models import StorageUsage
+
+        row = StorageUsage.objects.filter(**scope).first()
+        return (row.logical_bytes, row.physical_bytes) if row else (0, 0)
+
+    def test_counters_follow_uploads_links_and_trash(self):
+        from graph.models import Node
+        from graph.schema import AddFileToNode, RemoveFileFromNode
+        from vault.deletion import restore_files, trash_files
+        from . import usage
+
+        a = UploadFile().mutate(self.info, name="a.txt", upload=SimpleUploadedFile("a.txt", b"0123456789"))
+        b = UploadFile().mutate(self.info, name="b.txt", upload=SimpleUploadedFile("b.txt", b"0123456789"))
+        AddFileVersion().mutate(self.info, file_id=a.file.id, upload=SimpleUploadedFile("a.txt", b"abcde"))
+        self.assertEqual(self._usage(user=self.user), (25, 15))
+
+        node = Node.objects.create(owner=self.user, name="Docs")
+        AddFileToNode().mutate(self.info, node_id=node.pk, file_id=a.file.id)
+        AddFileToNode().mutate(self.info, node_id=node.pk, file_id=b.file.id)
+        self.assertEqual(self._usage(node=node), (25, 15))
+        RemoveFileFromNode().mutate(self.info, node_id=node.pk, file_id=a.file.id)
+        self.assertEqual(self._usage(node=node), (10, 10))
+
+        trash_files([b.file.id])
+        self.assertEqual(self._usage(user=self.user), (15, 15))
+        self.assertEqual(self._usage(node=node), (0, 0))
+        restore_files([b.file.id])
+        self.assertEqual(self._usage(user=self.user), (25, 15))
+
+        self.assertEqual(usage.reconcile()["fixed"], [])
+        from .models import StorageUsage
+
+        StorageUsage.objects.filter(user=self.user).update(logical_bytes=1, physical_bytes=2)
+        report = usage.reconcile()
+        self.assertEqual(report["fixed"], [(f"user={self.user.pk}", (1, 2), (25, 15))])
+        self.assertEqual(self._usage(user=self.user), (25, 15))
+
+    @override_settings(STORAGE_QUOTA_BYTES=20)
+    def test_quota_refuses_uploads_before_storing(self):
+        from .schema import FilesQuery
+
+        UploadFile().mutate(self.info, name="a.txt", upload=SimpleUploadedFile("a.txt", b"x" * 15))
+        with self.assertRaisesMessage(GraphQLError, "quota"):
+            UploadFile().mutate(self.info, name="b.txt", upload=SimpleUploadedFile("b.txt", b"y" * 10))
+        self.assertEqual(File.objects.count(), 1)
+        usage = FilesQuery().resolve_storage_usage(self.info)
+        self.assertEqual((usage.logical_bytes, usage.quota_bytes, usage.remaining_bytes), (15, 20, 5))
+
+        # the streaming handler gives up mid-request and removes what it wrote
+        self.client.force_login(self.user)
+        operations = {
+            "query": "mutation($u: Upload!) { uploadFile(name: \"c\", upload: $u) { file { id } } }",
+            "variables": {"u": None},
+        }
+        response = self.client.post("/graphql/", data={
+            "operations": json.dumps(operations),
+            "map": json.dumps({"0": ["variables.u"]}),
+            "0": SimpleUploadedFile("c.bin", b"z" * 1000),
+        })
+        self.assertEqual(response.status_code, 400)
+        stored = []
+        for _root, _dirs, files in os.walk(self.media_root):
+            stored.extend(files)
+        self.assertEqual(len(stored), 1)
+
+
+class SniffContentTypeTests(TestCase):
+    def test_magic_numbers_and_fallbacks(self):
+        from .uploadhandlers import sniff_content_type
+
+        self.assertEqual(sniff_content_type(b"%PDF-1.7 ...", "x.bin"), "application/pdf")
+        self.assertEqual(sniff_content_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ", ""), "image/webp")
+        self.assertEqual(sniff_content_type(b"hello world", "notes"), "text/plain")
+        self.assertEqual(sniff_content_type(b"a,b\n1,2", "t.csv"), "text/csv")
+        self.assertEqual(
+            sniff_content_type(b"PK\x03\x04rest", "r.docx"),
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
+        self.assertEqual(sniff_content_type(b"\x00\x01\x02", ""), "application/octet-stream")
+
+
+class DeltaCodecTests(TestCase):
+    def _roundtrip(self, base, target):
+        import io
+
+        from .delta import diff, patch
+
+        out = io.BytesIO()
+        diff(io.BytesIO(base), io.BytesIO(target), out, block_size=64)
+        out.seek(0)
+        rebuilt = b"".join(patch(io.BytesIO(base), out))
+        self.assertEqual(rebuilt, target)
+        return out.getvalue()
+
+    def test_edits_produce_small_deltas(self):
+        import random
+
+        rng = random.Random(7)
+        base = bytes(rng.getrandbits(8) for _ in range(20000))
+        target = base[:5000] + b"inserted" + base[5000:12000] + base[12100:] + b"tail"
+
+        encoded = self._roundtrip(base, target)
+        self.assertLess(len(encoded), len(target) // 10)
+
+    def test_unrelated_and_empty_inputs(self):
+        self._roundtrip(b"", b"")
+        self._roundtrip(b"abc", b"")
+        self._roundtrip(b"", b"completely new content")
+        self._roundtrip(b"x" * 1000, b"y" * 999)
+
+
+class DeltaVersionStorageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_override = override_settings(VERSION_CACHE_DIR=os.path.join(self.media_root, "_cache"))
+        self.cache_override.enable()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+
+    def tearDown(self):
+        self.cache_override.disable()
+        super().tearDown()
+
+    def _contents(self, count):
+        return edited_contents(count)
+
+    def test_older_versions_become_deltas(self):
+        from .delta import iter_version
+        from .schema import SetVersionStorage
+
+        contents = self._contents(4)
+        created = UploadFile().mutate(
+            self.info, name="big.bin", upload=SimpleUploadedFile("big.bin", contents[0])
+        )
+        SetVersionStorage().mutate(self.info, file_id=created.file.id, mode="DELTA", rebase_every=3)
+        for content in contents[1:]:
+            AddFileVersion().mutate(
+                self.info, file_id=created.file.id, upload=SimpleUploadedFile("big.bin", content)
+            )
+        # compaction runs as a background job
+        self.assertEqual(run_pending(), 3)
+
+        versions = list(Version.objects.filter(file=created.file).order_by("created_at", "id"))
+        # v0 is a keyframe, v1 and v2 are deltas, the head stays whole
+        self.assertEqual(
+            [v.delta_base_id is not None for v in versions], [False, True, True, False]
+        )
+        self.assertLess(versions[1].upload.size, len(contents[1]) // 10)
+        for version, content in zip(versions, contents):
+            self.assertEqual(b"".join(iter_version(version)), content)
+
+        self.client.force_login(self.user)
+        response = self.client.get(f"/files/versions/{versions[1].id}/download/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), contents[1])
+
+    def test_old_blob_outlives_the_compaction_and_large_versions_stay_whole(self):
+        from .schema import SetVersionStorage
+
+        contents = self._contents(4)
+        created = UploadFile().mutate(
+            self.info, name="big.bin", upload=SimpleUploadedFile("big.bin", contents[0])
+        )
+        SetVersionStorage().mutate(self.info, file_id=created.file.id, mode="DELTA", rebase_every=5)
+        added = [
+            AddFileVersion().mutate(
+                self.info, file_id=created.file.id, upload=SimpleUploadedFile("big.bin", content)
+            ).version
+            for content in contents[1:3]
+        ]
+        whole = added[0].upload.name
+        run_pending(["versions"])
+        # the blob goes in a job of its own, after the delta has committed
+        self.assertIsNotNone(Version.objects.get(pk=added[0].pk).delta_base_id)
+        self.assertTrue(added[0].upload.storage.exists(whole))
+        run_pending()
+        self.assertFalse(added[0].upload.storage.exists(whole))
+
+        with override_settings(DELTA_MAX_BYTES=len(contents[2]) - 1):
+            AddFileVersion().mutate(
+                self.info, file_id=created.file.id, upload=SimpleUploadedFile("big.bin", contents[3])
+            )
+            run_pending()
+        self.assertIsNone(Version.objects.get(pk=added[1].pk).delta_base_id)
+
+    def test_download_requires_read_access(self):
+        contents = self._contents(2)
+        created = UploadFile().mutate(
+            self.info, name="big.bin", upload=SimpleUploadedFile("big.bin", contents[0])
+        )
+        stranger = get_user_model().objects.create_user(username="stranger", password="pw")
+        self.client.force_login(stranger)
+
+        response = self.client.get(f"/files/versions/{created.version.id}/download/")
+        self.assertEqual(response.status_code, 404)
+
+
+class SignedDownloadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from django.core.cache import cache
+
+        cache.clear()
+        User = get_user_model()
+        self.user = User.objects.create_user(username="user", password="pw")
+        self.other = User.objects.create_user(username="other", password="pw")
+        self.info = self._info_for(self.user)
+        self.created = UploadFile().mutate(
+            self.info, name="notes.txt", upload=SimpleUploadedFile("notes.txt", b"signed bytes")
+        )
+
+    def _url(self, user, target=None):
+        from .schema import FileType
+
+        url = (target or FileType).resolve_download_url(
+            self.created.version if target else self.created.file, self._info_for(user)
+        )
+        return url.replace("http://testserver", "")
+
+    def test_signed_link_needs_no_access_checks(self):
+        url = self._url(self.user)
+        # only the lookup of the file itself
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"signed bytes")
+        self.assertIn('filename="notes.txt"', response["Content-Disposition"])
+
+        from .schema import VersionType
+
+        response = self.client.get(self._url(self.user, VersionType))
+        self.assertEqual(b"".join(response.streaming_content), b"signed bytes")
+
+    def test_tampered_or_expired_links_are_refused(self):
+        url = self._url(self.user)
+        self.assertEqual(self.client.get(url[:-1] + ("0" if url[-1] != "0" else "1")).status_code, 404)
+        # a file link does not open a version with the same id
+        version_url = f"/files/versions/{self.created.file.id}/download/?{url.split('?')[1]}"
+        self.assertEqual(self.client.get(version_url).status_code, 404)
+        with override_settings(DOWNLOAD_LINK_SECONDS=-600, DOWNLOAD_LINK_ROUNDING=1):
+            expired = self._url(self.user)
+        self.assertEqual(self.client.get(expired).status_code, 404)
+        # without a link the caller's own access decides
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url.split("?")[0]).status_code, 404)
+
+    def test_revoking_a_share_invalidates_its_links(self):
+        from .schema import RevokeFileShare, ShareFileWithUser
+
+        share = ShareFileWithUser().mutate(
+            self.info, file_id=self.created.file.id, user_id=self.other.id, permission="R"
+        ).share
+        url = self._url(self.other)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            RevokeFileShare().mutate(self.info, share_id=share.id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(self._url(self.user)).status_code, 200)
+
+    def test_links_follow_group_membership_and_need_access_to_issue(self):
+        from accounts.models import Group, GroupMember
+        from .models import FileShare
+        from .schema import VersionType
+
+        with self.assertRaises(GraphQLError):
+            self._url(self.other, VersionType)
+
+        group = Group.objects.create(name="Team", owner=self.user)
+        membership = GroupMember.objects.create(group=group, user=self.other)
+        FileShare.objects.create(file=self.created.file, shared_with_group=group, permission=FileShare.READ)
+        url = self._url(self.other, VersionType)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        # leaving the group rotates the keys of the files shared with it
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_trashing_a_file_invalidates_its_links(self):
+        from vault.deletion import restore_files, trash_files
+
+        url = self._url(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            trash_files([self.created.file.id])
+        restore_files([self.created.file.id])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class RetentionTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_override = override_settings(VERSION_CACHE_DIR=os.path.join(self.media_root, "_cache"))
+        self.cache_override.enable()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+
+    def tearDown(self):
+        self.cache_override.disable()
+        super().tearDown()
+
+    def test_selection_keeps_last_daily_and_monthly(self):
+        from datetime import datetime, timedelta
+        from django.utils import timezone
+        from .models import RetentionPolicy
+        from .retention import select_prunable
+
+        now = timezone.make_aware(datetime(2024, 6, 30, 12))
+        # two versions a day, newest first, for 90 days
+        versions = [(i, now - timedelta(hours=12 * i)) for i in range(180)]
+        policy = RetentionPolicy(keep_last=3, keep_daily_days=7, keep_weekly_weeks=0, keep_monthly_months=None)
+        kept = sorted(set(range(180)) - set(select_prunable(versions, policy, now)))
+        # 0-2 by count, the newest of each of the last 7 days, the newest of May and of April
+        self.assertEqual(kept, [0, 1, 2, 4, 6, 8, 10, 12, 60, 122])
+
+    def test_pruning_rebases_surviving_deltas(self):
+        from chat.models import Channel, Message
+        from .delta import iter_version
+        from .models import StorageUsage
+        from .schema import SetRetentionPolicy, SetVersionStorage
+
+        contents = edited_contents(4)
+        created = UploadFile().mutate(
+            self.info, name="big.bin", upload=SimpleUploadedFile("big.bin", contents[0])
+        )
+        SetVersionStorage().mutate(self.info, file_id=created.file.id, mode="DELTA")
+        for content in contents[1:]:
+            AddFileVersion().mutate(
+                self.info, file_id=created.file.id, upload=SimpleUploadedFile("big.bin", content)
+            )
+        run_pending()
+        v0, v1, v2, v3 = Version.objects.filter(file=created.file).order_by("created_at", "id")
+        self.assertEqual(v1.delta_base_id, v2.pk)
+        # attached to a chat message, so it survives pruning
+        channel = Channel.objects.create(channel_type=Channel.PUBLIC, name="c")
+        Message.objects.create(channel=channel, sender=self.user, attachment=v1)
+
+        SetRetentionPolicy().mutate(self.info, file_id=created.file.id, keep_last=1)
+        run_pending()
+
+        remaining = list(Version.objects.filter(file=created.file).order_by("created_at", "id"))
+        self.assertEqual([v.pk for v in remaining], [v1.pk, v3.pk])
+        self.assertEqual(remaining[0].delta_base_id, v3.pk)
+        self.assertEqual(b"".join(iter_version(remaining[0])), contents[1])
+        self.assertEqual(StorageUsage.objects.get(user=self.user).logical_bytes, len(contents[1]) + len(contents[3]))
+
+    def test_pruning_diffs_outside_the_lock_and_rechecks_under_it(self):
+        from unittest import mock
+
+        from django.db import connection
+
+        from chat.models import Channel, Message
+        from . import delta
+        from .delta import iter_version
+        from .models import RetentionPolicy
+        from .retention import prune_file
+        from .schema import SetVersionStorage
+
+        contents = edited_contents(4)
+        created = UploadFile().mutate(
+            self.info, name="big.bin", upload=SimpleUploadedFile("big.bin", contents[0])
+        )
+        SetVersionStorage().mutate(self.info, file_id=created.file.id, mode="DELTA")
+        for content in contents[1:]:
+            AddFileVersion().mutate(
+                self.info, file_id=created.file.id, upload=SimpleUploadedFile("big.bin", content)
+            )
+        run_pending()
+        v0, v1, v2, v3 = Version.objects.filter(file=created.file).order_by("created_at", "id")
+        channel = Channel.objects.create(channel_type=Channel.PUBLIC, name="c")
+        Message.objects.create(channel=channel, sender=self.user, attachment=v1)
+        depth = len(connection.savepoint_ids)
+        depths = []
+        real_write, real_plan = delta._write_delta, delta.plan_rebase
+
+        def write_delta(*args):
+            depths.append(len(connection.savepoint_ids))
+            return real_write(*args)
+
+        def plan_then_compact(version_ids):
+            plans = real_plan(version_ids)
+            # v1 is rewritten by someone else after it was planned
+            delta.materialize(Version.objects.get(pk=v1.pk))
+            return plans
+
+        policy = RetentionPolicy(owner=self.user, keep_last=1)
+        with mock.patch.object(delta, "_write_delta", side_effect=write_delta), \
+                mock.patch.object(delta, "plan_rebase", side_effect=plan_then_compact):
+            pruned = prune_file(created.file, policy, batch_size=1)
+
+        self.assertEqual(pruned, [v2.pk, v0.pk])
+        # the diffs ran outside the transaction of every batch
+        self.assertTrue(depths)
+        self.assertEqual(set(depths), {depth})
+        # the stale plan was dropped, not applied over the newer blob
+        v1.refresh_from_db()
+        self.assertIsNone(v1.delta_base_id)
+        self.assertEqual(b"".join(iter_version(v1)), contents[1])
+
+
+class ChunkedStorageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from .chunkstore import ChunkedStorage
+
+        self.storage = ChunkedStorage(location=self.media_root)
+
+    def _payload(self, seed, size):
+        import random
+
+        rng = random.Random(seed)
+        return bytes(rng.getrandbits(8) for _ in range(size))
+
+    def test_similar_blobs_share_chunks(self):
+        from django.core.files.base import ContentFile
+
+        from .models import Chunk
+
+        base = self._payload(1, 600 * 1024)
+        edited = base[:300 * 1024] + b"a small edit" + base[300 * 1024:]
+
+        first = self.storage.save("uploads/a.bin", ContentFile(base))
+        chunks_after_first = Chunk.objects.count()
+        second = self.storage.save("uploads/b.bin", ContentFile(edited))
+
+        new_chunks = Chunk.objects.count() - chunks_after_first
+        self.assertGreater(chunks_after_first, 2)
+        self.assertLessEqual(new_chunks, 2)
+        with self.storage.open(first) as fh:
+            self.assertEqual(fh.read(), base)
+        with self.storage.open(second) as fh:
+            fh.seek(300 * 1024)
+            self.assertEqual(fh.read(12), b"a small edit")
+        self.assertEqual(self.storage.size(second), len(edited))
+
+    def test_boundaries_follow_content_after_an_insert(self):
+        from .chunkstore import iter_chunks
+
+        base = self._payload(4, 1024 * 1024)
+        edited = b"shifted" + base
+        first = list(iter_chunks(io.BytesIO(base)))
+        second = list(iter_chunks(io.BytesIO(edited)))
+        self.assertGreater(len({len(chunk) for chunk in first}), 1)
+        # only the chunk holding the insert changes
+        self.assertEqual(first[1:], second[1:])
+
+    def test_failed_save_gives_back_its_chunk_references(self):
+        from django.core.files.base import ContentFile
+
+        from .models import Chunk
+
+        inner_save = self.storage.inner.save
+
+        def fail_on_manifest(name, content, max_length=None):
+            if name.startswith("uploads/"):
+                raise OSError("disk full")
+            return inner_save(name, content, max_length)
+
+        with mock.patch.object(self.storage.inner, "save", side_effect=fail_on_manifest):
+            with self.assertRaises(OSError):
+                self.storage.save("uploads/d.bin", ContentFile(self._payload(5, 200 * 1024)))
+        self.assertTrue(Chunk.objects.exists())
+        self.assertFalse(Chunk.objects.filter(refcount__gt=0).exists())
+
+    def test_delete_releases_chunks_for_gc(self):
+        from django.core.files.base import ContentFile
+
+        from .chunkstore import collect_chunks
+        from .models import Chunk
+
+        shared = self._payload(2, 200 * 1024)
+        first = self.storage.save("uploads/a.bin", ContentFile(shared))
+        second = self.storage.save("uploads/b.bin", ContentFile(shared + b"extra"))
+
+        self.storage.delete(first)
+        # only the tail chunk differs; everything else is still used by `second`
+        self.assertLessEqual(collect_chunks(self.storage, dry_run=True)[0], 1)
+        self.assertTrue(Chunk.objects.filter(refcount__gt=0).exists())
+
+        self.storage.delete(second)
+        removed, _size = collect_chunks(self.storage)
+        self.assertGreater(removed, 0)
+        self.assertFalse(Chunk.objects.exists())
+        leftover = [f for _r, _d, files in os.walk(os.path.join(self.media_root, "chunks")) for f in files]
+        self.assertEqual(leftover, [])
+
+    def test_blob_view_serves_ranges(self):
+        from django.core.files.base import ContentFile
+
+        payload = self._payload(3, 100 * 1024)
+        name = self.storage.save("uploads/c.bin", ContentFile(payload))
+
+        with override_settings(VAULT_BLOB_STORAGE="chunked"):
+            response = self.client.get(f"/files/blobs/{name}", HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), payload[10:20])
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(payload)}")
+
+
+@skipUnless(os.environ.get("VAULT_TEST_S3_ENDPOINT"), "needs an S3 endpoint such as MinIO")
+class S3StorageTests(TestCase):
+    """
+    Run against a local stand-in, e.g. ``docker compose --profile s3 up
+    vault_minio vault_minio_init`` and ``VAULT_TEST_S3_ENDPOINT=http://localhost:9000``.
+    """
+
+    def setUp(self):
+        from .s3storage import S3Storage
+
+        self.storage = S3Storage({
+            "ENDPOINT_URL": os.environ["VAULT_TEST_S3_ENDPOINT"],
+            "ACCESS_KEY": os.environ.get("VAULT_TEST_S3_ACCESS_KEY", "vault"),
+            "SECRET_KEY": os.environ.get("VAULT_TEST_S3_SECRET_KEY", "s3cr3tpass"),
+            "BUCKET": os.environ.get("VAULT_TEST_S3_BUCKET", "vault"),
+            "LOCATION": f"tests/{os.getpid()}",
+            "ADDRESSING_STYLE": "path",
+            # the smallest part size S3 allows, so a small blob goes up in parts
+            "MULTIPART_THRESHOLD": 5 * 1024 ** 2,
+            "MULTIPART_CHUNKSIZE": 5 * 1024 ** 2,
+        })
+
+    def test_multipart_roundtrip_ranged_reads_and_presigned_url(self):
+        from urllib.request import urlopen
+        from django.core.files.base import ContentFile
+
+        content = os.urandom(11 * 1024 ** 2)
+        name = self.storage.save("uploads/big.bin", ContentFile(content))
+        self.addCleanup(self.storage.delete, name)
+
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.size(name), len(content))
+        self.assertEqual(self.storage.listdir("uploads")[1], ["big.bin"])
+        with self.storage.open(name) as fh:
+            fh.seek(len(content) - 100)
+            self.assertEqual(fh.read(), content[-100:])
+            fh.seek(10)
+            self.assertEqual(fh.read(20), content[10:30])
+        with urlopen(self.storage.url(name)) as response:
+            self.assertEqual(response.read(), content)
+
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+
+class OrphanCollectorTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+
+    def _blob(self, name, content, age_hours=2):
+        import time
+
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import default_storage
+
+        name = default_storage.save(name, ContentFile(content))
+        old = time.time() - age_hours * 3600
+        os.utime(default_storage.path(name), (old, old))
+        return name
+
+    def test_dry_run_then_collect(self):
+        from .blobs import collect_orphans
+
+        kept = self._blob("uploads/2020/01/01/kept.txt", b"kept")
+        File.objects.create(owner=self.user, name="kept.txt", upload=kept)
+        shared = self._blob("uploads/2020/01/01/versions/shared.txt", b"shared")
+        Version.objects.create(
+            file=File.objects.create(owner=self.user, name="s", upload=kept), upload=shared
+        )
+        orphan = self._blob("uploads/2020/01/01/orphan.txt", b"orphan!")
+        fresh = self._blob("uploads/2020/01/01/in-flight.txt", b"uploading", age_hours=0)
+
+        report = collect_orphans(dry_run=True)
+        self.assertEqual(report["names"], [orphan])
+        self.assertEqual(report["bytes"], 7)
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, orphan)))
+
+        report = collect_orphans(batch_size=1)
+        self.assertEqual(report["count"], 1)
+        for name in (kept, shared, fresh):
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, orphan)))
+
+
+class DeleteFileTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+
+    def test_delete_detaches_references_and_defers_blob_release(self):
+        from unittest import mock
+
+        from chat.models import Channel, Message
+        from graph.models import Node, NodeFile
+        from vault.deletion import delete_files
+
+        file = File.objects.create(owner=self.user, name="a.txt", upload="uploads/a.txt")
+        base = Version.objects.create(file=file, upload="uploads/a.txt")
+        Version.objects.create(file=file, upload="uploads/b.vdelta", delta_base=base)
+        node = Node.objects.create(owner=self.user, name="n")
+        NodeFile.objects.create(node=node, file=file)
+        channel = Channel.objects.create(channel_type=Channel.PUBLIC, name="c")
+        message = Message.objects.create(channel=channel, sender=self.user, attachment=base)
+        self.user.profile.avatar_file = file
+        self.user.profile.save()
+
+        with mock.patch("vault.deletion.release_later") as release_later, \
+                mock.patch("vault.deletion.NodeUpdates.notify_many") as notify_many, \
+                mock.patch("vault.deletion.MessageUpdates.notify") as notify_channel, \
+                self.captureOnCommitCallbacks(execute=True):
+            delete_files([file.pk])
+
+        self.assertFalse(File.all_objects.exists())
+        self.assertFalse(Version.all_objects.exists())
+        self.assertFalse(NodeFile.all_objects.exists())
+        message.refresh_from_db()
+        self.assertIsNone(message.attachment_id)
+        self.user.profile.refresh_from_db()
+        self.assertIsNone(self.user.profile.avatar_file_id)
+        release_later.assert_called_once_with({"uploads/a.txt", "uploads/b.vdelta"})
+        notify_many.assert_called_once_with({node.pk})
+        notify_channel.assert_called_once_with(channel.pk)
+
+
+class TrashTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+        self.file = UploadFile().mutate(
+            self.info, name="a.txt", upload=SimpleUploadedFile("a.txt", b"first")
+        ).file
+
+    def test_delete_restore_and_purge_file(self):
+        from datetime import timedelta
+
+        from vault.deletion import purge_trash
+        from vault.trash import Restore, TrashQuery
+        from .schema import DeleteFile
+
+        DeleteFile().mutate(self.info, file_id=self.file.id)
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(Version.objects.exists())
+        trash = TrashQuery().resolve_trash(self.info)
+        self.assertEqual(list(trash.files), [File.all_objects.get()])
+
+        Restore().mutate(self.info, file_ids=[self.file.id])
+        self.assertTrue(File.objects.filter(pk=self.file.pk).exists())
+
+        DeleteFile().mutate(self.info, file_id=self.file.id)
+        self.assertEqual(purge_trash()["files"], 0)
+        name = self.file.upload.name
+        report = purge_trash(retention=timedelta(0))
+        self.assertEqual(report["files"], 1)
+        self.assertFalse(File.all_objects.exists())
+        self.assertFalse(Version.all_objects.exists())
+        # the blob goes with the queued release job
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        run_pending()
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, name)))
+
+    def test_delete_version_keeps_the_last_one(self):
+        from .schema import DeleteVersion
+
+        first = Version.objects.get()
+        with self.assertRaises(GraphQLError):
+            DeleteVersion().mutate(self.info, version_id=first.id)
+        AddFileVersion().mutate(
+            self.info, file_id=self.file.id, upload=SimpleUploadedFile("a.txt", b"second")
+        )
+        DeleteVersion().mutate(self.info, version_id=first.id)
+        self.assertEqual(Version.objects.count(), 1)
+        self.assertEqual(self.file.versions.count(), 1)
+        self.assertEqual(Version.all_objects.count(), 2)
+
+
+class DiskCacheTests(MediaRootMixin, TestCase):
+    def test_writes_scan_only_when_the_estimate_passes_the_limit(self):
+        from . import cache as cache_module
+        from .cache import DiskCache
+
+        cache = DiskCache(self.media_root, max_bytes=1000)
+        with mock.patch.dict(cache_module._scans, clear=True), \
+                mock.patch.object(DiskCache, "prune", autospec=True, side_effect=DiskCache.prune) as prune:
+            for i in range(4):
+                with cache.writer(f"k{i}") as fh:
+                    fh.write(b"x" * 300)
+            # the first write scans; the next two fit the estimate
+            self.assertEqual(prune.call_count, 2)
+
+        sizes = [os.path.getsize(os.path.join(root, name)) for root, _dirs, names in os.walk(self.media_root) for name in names]
+        self.assertLessEqual(sum(sizes), 1000)
+        self.assertIsNotNone(cache.open("k3"))
+
+
+class DerivativeTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+
+    @staticmethod
+    def _png(size=(800, 600), color=(200, 30, 30)):
+        import io
+
+        from PIL import Image
+
+        out = io.BytesIO()
+        Image.new("RGB", size, color).save(out, "PNG")
+        return out.getvalue()
+
+    def test_upload_queues_thumbnails_shared_by_identical_content(self):
+        from jobs.models import Job
+        from .storage import blob_storage
+        from .derivatives import THUMBNAIL_SIZES, thumbnail_name
+        from .schema import FileType, VersionType
+
+        png = self._png()
+        created = UploadFile().mutate(self.info, name="a.png", upload=SimpleUploadedFile("a.png", png))
+        self.assertEqual(run_pending(), 1)
+        sha = created.version.sha256
+        for size in THUMBNAIL_SIZES:
+            self.assertTrue(blob_storage().exists(thumbnail_name(sha, size)))
+
+        again = UploadFile().mutate(self.info, name="b.png", upload=SimpleUploadedFile("b.png", png))
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(
+            VersionType.resolve_thumbnail_url(again.version, self.info, size=48),
+            f"http://testserver/media/{thumbnail_name(sha, 64)}",
+        )
+        self.assertIn("thumb-256", FileType.resolve_thumbnail_url(again.file, self.info, size=200))
+
+    def test_thumbnails_are_served_from_chunked_storage_without_lookups(self):
+        from unittest import mock
+
+        from .schema import VersionType
+
+        with override_settings(VAULT_BLOB_STORAGE="chunked"):
+            created = UploadFile().mutate(
+                self.info, name="a.png", upload=SimpleUploadedFile("a.png", self._png())
+            )
+            self.assertEqual(run_pending(), 1)
+            created.version.refresh_from_db()
+            with mock.patch("files.chunkstore.ChunkedStorage.exists") as exists:
+                url = VersionType.resolve_thumbnail_url(created.version, self.info, size=64)
+            exists.assert_not_called()
+            self.assertIn("/files/blobs/derivatives/", url)
+            response = self.client.get(url.replace("http://testserver", ""))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b"".join(response.streaming_content).startswith(b"RIFF"))
+
+    def test_missing_thumbnail_is_generated_by_the_view(self):
+        import io
+
+        from PIL import Image
+
+        from .schema import VersionType
+
+        created = UploadFile().mutate(
+            self.info, name="a.png", upload=SimpleUploadedFile("a.png", self._png())
+        )
+        url = VersionType.resolve_thumbnail_url(created.version, self.info, size=256)
+        self.assertEqual(url, f"http://testserver/files/versions/{created.version.id}/thumbnail/256/")
+
+        self.client.force_login(self.user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("immutable", response["Cache-Control"])
+        image = Image.open(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual((image.format, image.size), ("WEBP", (256, 192)))
+
+        stranger = get_user_model().objects.create_user(username="stranger", password="pw")
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_text_snippet_and_pdf_preview(self):
+        import io
+
+        import pypdfium2
+
+        from .derivatives import generate
+        from .schema import VersionType
+
+        text = UploadFile().mutate(
+            self.info, name="notes.txt", upload=SimpleUploadedFile("notes.txt", "héllo ".encode() * 200)
+        )
+        snippet = VersionType.resolve_text_snippet(text.version, self.info)
+        self.assertEqual(len(snippet), 500)
+        self.assertTrue(snippet.startswith("héllo héllo"))
+        self.assertIsNone(VersionType.resolve_thumbnail_url(text.version, self.info, size=64))
+
+        pdf = pypdfium2.PdfDocument.new()
+        pdf.new_page(200, 300)
+        out = io.BytesIO()
+        pdf.save(out)
+        doc = UploadFile().mutate(
+            self.info, name="doc.pdf", upload=SimpleUploadedFile("doc.pdf", out.getvalue())
+        )
+        self.assertEqual(doc.version.content_type, "application/pdf")
+        self.assertTrue(generate(doc.version))
+
+
+class ResizeTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache_override = override_settings(RESIZE_CACHE_DIR=os.path.join(self.media_root, "_resized"))
+        self.cache_override.enable()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+        self.file = UploadFile().mutate(
+            self.info, name="me.png", upload=SimpleUploadedFile("me.png", DerivativeTests._png())
+        ).file
+
+    def tearDown(self):
+        self.cache_override.disable()
+        super().tearDown()
+
+    def test_resize_is_permission_checked_and_cached(self):
+        import io
+
+        from PIL import Image
+
+        url = f"/media/resize/{self.file.id}"
+        stranger = get_user_model().objects.create_user(username="stranger", password="pw")
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(url, {"w": 64}).status_code, 404)
+
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url, {"w": "big"}).status_code, 400)
+        response = self.client.get(url, {"w": 60, "fmt": "jpeg"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "image/jpeg")
+        self.assertEqual(response["Cache-Control"], "private, max-age=300")
+        image = Image.open(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(image.size, (64, 48))
+        cached = os.listdir(os.path.join(self.media_root, "_resized"))
+        self.assertEqual(len(cached), 1)
+
+    def test_avatar_url_is_a_sized_public_variant(self):
+        from accounts.schema import ProfileType
+
+        profile = self.user.profile
+        profile.avatar_file = self.file
+        profile.save()
+
+        url = ProfileType.resolve_avatar_url(profile, self.info, size=32)
+        self.assertIn(f"/media/resize/{self.file.id}?w=32&fmt=webp&v=", url)
+        self.client.logout()
+        response = self.client.get(url.replace("http://testserver", ""))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+
+
+class ExportTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = get_user_model().objects.create_user(username="user", password="pw")
+        self.info = self._info_for(self.user)
+
+    def test_version_history_zip_streams_and_resumes(self):
+        import io
+        import zipfile
+
+        created = UploadFile().mutate(
+            self.info, name="notes.txt", upload=SimpleUploadedFile("notes.txt", b"one " * 1000)
+        )
+        for content in (b"two " * 1000, b"\x89PNG\r\n\x1a\n" + b"\x00" * 100):
+            AddFileVersion().mutate(
+                self.info, file_id=created.file.id, upload=SimpleUploadedFile("notes.txt", content)
+            )
+        self.client.force_login(self.user)
+        url = f"/files/{created.file.id}/versions.zip"
+
+        response = self.client.get(url)
+        self.assertEqual(response["X-Export-Total"], "3")
+        self.assertNotIn("X-Export-Next", response)
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ["notes v1.txt", "notes v2.txt", "notes v3.txt"])
+        self.assertEqual(archive.read("notes v2.txt"), b"two " * 1000)
+        self.assertIsNone(archive.testzip())
+        kinds = [info.compress_type for info in archive.infolist()]
+        self.assertEqual(kinds, [zipfile.ZIP_DEFLATED, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED])
+
+        response = self.client.get(url, {"start": 1, "count": 1})
+        self.assertEqual(response["X-Export-Next"], "2")
+        archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), ["notes v2.txt"])
+
+        stranger = get_user_model().objects.create_user(username="stranger", password="pw")
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(url).status_code, 404)
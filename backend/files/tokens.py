@@ -0,0 +1,102 @@
+"""
+Signed, expiring download links.
+
+``downloadUrl`` runs the share checks and hands out a link carrying
+``?t=<file id>.<user id>.<expiry>.<signature>``. The signature is an HMAC
+over the target (a file or a version), the file, the user, the expiry and
+the file's ``download_key`` generation. The download views accept a valid
+link without running any share or membership queries.
+
+Anything that can take read access away bumps ``download_key`` instead,
+which invalidates every link issued for the file: changing or revoking a
+share, trashing the file or one of its versions, and removing a group or
+channel membership the access may have come through (see ``files.signals``).
+The current generation is read through the cache. With a per-process
+cache, other processes see a rotation within ``DOWNLOAD_KEY_CACHE_SECONDS``;
+a shared cache makes it immediate.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from files.models import File, FileShare, Version
+
+SALT = "files.tokens.download"
+
+
+def _cache_key(file_id):
+    return f"files:download-key:{file_id}"
+
+
+def key_generation(file_id):
+    """The file's current ``download_key``, or ``None`` if there is no such file."""
+    generation = cache.get(_cache_key(file_id))
+    if generation is None:
+        generation = File.all_objects.filter(pk=file_id).values_list("download_key", flat=True).first()
+        if generation is None:
+            return None
+        cache.set(_cache_key(file_id), generation, settings.DOWNLOAD_KEY_CACHE_SECONDS)
+    return generation
+
+
+def rotate(file_ids):
+    """Invalidate every download link issued for ``file_ids``."""
+    file_ids = list(file_ids)
+    File.all_objects.filter(pk__in=file_ids).update(download_key=F("download_key") + 1)
+    transaction.on_commit(lambda: cache.delete_many([_cache_key(pk) for pk in file_ids]))
+
+
+def rotate_for_groups(group_ids):
+    """Invalidate links to files shared with ``group_ids``; members may have lost access."""
+    rotate(
+        FileShare.objects.filter(shared_with_group_id__in=group_ids)
+        .values_list("file_id", flat=True).distinct()
+    )
+
+
+def rotate_for_channels(channel_ids):
+    """Invalidate links to versions attached in ``channel_ids``; members may have lost access."""
+    rotate(
+        Version.all_objects.filter(attached_messages__channel_id__in=channel_ids)
+        .values_list("file_id", flat=True).distinct()
+    )
+
+
+def _signature(kind, pk, file_id, user_id, expires, generation):
+    value = f"{kind}:{pk}:{file_id}:{user_id}:{expires}:{generation}"
+    return salted_hmac(SALT, value, algorithm="sha256").hexdigest()
+
+
+def issue(kind, pk, file_id, user):
+    """
+    Token granting ``user`` downloads of the ``kind`` (``"file"`` or
+    ``"version"``) with ``pk`` until it expires. Expiries are rounded up to
+    ``DOWNLOAD_LINK_ROUNDING`` so repeated resolves give the same, cacheable URL.
+    """
+    step = settings.DOWNLOAD_LINK_ROUNDING
+    expires = -(-(int(time.time()) + settings.DOWNLOAD_LINK_SECONDS) // step) * step
+    user_id = user.pk or 0
+    generation = key_generation(file_id)
+    return f"{file_id}.{user_id}.{expires}.{_signature(kind, pk, file_id, user_id, expires, generation)}"
+
+
+def verify(kind, pk, token):
+    """``(file_id, user_id)`` when ``token`` is a live grant for ``kind``/``pk``, else ``None``."""
+    try:
+        file_id, user_id, expires, signature = token.split(".")
+        file_id, user_id, expires = int(file_id), int(user_id), int(expires)
+    except (AttributeError, ValueError):
+        return None
+    if expires < time.time():
+        return None
+    generation = key_generation(file_id)
+    if generation is None:
+        return None
+    if not constant_time_compare(signature, _signature(kind, pk, file_id, user_id, expires, generation)):
+        return None
+    return file_id, user_id
@@ -0,0 +1,210 @@
+"""
+Upload handler that streams multipart files straight into media storage.
+
+Django's default handlers buffer uploads in memory or a temp file and the
+``FileField`` then copies them into ``upload_to``. This handler writes each
+chunk to its final location as it arrives and computes the SHA-256, byte size
+and a sniffed MIME type in the same pass, so nothing has to re-read the file.
+"""
+
+import hashlib
+import mimetypes
+import os
+
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.temp import NamedTemporaryFile
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from files.storage import blob_storage
+
+SNIFF_BYTES = 512
+# room for multipart headers and the GraphQL operations around the files
+QUOTA_SLACK = 64 * 1024
+
+# (magic prefix, MIME type) – checked in order against the first bytes
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+    (b"%PDF-", "application/pdf"),
+    (b"PK\x03\x04", "application/zip"),
+    (b"\x1f\x8b", "application/gzip"),
+    (b"BZh", "application/x-bzip2"),
+    (b"\xfd7zXZ\x00", "application/x-xz"),
+    (b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (b"Rar!\x1a\x07", "application/vnd.rar"),
+    (b"ID3", "audio/mpeg"),
+    (b"OggS", "audio/ogg"),
+    (b"fLaC", "audio/flac"),
+    (b"\x1aE\xdf\xa3", "video/webm"),
+]
+
+_RIFF_TYPES = {
+    b"WEBP": "image/webp",
+    b"WAVE": "audio/wav",
+    b"AVI ": "video/x-msvideo",
+}
+
+
+def sniff_content_type(head, name=""):
+    """Best-effort MIME type from the leading bytes, falling back to the name."""
+    guessed = mimetypes.guess_type(name)[0] if name else None
+
+    for magic, content_type in _SIGNATURES:
+        if head.startswith(magic):
+            # docx/xlsx/odt/jar… are zip containers; the extension is more specific
+            if content_type == "application/zip" and guessed:
+                return guessed
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] in _RIFF_TYPES:
+        return _RIFF_TYPES[head[8:12]]
+    if head[4:8] == b"ftyp":
+        return "video/quicktime" if head[8:10] == b"qt" else "video/mp4"
+
+    if b"\x00" not in head:
+        try:
+            head.decode("utf-8")
+        except UnicodeDecodeError as exc:
+            # a multi-byte character may be cut off at the sniff boundary
+            if exc.start < len(head) - 3:
+                return guessed or "application/octet-stream"
+        return guessed or "text/plain"
+    return guessed or "application/octet-stream"
+
+
+class StreamedUploadedFile(UploadedFile):
+    """An upload whose bytes and metadata were captured while it streamed in."""
+
+    def __init__(self, file, name, content_type, size, charset, sha256,
+                 stored_name=None, content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.sha256 = sha256
+        # name relative to the storage when the bytes are already in place
+        self.stored_name = stored_name
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def _open_temporary(file_name):
+    return None, NamedTemporaryFile(suffix=".upload" + os.path.splitext(file_name)[1])
+
+
+def _open_destination(file_name):
+    """
+    Reserve a unique name under ``File.upload``'s ``upload_to`` and open it.
+
+    Returns ``(stored_name, fileobj)``. Storages without local paths get a
+    temporary file instead and ``stored_name`` is ``None``; the ``FileField``
+    then saves the upload through the storage API as usual.
+    """
+    from files.models import File
+
+    storage = blob_storage()
+    name = File._meta.get_field("upload").generate_filename(None, file_name)
+    try:
+        storage.path(name)
+    except NotImplementedError:
+        return _open_temporary(file_name)
+
+    while True:
+        name = storage.get_available_name(name)
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        except FileExistsError:
+            # lost a race with a concurrent upload of the same name; pick again
+            continue
+        if storage.file_permissions_mode is not None:
+            os.chmod(path, storage.file_permissions_mode)
+        return name, os.fdopen(fd, "w+b")
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Stream uploads to final storage while hashing, sizing and sniffing them.
+
+    Only signed-in users' uploads are written to storage directly; anonymous
+    requests get temporary files that go away with the request, as with
+    Django's own handlers. Requests from users who are over their storage
+    quota are refused before anything is written: up front from
+    ``Content-Length`` when it is known to be too large, otherwise as soon
+    as the streamed bytes exceed what is left, removing whatever this
+    request already stored. Blobs that no row references once the response
+    is ready are removed by ``DiscardUnusedUploadsMiddleware``.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.stream = False
+        self.allowance = None
+        self.received = 0
+        self.written = []
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        from files import usage
+        from files.views import request_user
+
+        if self.request is None:
+            return
+        user = request_user(self.request)
+        if not user.is_authenticated:
+            return
+        self.stream = True
+        self.allowance = usage.remaining(user)
+        if self.allowance is not None and content_length > self.allowance + QUOTA_SLACK:
+            raise RequestDataTooBig("Storage quota exceeded.")
+
+    def _reject(self):
+        self.file.close()
+        storage = blob_storage()
+        for name in self.written + [self.stored_name]:
+            if name:
+                storage.delete(name)
+        self.written = []
+        raise RequestDataTooBig("Storage quota exceeded.")
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.head = b""
+        open_file = _open_destination if self.stream else _open_temporary
+        self.stored_name, self.file = open_file(self.file_name)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.allowance is not None and self.received > self.allowance:
+            self._reject()
+        self.digest.update(raw_data)
+        if len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[: SNIFF_BYTES - len(self.head)]
+        self.file.write(raw_data)
+        # consumed here; no later handler needs to see the chunk
+        return None
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        if self.stored_name:
+            self.written.append(self.stored_name)
+        return StreamedUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=sniff_content_type(self.head, self.file_name),
+            size=file_size,
+            charset=self.charset,
+            sha256=self.digest.hexdigest(),
+            stored_name=self.stored_name,
+            content_type_extra=self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if not hasattr(self, "file"):
+            return
+        self.file.close()
+        if self.stored_name:
+            blob_storage().delete(self.stored_name)
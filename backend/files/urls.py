@@ -0,0 +1,17 @@
+from django.urls import path
+
+from . import views
+
+app_name = "files"
+
+urlpatterns = [
+    path("<int:file_id>/download/", views.download_file, name="file-download"),
+    path("versions/<int:version_id>/download/", views.download_version, name="version-download"),
+    path(
+        "versions/<int:version_id>/thumbnail/<int:size>/",
+        views.version_thumbnail,
+        name="version-thumbnail",
+    ),
+    path("<int:file_id>/versions.zip", views.export_versions, name="versions-export"),
+    path("blobs/<path:name>", views.serve_blob, name="blob"),
+]
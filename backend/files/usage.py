@@ -0,0 +1,198 @@
+"""
+Per-user and per-node storage accounting.
+
+A ``StorageUsage`` row holds two totals over the live versions in its scope
+(a user's files, or the files linked to a node):
+
+* ``logical_bytes``: every version at its full size;
+* ``physical_bytes``: each distinct content hash once. Delta compression is
+  not taken into account, so this is an upper bound on what is stored.
+
+Trashed files and versions do not count. Whoever adds or removes live
+versions, or links and unlinks files, calls the matching function here in
+the same transaction, with the rows still readable. Each call costs one
+query per affected scope to see which hashes are shared, plus one
+``UPDATE``. ``reconcile`` rebuilds every row from the database alone.
+"""
+
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max, Sum
+
+from files.models import StorageUsage, Version
+
+_FIELDS = ("pk", "sha256", "size", "file_id", "file__owner_id")
+
+
+# ── Incremental updates ──────────────────────────────────────────────────────
+
+def _bump(scope, logical, physical):
+    if not logical and not physical:
+        return
+    changes = {"logical_bytes": F("logical_bytes") + logical, "physical_bytes": F("physical_bytes") + physical}
+    if StorageUsage.objects.filter(**scope).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            StorageUsage.objects.create(logical_bytes=logical, physical_bytes=physical, **scope)
+    except IntegrityError:
+        # created concurrently; add to that row instead
+        StorageUsage.objects.filter(**scope).update(**changes)
+
+
+def _change(scope, scope_versions, rows, sign):
+    """Add (``sign`` 1) or remove (-1) ``rows`` from the totals of one scope."""
+    logical = sum(row["size"] or 0 for row in rows)
+    sizes = {}
+    physical = 0
+    for row in rows:
+        if row["sha256"]:
+            sizes[row["sha256"]] = row["size"] or 0
+        else:
+            # content without a hash cannot be matched; count it every time
+            physical += row["size"] or 0
+    if sizes:
+        shared = set(
+            scope_versions.exclude(pk__in=[row["pk"] for row in rows])
+            .filter(sha256__in=sizes)
+            .values_list("sha256", flat=True)
+            .distinct()
+        )
+        physical += sum(size for sha256, size in sizes.items() if sha256 not in shared)
+    _bump(scope, sign * logical, sign * physical)
+
+
+def _apply(rows, sign):
+    from graph.models import NodeFile
+
+    rows = list(rows)
+    if not rows:
+        return
+    by_owner = defaultdict(list)
+    by_file = defaultdict(list)
+    for row in rows:
+        by_owner[row["file__owner_id"]].append(row)
+        by_file[row["file_id"]].append(row)
+    for owner_id, owned in by_owner.items():
+        _change({"user_id": owner_id}, Version.objects.filter(file__owner_id=owner_id), owned, sign)
+
+    by_node = defaultdict(list)
+    for node_id, file_id in NodeFile.all_objects.filter(file_id__in=by_file).values_list("node_id", "file_id"):
+        by_node[node_id].extend(by_file[file_id])
+    for node_id, linked in by_node.items():
+        _change({"node_id": node_id}, Version.objects.filter(file__file_nodes__node_id=node_id), linked, sign)
+
+
+def versions_added(version_ids):
+    """Count versions that just became live (created or restored)."""
+    with transaction.atomic():
+        _apply(Version.objects.filter(pk__in=version_ids).values(*_FIELDS), 1)
+
+
+def versions_removed(version_ids):
+    """Stop counting versions that are about to be trashed or deleted."""
+    with transaction.atomic():
+        _apply(Version.objects.filter(pk__in=version_ids).values(*_FIELDS), -1)
+
+
+def files_added(file_ids):
+    versions_added(Version.objects.filter(file_id__in=file_ids).values_list("pk", flat=True))
+
+
+def files_removed(file_ids):
+    versions_removed(Version.objects.filter(file_id__in=file_ids).values_list("pk", flat=True))
+
+
+def files_linked(node_id, file_ids, sign=1):
+    """Count the live versions of ``file_ids`` towards ``node_id``; -1 to uncount."""
+    with transaction.atomic():
+        rows = list(Version.objects.filter(file_id__in=file_ids).values(*_FIELDS))
+        if rows:
+            _change(
+                {"node_id": node_id},
+                Version.objects.filter(file__file_nodes__node_id=node_id),
+                rows,
+                sign,
+            )
+
+
+def files_unlinked(node_id, file_ids):
+    files_linked(node_id, file_ids, sign=-1)
+
+
+# ── Quotas ───────────────────────────────────────────────────────────────────
+
+def quota(user):
+    """Bytes ``user`` may store, or ``None`` for no limit."""
+    row = StorageUsage.objects.filter(user=user).values("quota_bytes").first()
+    if row and row["quota_bytes"] is not None:
+        return row["quota_bytes"]
+    return settings.STORAGE_QUOTA_BYTES
+
+
+def remaining(user):
+    """Bytes ``user`` may still add, or ``None`` for no limit."""
+    limit = quota(user)
+    if limit is None:
+        return None
+    used = StorageUsage.objects.filter(user=user).values_list("logical_bytes", flat=True).first() or 0
+    return max(0, limit - used)
+
+
+def has_room(user, size):
+    """Whether ``size`` more bytes fit in the quota of ``user``."""
+    left = remaining(user)
+    return left is None or (size or 0) <= left
+
+
+# ── Reconciliation ───────────────────────────────────────────────────────────
+
+def _totals(key):
+    """``{scope id: (logical, physical)}`` over live versions grouped by ``key``."""
+    live = Version.objects.filter(**{f"{key}__isnull": False})
+    totals = defaultdict(lambda: [0, 0])
+    for scope_id, logical in live.values_list(key).annotate(total=Sum("size")).order_by():
+        totals[scope_id][0] = logical or 0
+    # one size per distinct hash; versions without one are each distinct
+    for scope_id, _sha256, size in (
+        live.exclude(sha256="").values_list(key, "sha256").annotate(size=Max("size")).order_by()
+    ):
+        totals[scope_id][1] += size or 0
+    for scope_id, size in live.filter(sha256="").values_list(key).annotate(total=Sum("size")).order_by():
+        totals[scope_id][1] += size or 0
+    return {scope_id: tuple(values) for scope_id, values in totals.items()}
+
+
+def reconcile(dry_run=False):
+    """
+    Recompute every counter from version metadata, without touching storage.
+    Returns ``{"checked": n, "fixed": [(scope, old, new), ...]}``.
+    """
+    report = {"checked": 0, "fixed": []}
+    for field, key in (("user_id", "file__owner_id"), ("node_id", "file__file_nodes__node_id")):
+        with transaction.atomic():
+            expected = _totals(key)
+            current = {
+                row[field]: (row["logical_bytes"], row["physical_bytes"])
+                for row in StorageUsage.objects.select_for_update()
+                .filter(**{f"{field}__isnull": False})
+                .values(field, "logical_bytes", "physical_bytes")
+            }
+            for scope_id in expected.keys() | current.keys():
+                report["checked"] += 1
+                old, new = current.get(scope_id, (0, 0)), expected.get(scope_id, (0, 0))
+                if old == new:
+                    continue
+                report["fixed"].append((f"{field[:-3]}={scope_id}", old, new))
+                if dry_run:
+                    continue
+                updated = StorageUsage.objects.filter(**{field: scope_id}).update(
+                    logical_bytes=new[0], physical_bytes=new[1]
+                )
+                if not updated:
+                    StorageUsage.objects.create(
+                        logical_bytes=new[0], physical_bytes=new[1], **{field: scope_id}
+                    )
+    return report
@@ -0,0 +1,227 @@
+# files/views.py
+
+import mimetypes
+import os
+import re
+
+from django.contrib.auth import authenticate
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse,
+)
+from django.utils.http import content_disposition_header
+
+from accounts.models import Profile
+from files import derivatives, tokens
+from files.delta import STREAM_CHUNK, iter_version
+from files.export import stream_zip, unique_names
+from files.models import File, Version
+from files.schema import can_read_version, readable_files
+from files.storage import blob_storage
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def request_user(request):
+    """The caller of a plain Django view, from a JWT header/cookie or the session."""
+    try:
+        user = authenticate(request=request)
+    except Exception:  # expired or malformed token
+        user = None
+    return user or request.user
+
+
+def download_file(request, file_id):
+    """
+    Download a file's original upload. A valid signed ``?t=`` link from
+    ``downloadUrl`` skips the share checks; without one the caller needs
+    read access.
+    """
+    if tokens.verify("file", file_id, request.GET.get("t")):
+        file = File.objects.filter(pk=file_id).first()
+    else:
+        file = readable_files(request_user(request)).filter(pk=file_id).first()
+    if not file or not file.upload:
+        raise Http404("File not found.")
+
+    storage = file.upload.storage
+    if getattr(storage, "redirect_downloads", False):
+        return HttpResponseRedirect(storage.url(file.upload.name, filename=file.name))
+    content_type = mimetypes.guess_type(file.name)[0] or "application/octet-stream"
+    response = blob_response(request, storage, file.upload.name, content_type)
+    response["Content-Disposition"] = content_disposition_header(True, file.name)
+    return response
+
+
+def download_version(request, version_id):
+    """
+    Stream the full content of a version, rebuilding it from deltas if needed.
+    Like ``download_file``, a valid signed link skips the access checks.
+    """
+    grant = tokens.verify("version", version_id, request.GET.get("t"))
+    if grant:
+        version = Version.objects.filter(pk=version_id, file_id=grant[0]).first()
+    else:
+        version = Version.objects.filter(pk=version_id).first()
+        if version and not can_read_version(request_user(request), version):
+            version = None
+    if not version:
+        raise Http404("Version not found.")
+
+    name = os.path.basename(version.upload.name)
+    if name.endswith(".vdelta"):
+        name = name[: -len(".vdelta")]
+    storage = version.upload.storage
+    if version.delta_base_id is None and getattr(storage, "redirect_downloads", False):
+        # the client fetches the bytes from the object store directly
+        return HttpResponseRedirect(storage.url(version.upload.name, filename=name))
+
+    response = StreamingHttpResponse(
+        iter_version(version),
+        content_type=version.content_type or "application/octet-stream",
+    )
+    if version.size is not None:
+        response["Content-Length"] = str(version.size)
+    response["Content-Disposition"] = f'attachment; filename="{name}"'
+    return response
+
+
+def version_thumbnail(request, version_id, size):
+    """Serve a thumbnail of a version, generating it first if it is missing."""
+    version = Version.objects.filter(pk=version_id).first()
+    if not version or not can_read_version(request_user(request), version):
+        raise Http404("Version not found.")
+    if derivatives.preview_kind(version.content_type) not in ("image", "pdf"):
+        raise Http404("No preview for this content.")
+    name = derivatives.thumbnail_name(version.sha256, derivatives.thumbnail_size(size))
+    if not version.has_thumbnails and not derivatives.generate(version):
+        raise Http404("No preview for this content.")
+    response = FileResponse(blob_storage().open(name, "rb"), content_type="image/webp")
+    # a version's content never changes
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+
+def resize_image(request, file_id):
+    """
+    Serve the latest version of an image file scaled to ``?w=`` pixels in
+    ``?fmt=`` (webp, jpeg or png). Anyone may fetch profile avatars; other
+    files need read access.
+    """
+    file = File.objects.filter(pk=file_id).first()
+    if not file:
+        raise Http404("File not found.")
+    is_avatar = Profile.objects.filter(avatar_file=file).exists()
+    if not is_avatar and not readable_files(request_user(request)).filter(pk=file.pk).exists():
+        raise Http404("File not found.")
+
+    try:
+        width = derivatives.resize_width(int(request.GET.get("w", "")))
+    except ValueError:
+        return HttpResponseBadRequest("w must be a width in pixels.")
+    fmt = request.GET.get("fmt", "webp")
+    if fmt not in derivatives.RESIZE_FORMATS:
+        return HttpResponseBadRequest("fmt must be one of: " + ", ".join(derivatives.RESIZE_FORMATS))
+
+    latest = file.versions.order_by("-created_at", "-id").first()
+    fh = latest and derivatives.resized(latest, width, fmt)
+    if not fh:
+        raise Http404("Not an image.")
+    response = FileResponse(fh, content_type=derivatives.RESIZE_FORMATS[fmt][1])
+    scope = "public" if is_avatar else "private"
+    if request.GET.get("v") == derivatives.version_tag(latest):
+        # the URL names this exact content, so it can be cached for good
+        response["Cache-Control"] = f"{scope}, max-age=31536000, immutable"
+    else:
+        response["Cache-Control"] = f"{scope}, max-age=300"
+    return response
+
+
+def zip_response(request, entries, filename):
+    """
+    Stream ``(name, version)`` entries as a ZIP download.
+
+    ``?start=`` and ``?count=`` pick a slice of the entries, so a client can
+    fetch a large export in parts and resume after the last complete one;
+    ``X-Export-Total`` and ``X-Export-Next`` tell it where it stands.
+    """
+    total = len(entries)
+    try:
+        start = max(int(request.GET.get("start", 0)), 0)
+        count = max(int(request.GET.get("count", total)), 0)
+    except ValueError:
+        return HttpResponseBadRequest("start and count must be integers.")
+    part = entries[start:start + count]
+
+    response = StreamingHttpResponse(stream_zip(part), content_type="application/zip")
+    response["Content-Disposition"] = content_disposition_header(True, filename)
+    response["X-Export-Total"] = str(total)
+    if start + len(part) < total:
+        response["X-Export-Next"] = str(start + len(part))
+    return response
+
+
+def export_versions(request, file_id):
+    """ZIP of every version of a file, oldest first."""
+    file = readable_files(request_user(request)).filter(pk=file_id).first()
+    if not file:
+        raise Http404("File not found.")
+    versions = list(Version.objects.filter(file=file).order_by("created_at", "id"))
+    stem, ext = os.path.splitext(file.name)
+    names = unique_names(f"{stem} v{i}{ext}" for i, _ in enumerate(versions, 1))
+    return zip_response(request, list(zip(names, versions)), f"{stem} versions.zip")
+
+
+def _iter_range(fh, start, length):
+    with fh:
+        fh.seek(start)
+        while length > 0:
+            data = fh.read(min(length, STREAM_CHUNK))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def serve_blob(request, name):
+    """
+    Serve a stored blob by name, honouring single ``Range`` requests.
+
+    Used as the URL of storages whose blobs are not plain files under
+    ``MEDIA_ROOT`` (chunk manifests), for uploads and their derivatives; like
+    ``MEDIA_URL`` it is unauthenticated and relies on the blob name not being
+    guessable.
+    """
+    storage = blob_storage()
+    if not name.startswith(("uploads/", f"{derivatives.PREFIX}/")) or not storage.exists(name):
+        raise Http404("Blob not found.")
+    return blob_response(request, storage, name)
+
+
+def blob_response(request, storage, name, content_type="application/octet-stream"):
+    """Stream blob ``name`` from ``storage``, or the part a single ``Range`` asks for."""
+    size = storage.size(name)
+    start, end = 0, size - 1
+
+    match = _RANGE_RE.match(request.headers.get("Range", ""))
+    if match and (match.group(1) or match.group(2)):
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start = max(size - int(match.group(2)), 0)
+        if start > end:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    length = end - start + 1 if size else 0
+    response = StreamingHttpResponse(
+        _iter_range(storage.open(name, "rb"), start, length),
+        status=206 if match and length != size else 200,
+        content_type=content_type,
+    )
+    response["Content-Length"] = str(length)
+    response["Accept-Ranges"] = "bytes"
+    if response.status_code == 206:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
@@ -0,0 +1,306 @@
+"""
+In-memory adjacency of the map, for graph traversals.
+
+Every process keeps the live edges in compressed sparse row form, one shard
+per owner: the owner's nodes that have edges, in ascending order, and for
+each one a slice of its neighbours, the edges leading to them and the
+neighbours' owners, in flat arrays. An edge between two owners' maps is in
+both shards. A breadth-first step over a whole frontier is then a few NumPy
+operations per owner it touches and needs no query.
+
+A shard is built on first use from that owner's edges alone, and a process
+keeps at most ``MAX_SHARDS`` of them. Edges added or deleted in this process
+are applied on commit (``graph.signals``, ``graph.bulk``) as an overlay on
+the shards of both ends, and a shard is rebuilt once ``OVERLAY_LIMIT`` edits
+have piled up on it. Every change also bumps its owners' generation counters
+in the cache; a process that finds its shard behind its owner's counter
+rebuilds that shard only. Trashing, restoring and deleting nodes in bulk
+bypasses the signals and calls ``invalidate`` for the owners involved. With
+a per-process cache, other processes catch up within
+``GRAPH_ADJACENCY_MAX_AGE_SECONDS`` of a shard's last build; a shared cache
+makes it immediate.
+
+Traversals only step onto nodes that ``allowed`` accepts, so the caller's
+ACL decides both what is returned and what a path may pass through.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from graph.models import Edge, Node
+
+GENERATION_KEY = "graph:adjacency:generation"
+# edits applied on top of a shard before it is rebuilt
+OVERLAY_LIMIT = 1000
+MAX_DEPTH = 6
+# owners' shards kept per process; the least recently used go first
+MAX_SHARDS = 256
+
+_lock = threading.Lock()
+_shards = OrderedDict()
+
+_EMPTY = np.zeros(0, dtype=np.int64)
+
+
+class Adjacency:
+    """A snapshot of the live edges of one owner's nodes plus the edits made since it was taken."""
+
+    def __init__(self, owner_id, ids, indptr, indices, edges, owners, generation, extra=(), removed=frozenset()):
+        self.owner_id = owner_id
+        self.ids = ids
+        self.indptr = indptr
+        self.indices = indices
+        self.edges = edges
+        # owner of each neighbour in ``indices``
+        self.owners = owners
+        self.generation = generation
+        self.built_at = time.monotonic()
+        # (edge, node, neighbour, neighbour's owner) added and edge ids deleted since the snapshot
+        self.extra = tuple(extra)
+        self.removed = frozenset(removed)
+        rows = np.array(self.extra, dtype=np.int64).reshape(-1, 4)
+        self._extra_edge, self._extra_src, self._extra_dst, self._extra_owner = rows.T
+        self._removed = np.fromiter(self.removed, dtype=np.int64, count=len(self.removed))
+
+    @classmethod
+    def load(cls, owner_id, generation):
+        # each edge from the owner's end: once as node_a, once as node_b
+        forward = Edge.objects.filter(node_a__owner_id=owner_id).values_list(
+            "pk", "node_a_id", "node_b_id", "node_b__owner_id"
+        )
+        backward = Edge.objects.filter(node_b__owner_id=owner_id).values_list(
+            "pk", "node_b_id", "node_a_id", "node_a__owner_id"
+        )
+        rows = np.array(list(forward) + list(backward), dtype=np.int64).reshape(-1, 4)
+        rows = rows[np.argsort(rows[:, 1], kind="stable")]
+        ids, starts = np.unique(rows[:, 1], return_index=True)
+        indptr = np.append(starts, len(rows)).astype(np.int64)
+        return cls(owner_id, ids, indptr, rows[:, 2], rows[:, 0], rows[:, 3], generation)
+
+    @property
+    def edits(self):
+        return len(self.extra) + len(self.removed)
+
+    def stale(self, generation):
+        return (
+            self.generation != generation
+            or self.edits > OVERLAY_LIMIT
+            or time.monotonic() - self.built_at > settings.GRAPH_ADJACENCY_MAX_AGE_SECONDS
+        )
+
+    def edited(self, generation, extra=(), removed=()):
+        """A copy with more edits on top; shards are never changed in place."""
+        return Adjacency(
+            self.owner_id, self.ids, self.indptr, self.indices, self.edges, self.owners, generation,
+            self.extra + tuple(extra), self.removed | set(removed),
+        )
+
+    def _positions(self, nodes):
+        """Index of each of ``nodes`` in the shard, and which of them it has."""
+        if not len(self.ids):
+            return np.zeros(len(nodes), dtype=np.int64), np.zeros(len(nodes), dtype=bool)
+        at = np.minimum(np.searchsorted(self.ids, nodes), len(self.ids) - 1)
+        return at, self.ids[at] == nodes
+
+    def has(self, node_id):
+        """Whether ``node_id`` has an edge in this shard."""
+        return bool(self._positions(np.array([node_id]))[1][0]) or node_id in self._extra_src
+
+    def step(self, frontier):
+        """
+        Every edge out of ``frontier`` (nodes of this owner) as ``(source,
+        target, edge, target's owner)`` arrays.
+        """
+        frontier = np.asarray(frontier, dtype=np.int64)
+        at, known = self._positions(frontier)
+        at = at[known]
+        starts = self.indptr[at]
+        counts = self.indptr[at + 1] - starts
+        flat = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        src = np.repeat(frontier[known], counts)
+        dst, edge, owner = self.indices[flat], self.edges[flat], self.owners[flat]
+        if self.extra:
+            mine = np.isin(self._extra_src, frontier)
+            src = np.concatenate([src, self._extra_src[mine]])
+            dst = np.concatenate([dst, self._extra_dst[mine]])
+            edge = np.concatenate([edge, self._extra_edge[mine]])
+            owner = np.concatenate([owner, self._extra_owner[mine]])
+        if self.removed:
+            keep = ~np.isin(edge, self._removed)
+            src, dst, edge, owner = src[keep], dst[keep], edge[keep], owner[keep]
+        return src, dst, edge, owner
+
+
+class Graph:
+    """
+    The adjacency of every map, as one traversal sees it: owners' shards are
+    fetched when the traversal first reaches one of their nodes, and kept
+    for the rest of it.
+    """
+
+    def __init__(self):
+        self._shards = {}
+
+    def shard(self, owner_id):
+        if owner_id not in self._shards:
+            self._shards[owner_id] = shard(owner_id)
+        return self._shards[owner_id]
+
+    def owner_of(self, node_id, likely=None):
+        """
+        Owner of the live node ``node_id``, or ``None``. The shard of the
+        ``likely`` owner is asked first; other nodes are looked up.
+        """
+        if likely and self.shard(likely).has(node_id):
+            return likely
+        return Node.objects.filter(pk=node_id).values_list("owner_id", flat=True).first()
+
+    def step(self, frontier, owners):
+        """Every edge out of ``frontier``, whose nodes belong to ``owners``; see ``Adjacency.step``."""
+        parts = [self.shard(int(owner)).step(frontier[owners == owner]) for owner in np.unique(owners)]
+        if not parts:
+            return _EMPTY, _EMPTY, _EMPTY, _EMPTY
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def levels(self, start, owner, allowed, depth=None):
+        """
+        Breadth-first search from ``start``, a node of ``owner``, yielding
+        each level as ``(nodes, parents)``: the nodes first reached at that
+        distance and the node each was reached from. Only nodes for which
+        ``allowed`` (ids, their owners → boolean mask) is true are entered.
+        """
+        seen = np.array([start], dtype=np.int64)
+        frontier, owners = seen, np.array([owner], dtype=np.int64)
+        distance = 0
+        while len(frontier) and (depth is None or distance < depth):
+            src, dst, _, dst_owners = self.step(frontier, owners)
+            fresh = ~np.isin(dst, seen)
+            dst, first = np.unique(dst[fresh], return_index=True)
+            parents, dst_owners = src[fresh][first], dst_owners[fresh][first]
+            # refused nodes are not asked about again
+            seen = np.concatenate([seen, dst])
+            ok = allowed(dst, dst_owners) if len(dst) else np.zeros(0, dtype=bool)
+            frontier, owners, parents = dst[ok], dst_owners[ok], parents[ok]
+            distance += 1
+            if len(frontier):
+                yield frontier, parents
+
+    def reach(self, start, owner, allowed, depth=None, limit=None):
+        """Ids of the nodes reachable from ``start``, nearest first, ``start`` excluded."""
+        found = []
+        total = 0
+        for nodes, _ in self.levels(start, owner, allowed, depth):
+            found.append(nodes)
+            total += len(nodes)
+            if limit is not None and total >= limit:
+                break
+        reached = np.concatenate(found) if found else _EMPTY
+        return reached[:limit].tolist()
+
+    def path(self, source, owner, target, allowed):
+        """Ids along a shortest path from ``source``, a node of ``owner``, to ``target``, or ``None``."""
+        if source == target:
+            return [source]
+        parent = {}
+        for nodes, parents in self.levels(source, owner, allowed):
+            parent.update(zip(nodes.tolist(), parents.tolist()))
+            if target in parent:
+                path = [target]
+                while path[-1] != source:
+                    path.append(parent[path[-1]])
+                return path[::-1]
+        return None
+
+
+def _owner_key(owner_id):
+    return f"{GENERATION_KEY}:{owner_id}"
+
+
+def _generation(owner_id):
+    """``(everything, this owner)`` generations; a shard is current while both match."""
+    values = cache.get_many([GENERATION_KEY, _owner_key(owner_id)])
+    return values.get(GENERATION_KEY, 0), values.get(_owner_key(owner_id), 0)
+
+
+def _bump(key):
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # evicted in between
+        cache.set(key, 1, None)
+        return 1
+
+
+def shard(owner_id):
+    """This process's adjacency of the map of ``owner_id``, rebuilt if it is out of date."""
+    generation = _generation(owner_id)
+    with _lock:
+        graph = _shards.get(owner_id)
+        if graph is not None:
+            _shards.move_to_end(owner_id)
+    if graph is None or graph.stale(generation):
+        graph = Adjacency.load(owner_id, generation)
+        with _lock:
+            _shards[owner_id] = graph
+            _shards.move_to_end(owner_id)
+            while len(_shards) > MAX_SHARDS:
+                _shards.popitem(last=False)
+    return graph
+
+
+def current():
+    """A view of every map's adjacency for one traversal."""
+    return Graph()
+
+
+def invalidate(owner_ids=None):
+    """
+    Make every process rebuild the shards of ``owner_ids`` before their next
+    traversal, or all shards for ``None``.
+    """
+    if owner_ids is None:
+        _bump(GENERATION_KEY)
+        with _lock:
+            _shards.clear()
+        return
+    for owner_id in set(owner_ids):
+        _bump(_owner_key(owner_id))
+        with _lock:
+            _shards.pop(owner_id, None)
+
+
+def _apply(owner_id, extra=(), removed=()):
+    generation = _bump(_owner_key(owner_id))
+    with _lock:
+        graph = _shards.get(owner_id)
+        # only patch a copy nobody else has changed in the meantime
+        if graph is not None and graph.generation[1] == generation - 1:
+            _shards[owner_id] = graph.edited((graph.generation[0], generation), extra, removed)
+        else:
+            _shards.pop(owner_id, None)
+
+
+def edges_added(rows):
+    """``(edge_id, node_a_id, node_b_id, owner_a_id, owner_b_id)`` rows inserted."""
+    extra = {}
+    for edge_id, node_a_id, node_b_id, owner_a_id, owner_b_id in rows:
+        extra.setdefault(owner_a_id, []).append((edge_id, node_a_id, node_b_id, owner_b_id))
+        extra.setdefault(owner_b_id, []).append((edge_id, node_b_id, node_a_id, owner_a_id))
+    for owner_id, owner_rows in extra.items():
+        _apply(owner_id, extra=owner_rows)
+
+
+def edge_added(edge_id, node_a_id, node_b_id, owner_a_id, owner_b_id):
+    edges_added([(edge_id, node_a_id, node_b_id, owner_a_id, owner_b_id)])
+
+
+def edge_removed(edge_id, owner_ids):
+    """Drop ``edge_id`` from the shards of ``owner_ids``, the owners of its ends."""
+    for owner_id in set(owner_ids):
+        _apply(owner_id, removed=[edge_id])
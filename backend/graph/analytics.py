@@ -0,0 +1,164 @@
+"""
+Importance scores for the nodes of a map.
+
+Every owner's map (its live nodes and the edges between them) is scored
+with SciPy sparse matrices:
+
+* ``pagerank``: the random-surfer score, summing to 1 over the map;
+* ``degree``: the number of edges at the node;
+* ``betweenness``: the share of shortest paths between other nodes that
+  pass through it, estimated with Brandes' algorithm from ``SAMPLES``
+  randomly chosen sources (exact on smaller maps).
+
+Scores are stored on ``Node`` and indexed per owner, so ``myNodes`` can
+list a map by importance. Rescoring runs on the ``layout`` queue. It waits
+until the nodes touched by edits since the last run (``MapStats.changes``)
+reach ``GRAPH_SCORE_MIN_CHANGES`` or ``CHANGE_RATIO`` of the map, whichever
+is more. PageRank then restarts from the stored scores, so a small change
+converges in a few iterations.
+"""
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from scipy import sparse
+
+from graph.layout import load_map
+from graph.models import MapStats, Node
+from jobs.models import Job
+from jobs.queue import task
+
+DAMPING = 0.85
+# L1 change between PageRank iterations that counts as converged
+TOLERANCE = 1e-9
+MAX_ITERATIONS = 100
+# BFS sources sampled for betweenness
+SAMPLES = 64
+# share of a map's nodes that must have changed before it is rescored
+CHANGE_RATIO = 0.05
+
+
+# ── Scores ───────────────────────────────────────────────────────────────────
+
+def adjacency_matrix(n, edges):
+    """Symmetric 0/1 CSR matrix of the undirected ``edges`` (index pairs)."""
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    ones = np.ones(len(edges))
+    matrix = sparse.coo_matrix((ones, (edges[:, 0], edges[:, 1])), shape=(n, n)).tocsr()
+    return ((matrix + matrix.T) > 0).astype(np.float64).tocsr()
+
+
+def pagerank(adjacency, start=None, damping=DAMPING, tolerance=TOLERANCE, max_iterations=MAX_ITERATIONS):
+    """
+    PageRank of every vertex by power iteration, from ``start`` (uniform by
+    default). Nodes without edges hand their rank to everyone. Returns
+    ``(scores, iterations)``.
+    """
+    n = adjacency.shape[0]
+    degree = np.asarray(adjacency.sum(axis=1)).reshape(-1)
+    dangling = degree == 0
+    inverse = np.divide(1.0, degree, out=np.zeros(n), where=~dangling)
+    rank = np.full(n, 1.0 / n)
+    if start is not None and np.asarray(start).sum() > 0:
+        rank = np.asarray(start, dtype=float) / np.asarray(start).sum()
+
+    for iteration in range(1, max_iterations + 1):
+        spread = adjacency @ (rank * inverse)
+        new = damping * (spread + rank[dangling].sum() / n) + (1 - damping) / n
+        change = np.abs(new - rank).sum()
+        rank = new
+        if change < tolerance:
+            break
+    return rank, iteration
+
+
+def betweenness(adjacency, samples=SAMPLES, seed=0):
+    """
+    Normalised betweenness centrality of every vertex, from breadth-first
+    searches out of ``samples`` random sources (all of them if fewer).
+    """
+    n = adjacency.shape[0]
+    total = np.zeros(n)
+    if n < 3:
+        return total
+    sources = np.random.default_rng(seed).choice(n, size=min(samples, n), replace=False)
+    for source in sources:
+        # shortest-path counts, level by level
+        sigma = np.zeros(n)
+        sigma[source] = 1
+        seen = np.zeros(n, dtype=bool)
+        seen[source] = True
+        levels = [np.array([source])]
+        while True:
+            front = np.zeros(n)
+            front[levels[-1]] = sigma[levels[-1]]
+            arriving = adjacency @ front
+            fresh = np.flatnonzero((arriving > 0) & ~seen)
+            if not len(fresh):
+                break
+            sigma[fresh] = arriving[fresh]
+            seen[fresh] = True
+            levels.append(fresh)
+        # dependencies, from the farthest level back
+        delta = np.zeros(n)
+        for farther, nearer in zip(levels[:0:-1], levels[-2::-1]):
+            share = np.zeros(n)
+            share[farther] = (1 + delta[farther]) / sigma[farther]
+            delta[nearer] += sigma[nearer] * (adjacency @ share)[nearer]
+        delta[source] = 0
+        total += delta
+    # scale the sample up to every source; each pair was counted from both ends
+    return total * (n / len(sources)) / ((n - 1) * (n - 2))
+
+
+def score(n, edges, start=None):
+    """``(pagerank, degree, betweenness)`` arrays for ``n`` vertices and ``edges``."""
+    adjacency = adjacency_matrix(n, edges)
+    rank, _ = pagerank(adjacency, start)
+    degree = np.asarray(adjacency.sum(axis=1)).reshape(-1).astype(np.int64)
+    return rank, degree, betweenness(adjacency)
+
+
+# ── Maps ─────────────────────────────────────────────────────────────────────
+
+def rescore(owner_id):
+    """Score the map of ``owner_id`` and store it; returns the number of nodes."""
+    ids, _, edges = load_map(owner_id)
+    if ids:
+        stored = dict(Node.objects.filter(owner_id=owner_id).values_list("pk", "pagerank"))
+        rank, degree, between = score(len(ids), edges, [stored.get(pk, 0) for pk in ids])
+        nodes = [
+            Node(pk=pk, pagerank=float(rank[i]), degree=int(degree[i]), betweenness=float(between[i]))
+            for i, pk in enumerate(ids)
+        ]
+        # scores are not shown on the map, so no notifications
+        Node.objects.bulk_update(nodes, ["pagerank", "degree", "betweenness"], batch_size=500)
+    return len(ids)
+
+
+@task(queue="layout")
+def score_map(owner_id):
+    stats, _ = MapStats.objects.get_or_create(owner_id=owner_id)
+    # edits landing while we score count towards the next run
+    counted = stats.changes
+    nodes = rescore(owner_id)
+    MapStats.objects.filter(pk=stats.pk).update(
+        changes=F("changes") - counted, nodes=nodes, scored_at=timezone.now()
+    )
+
+
+def note_changes(owner_id, count):
+    """
+    Record that edits touched ``count`` nodes of the map of ``owner_id``, and
+    queue a rescoring once enough of it has changed.
+    """
+    with transaction.atomic():
+        stats, _ = MapStats.objects.select_for_update().get_or_create(owner_id=owner_id)
+        stats.changes += count
+        stats.save(update_fields=["changes"])
+    if stats.changes < max(settings.GRAPH_SCORE_MIN_CHANGES, CHANGE_RATIO * stats.nodes):
+        return
+    if not Job.objects.filter(task=score_map.task_name, status=Job.QUEUED, args__0=owner_id).exists():
+        score_map.delay(owner_id)
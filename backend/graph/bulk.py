@@ -0,0 +1,99 @@
+"""
+Many graph rows at once.
+
+``bulk_create`` and ``unlink_files`` skip the per-row signals, so what they
+would do happens here instead: edges get their neighbor rows and reach the
+adjacency cache, and linked files count towards storage usage. Callers
+notify subscribers once for the whole batch.
+
+MySQL does not report the ids of a multi-row insert. Nodes are then tagged
+with a temporary ``import_key`` and read back by it, and edges are found
+again by their two ends.
+"""
+
+import uuid
+
+from django.db import connection, transaction
+
+from files import usage
+from graph import adjacency
+from graph.models import Edge, Node, NodeFile, NodeNeighbor
+
+
+def insert_nodes(nodes):
+    """Insert unsaved ``nodes``; sets their ids."""
+    if not nodes:
+        return nodes
+    if connection.features.can_return_rows_from_bulk_insert:
+        return Node.objects.bulk_create(nodes)
+    token = uuid.uuid4().hex
+    for i, node in enumerate(nodes):
+        node.import_key = f"{token}:{i}"
+    Node.objects.bulk_create(nodes)
+    ids = dict(Node.all_objects.filter(import_key__startswith=f"{token}:").values_list("import_key", "pk"))
+    for node in nodes:
+        node.pk = ids[node.import_key]
+        node.import_key = None
+    Node.all_objects.filter(pk__in=ids.values()).update(import_key=None)
+    return nodes
+
+
+def insert_edges(edges):
+    """Insert unsaved ``edges`` with their neighbor rows; sets their ids."""
+    if not edges:
+        return edges
+    Edge.objects.bulk_create(edges)
+    if not connection.features.can_return_rows_from_bulk_insert:
+        ids = {
+            (a, b): pk
+            for pk, a, b in Edge.all_objects.filter(
+                node_a_id__in={e.node_a_id for e in edges}, node_b_id__in={e.node_b_id for e in edges}
+            ).values_list("pk", "node_a_id", "node_b_id")
+        }
+        for edge in edges:
+            edge.pk = ids[edge.node_a_id, edge.node_b_id]
+    NodeNeighbor.objects.bulk_create(NodeNeighbor.for_edges(edges))
+    owners = dict(
+        Node.all_objects.filter(pk__in={e.node_a_id for e in edges} | {e.node_b_id for e in edges})
+        .values_list("pk", "owner_id")
+    )
+    rows = [
+        (edge.pk, edge.node_a_id, edge.node_b_id, owners[edge.node_a_id], owners[edge.node_b_id])
+        for edge in edges
+    ]
+    transaction.on_commit(lambda: adjacency.edges_added(rows))
+    return edges
+
+
+def _by_node(links):
+    files = {}
+    for link in links:
+        files.setdefault(link.node_id, []).append(link.file_id)
+    return files
+
+
+def link_files(links):
+    """Insert unsaved ``NodeFile`` rows and count them towards their nodes."""
+    NodeFile.objects.bulk_create(links)
+    count_links(links)
+    return links
+
+
+def unlink_files(links):
+    """Delete ``NodeFile`` rows in one statement and stop counting them."""
+    uncount_links(links)
+    # in SQL, as vault.deletion does: no per-row signals or notifications
+    doomed = NodeFile.objects.filter(pk__in=[link.pk for link in links])
+    doomed._raw_delete(doomed.db)
+
+
+def uncount_links(links):
+    """Stop counting ``NodeFile`` rows about to move away or be deleted."""
+    for node_id, file_ids in _by_node(links).items():
+        usage.files_unlinked(node_id, file_ids)
+
+
+def count_links(links):
+    """Count ``NodeFile`` rows that just arrived at their nodes."""
+    for node_id, file_ids in _by_node(links).items():
+        usage.files_linked(node_id, file_ids)
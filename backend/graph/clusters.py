@@ -0,0 +1,233 @@
+"""
+Level-of-detail clusters for large maps.
+
+Every owner's map is grouped into ``LEVELS`` nested levels of communities.
+Level 1 runs label propagation over the nodes and their edges. Each higher
+level runs it again over the communities of the level below, linked by
+the number of edges between them. Nodes or communities without any link
+are grouped by where they sit on the map instead, in cells that grow with
+the level. Each node's community per level is stored in ``NodeCluster``,
+named by its smallest node id.
+
+The layout job updates the clusters after each edit, and ``recluster_map``
+after nodes are trashed or restored. Level 1 is recomputed only around the
+change, starting from the stored labels; the levels above are small and are
+rebuilt from it. Sizes, centres and links between
+clusters are aggregated at query time over the nodes the viewer can read,
+so a shared map never reveals what is not shared.
+"""
+
+import numpy as np
+from django.db import transaction
+from scipy import sparse
+from django.db.models import Avg, BigIntegerField, Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from graph.layout import IDEAL_EDGE, RADIUS, load_map, neighbourhood
+from graph.models import Edge, NodeCluster
+from jobs.queue import task
+
+LEVELS = 3
+# cells for grouping unlinked communities are IDEAL_EDGE * SPREAD ** level wide
+SPREAD = 4
+ITERATIONS = 20
+
+
+# ── Communities ──────────────────────────────────────────────────────────────
+
+def _common_neighbours(n, edges):
+    """Neighbours the two ends of every edge share."""
+    ones = np.ones(len(edges))
+    adjacency = sparse.coo_matrix((ones, (edges[:, 0], edges[:, 1])), shape=(n, n)).tocsr()
+    adjacency = ((adjacency + adjacency.T) > 0).astype(np.float64)
+    shared = adjacency @ adjacency
+    return np.asarray(shared[edges[:, 0], edges[:, 1]]).reshape(-1)
+
+
+def propagate(n, edges, weights=None, labels=None, movable=None, iterations=ITERATIONS, seed=0):
+    """
+    Label propagation over ``n`` vertices and weighted undirected ``edges``
+    (index pairs): each vertex repeatedly takes the label with the most
+    weight among its neighbours. Starts from ``labels`` (singletons by
+    default); only ``movable`` vertices change. Returns the labels.
+    """
+    labels = np.arange(n) if labels is None else np.array(labels)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    if not len(edges):
+        return labels
+    weights = np.ones(len(edges)) if weights is None else np.asarray(weights, dtype=float)
+    # edges inside a dense group outweigh a lone bridge out of it, which
+    # would otherwise flood one group into the next while labels are ties
+    weights = weights * (1 + _common_neighbours(n, edges))
+    active = np.ones(n, dtype=bool) if movable is None else np.asarray(movable, dtype=bool)
+    source = np.concatenate([edges[:, 0], edges[:, 1]])
+    target = np.concatenate([edges[:, 1], edges[:, 0]])
+    weight = np.concatenate([weights, weights])
+    rng = np.random.default_rng(seed)
+
+    for _ in range(iterations):
+        # weight of each (vertex, neighbouring label) pair
+        keys, inverse = np.unique(source * n + labels[target], return_inverse=True)
+        score = np.bincount(inverse.reshape(-1), weight)
+        vertex, label = keys // n, keys % n
+        # best label of each vertex: most weight, then the smallest label
+        order = np.lexsort((label, -score, vertex))
+        first = order[np.r_[True, vertex[order][1:] != vertex[order][:-1]]]
+        best, best_score = labels.copy(), np.zeros(n)
+        best[vertex[first]], best_score[vertex[first]] = label[first], score[first]
+
+        current = np.arange(n) * n + labels
+        at = np.minimum(np.searchsorted(keys, current), len(keys) - 1)
+        current_score = np.where(keys[at] == current, score[at], 0)
+        better = active & (best_score > current_score)
+        if not better.any():
+            break
+        # about half at a time, so the two sides of a cut never swap forever
+        step = better & (rng.random(n) < 0.5)
+        labels[step] = best[step]
+    return labels
+
+
+def _smallest_member(labels):
+    """Relabel groups by their smallest member index."""
+    first = np.full(len(labels), len(labels))
+    np.minimum.at(first, labels, np.arange(len(labels)))
+    return first[labels]
+
+
+def coarsen(groups, pos, edges, level, labels=None, movable=None):
+    """
+    Group the communities ``groups`` (a label per node) of one level into
+    those of ``level``: propagate over the links between them, and put
+    unlinked ones together by map cell. Returns a label per node, the
+    smallest node index of its community. ``labels`` and ``movable``, per
+    community, warm-start the propagation.
+    """
+    names, member = np.unique(groups, return_inverse=True)
+    member = member.reshape(-1)
+    m = len(names)
+    a, b = member[edges[:, 0]], member[edges[:, 1]]
+    between = a != b
+    links, weights = np.unique(
+        np.stack([np.minimum(a, b), np.maximum(a, b)], axis=1)[between], axis=0, return_counts=True
+    )
+    community = propagate(m, links.reshape(-1, 2), weights, labels, movable)
+
+    alone = np.bincount(links.ravel().astype(np.int64), minlength=m) == 0
+    if alone.any():
+        size = np.bincount(member, minlength=m)
+        centre = np.stack([np.bincount(member, pos[:, axis], m) for axis in (0, 1)], axis=1) / size[:, None]
+        cell = np.floor(centre[alone] / (IDEAL_EDGE * SPREAD ** level)).astype(np.int64)
+        _, together = np.unique(cell, axis=0, return_inverse=True)
+        together = together.reshape(-1)
+        rep = np.full(len(cell), m)
+        np.minimum.at(rep, together, np.flatnonzero(alone))
+        community[alone] = rep[together]
+    return _smallest_member(community[member])
+
+
+def hierarchy(pos, edges, labels=None, movable=None):
+    """
+    ``LEVELS`` arrays with the community of every node per level, as its
+    smallest node index. ``labels``/``movable`` (per node) warm-start level 1,
+    whose communities start out as single nodes.
+    """
+    levels = []
+    groups = np.arange(len(pos))
+    for level in range(1, LEVELS + 1):
+        start = (labels, movable) if level == 1 else (None, None)
+        groups = coarsen(groups, pos, edges, level, *start)
+        levels.append(groups)
+    return levels
+
+
+def recluster(owner_id, node_ids=None):
+    """
+    Update the stored clusters of the map of ``owner_id``: rebuild them, or
+    recompute level 1 only around ``node_ids``. Returns the rows changed.
+    """
+    ids, pos, edges = load_map(owner_id)
+    if not ids:
+        return 0
+    index = {pk: i for i, pk in enumerate(ids)}
+    stored = {
+        (node_id, level): (pk, cluster)
+        for pk, node_id, level, cluster in NodeCluster.objects.filter(node_id__in=ids).values_list(
+            "pk", "node_id", "level", "cluster"
+        )
+    }
+
+    labels = movable = None
+    if node_ids is not None:
+        seeds = [index[pk] for pk in node_ids if pk in index]
+        movable = neighbourhood(len(ids), edges, seeds, RADIUS)
+        # start from the stored groups, even those named after a node now gone
+        _, groups = np.unique([stored.get((pk, 1), (None, pk))[1] for pk in ids], return_inverse=True)
+        labels = _smallest_member(groups.reshape(-1))
+
+    created, updated = [], []
+    for level, groups in enumerate(hierarchy(pos, edges, labels, movable), 1):
+        for i, node_id in enumerate(ids):
+            cluster = ids[groups[i]]
+            row = stored.get((node_id, level))
+            if row is None:
+                created.append(NodeCluster(node_id=node_id, level=level, cluster=cluster))
+            elif row[1] != cluster:
+                updated.append(NodeCluster(pk=row[0], cluster=cluster))
+    with transaction.atomic():
+        NodeCluster.objects.bulk_create(created, batch_size=1000)
+        NodeCluster.objects.bulk_update(updated, ["cluster"], batch_size=1000)
+    return len(created) + len(updated)
+
+
+@task(queue="layout")
+def recluster_map(owner_id, node_ids=None):
+    """Reclusters without a layout, when nodes leave or rejoin the map."""
+    recluster(owner_id, node_ids)
+
+
+# ── Views ────────────────────────────────────────────────────────────────────
+
+def summarise(nodes, level, limit):
+    """
+    The clusters at ``level`` of the nodes in the queryset ``nodes``, as
+    ``(clusters, links)``. Clusters are ``{"cluster", "size", "x", "y"}``,
+    largest first, at most ``limit``. Links are ``(cluster, cluster, edges)``
+    between the returned clusters. Nodes not clustered yet stand alone.
+    """
+    ids = nodes.values("pk")
+    clusters = list(
+        NodeCluster.objects.filter(level=level, node__in=ids)
+        .values("cluster")
+        .annotate(size=Count("node"), x=Avg("node__x"), y=Avg("node__y"))
+        .order_by("-size", "cluster")[:limit]
+    )
+    clusters += [
+        {"cluster": pk, "size": 1, "x": x, "y": y}
+        for pk, x, y in nodes.exclude(clusters__level=level)
+        .order_by("pk")
+        .values_list("pk", "x", "y")[: max(limit - len(clusters), 0)]
+    ]
+
+    def cluster_of(end):
+        return Coalesce(
+            Subquery(NodeCluster.objects.filter(level=level, node=OuterRef(end)).values("cluster")[:1]),
+            F(f"{end}_id"),
+            output_field=BigIntegerField(),
+        )
+
+    shown = {c["cluster"] for c in clusters}
+    links = {}
+    rows = (
+        Edge.objects.filter(node_a__in=ids, node_b__in=ids)
+        .annotate(source=cluster_of("node_a"), target=cluster_of("node_b"))
+        .exclude(source=F("target"))
+        .values("source", "target")
+        .annotate(edges=Count("pk"))
+        .order_by()
+    )
+    for row in rows:
+        pair = (min(row["source"], row["target"]), max(row["source"], row["target"]))
+        if pair[0] in shown and pair[1] in shown:
+            links[pair] = links.get(pair, 0) + row["edges"]
+    return clusters, [(a, b, count) for (a, b), count in sorted(links.items())]
@@ -0,0 +1,297 @@
+"""
+Server-side map layout.
+
+Positions come from a force-directed layout (Fruchterman–Reingold) over an
+owner's nodes and the edges between them, vectorised with NumPy. Repulsion
+uses a one-level Barnes–Hut grid: nodes in the same or a neighbouring cell
+push each other exactly, while farther cells push as one body at their
+centre of mass. An iteration therefore costs O(n · cells) instead of O(n²).
+
+Layouts run on the ``layout`` queue and are written back to ``Node.x/y``,
+so clients only ever read positions. A node dragged (``moveNodes``) while a
+layout ran keeps the position it was dragged to. The same job then updates
+the map's clusters (``graph.clusters``) and counts the edit towards
+rescoring it (``graph.analytics``).
+
+Adding a node or an edge queues an incremental pass. Only the nodes within
+``RADIUS`` hops of the change, and any piled on top of it, move, starting
+from their stored positions. The rest of the map stays put but still pushes
+on them. Changes touching more than ``INCREMENTAL_MAX_SEEDS`` nodes, such
+as large imports, get a full layout instead. ``layoutMap`` lays out a whole
+map.
+"""
+
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from scipy.spatial import cKDTree
+
+from graph.models import Edge, MapStats, Node
+from jobs.models import Job
+from jobs.queue import enqueue, task
+from vault.subscriptions import NodeUpdates
+
+# ideal distance between linked nodes, in map units (the map's grid spacing)
+IDEAL_EDGE = 200.0
+ITERATIONS = 100
+INCREMENTAL_ITERATIONS = 30
+# hops around a change that an incremental pass may move
+RADIUS = 2
+# changed nodes above which the whole map is laid out instead
+INCREMENTAL_MAX_SEEDS = 2000
+# pull towards the centre in full layouts, so separate components stay close
+GRAVITY = 1.0
+# average nodes per grid cell
+LEAF_SIZE = 16
+# elements per temporary array; bounds memory on large maps
+CHUNK = 1 << 20
+MIN_DISTANCE = 1.0
+
+
+# ── Forces ───────────────────────────────────────────────────────────────────
+
+def _push(d, weight, k):
+    """Repulsion along offsets ``d`` (last axis x, y), scaled by ``weight``."""
+    dist2 = np.maximum((d ** 2).sum(axis=-1), MIN_DISTANCE ** 2)
+    return d * (k * k * weight / dist2)[..., None]
+
+
+def _grid(pos):
+    """Cell coordinates of every node, and the number of cells per side."""
+    # fitted to the bulk of the nodes; stragglers share the edge cells
+    lo, hi = np.percentile(pos, [1, 99], axis=0)
+    span = max(float((hi - lo).max()), MIN_DISTANCE)
+    side = max(1, int(np.ceil(np.sqrt(len(pos) / LEAF_SIZE))))
+    cells = np.floor((pos - lo) / (span / side)).astype(np.int64)
+    return np.clip(cells, 0, side - 1), side
+
+
+def _repulsion(pos, targets, k):
+    """Repulsion on the nodes ``targets`` from every node in ``pos``."""
+    grid, side = _grid(pos)
+    cell = grid[:, 0] * side + grid[:, 1]
+
+    mass = np.bincount(cell, minlength=side * side).astype(float)
+    occupied = np.flatnonzero(mass)
+    centre = np.stack([np.bincount(cell, pos[:, axis], side * side) for axis in (0, 1)], axis=1)
+    centre = centre[occupied] / mass[occupied, None]
+    mass = mass[occupied]
+    cell_grid = np.stack([occupied // side, occupied % side], axis=1)
+
+    # nodes sorted by cell; a cell's members are order[starts[c]:starts[c] + counts[c]]
+    order = np.argsort(cell, kind="stable")
+    counts = np.bincount(cell, minlength=side * side)
+    starts = np.cumsum(counts) - counts
+
+    force = np.zeros((len(targets), 2))
+    step = max(1, CHUNK // max(len(occupied), int(counts.max())))
+    for lo in range(0, len(targets), step):
+        chunk = targets[lo:lo + step]
+        p, g = pos[chunk], grid[chunk]
+        # cells beyond the neighbouring ones act through their centre of mass
+        far = np.abs(cell_grid[None, :, :] - g[:, None, :]).max(axis=2) > 1
+        f = _push(p[:, None, :] - centre[None, :, :], mass[None, :] * far, k).sum(axis=1)
+        # the same and neighbouring cells act node by node
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                nx, ny = g[:, 0] + dx, g[:, 1] + dy
+                inside = (nx >= 0) & (nx < side) & (ny >= 0) & (ny < side)
+                near = np.where(inside, nx * side + ny, 0)
+                size = np.where(inside, counts[near], 0)
+                target = np.repeat(np.arange(len(chunk)), size)
+                rank = np.arange(len(target)) - np.repeat(np.cumsum(size) - size, size)
+                source = order[np.repeat(starts[near], size) + rank]
+                push = _push(p[target] - pos[source], source != chunk[target], k)
+                f[:, 0] += np.bincount(target, push[:, 0], len(chunk))
+                f[:, 1] += np.bincount(target, push[:, 1], len(chunk))
+        force[lo:lo + step] = f
+    return force
+
+
+def _attraction(pos, edges, k):
+    """Spring force along every edge, on every node."""
+    force = np.zeros_like(pos)
+    if len(edges):
+        d = pos[edges[:, 0]] - pos[edges[:, 1]]
+        pull = d * (np.sqrt((d ** 2).sum(axis=1)) / k)[:, None]
+        np.add.at(force, edges[:, 0], -pull)
+        np.add.at(force, edges[:, 1], pull)
+    return force
+
+
+def _spread_stacked(pos, movable, k, rng):
+    # nodes sharing one spot have no direction to be pushed apart in
+    _, inverse, counts = np.unique(pos, axis=0, return_inverse=True, return_counts=True)
+    stacked = (counts[inverse.reshape(-1)] > 1) & movable
+    pos[stacked] += rng.uniform(-k / 2, k / 2, size=(int(stacked.sum()), 2))
+
+
+def force_layout(pos, edges, movable=None, iterations=ITERATIONS, k=IDEAL_EDGE, temperature=None,
+                 gravity=0.0, seed=0):
+    """
+    Run ``iterations`` layout steps over ``pos`` (n × 2) and ``edges``
+    (index pairs); return the new positions. Only nodes in the boolean mask
+    ``movable`` (all by default) move, and no further per step than the
+    ``temperature``, which cools linearly to zero from a tenth of the map's
+    width by default.
+    """
+    pos = np.array(pos, dtype=float).reshape(-1, 2)
+    edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+    movable = np.ones(len(pos), dtype=bool) if movable is None else np.asarray(movable, dtype=bool)
+    targets = np.flatnonzero(movable)
+    if not len(targets):
+        return pos
+    _spread_stacked(pos, movable, k, np.random.default_rng(seed))
+    if temperature is None:
+        temperature = max(float(np.ptp(pos, axis=0).max()) / 10, k)
+
+    for i in range(iterations):
+        limit = temperature * (1 - i / iterations)
+        force = _repulsion(pos, targets, k) + _attraction(pos, edges, k)[targets]
+        if gravity:
+            force -= gravity * (pos[targets] - pos.mean(axis=0))
+        length = np.maximum(np.sqrt((force ** 2).sum(axis=1)), 1e-9)
+        pos[targets] += force * (np.minimum(length, limit) / length)[:, None]
+    return pos
+
+
+def neighbourhood(n, edges, seeds, radius=RADIUS):
+    """Boolean mask of the nodes within ``radius`` hops of ``seeds``."""
+    mask = np.zeros(n, dtype=bool)
+    mask[seeds] = True
+    for _ in range(radius):
+        touched = edges[mask[edges[:, 0]] | mask[edges[:, 1]]].ravel()
+        if mask[touched].all():
+            break
+        mask[touched] = True
+    return mask
+
+
+# ── Maps ─────────────────────────────────────────────────────────────────────
+
+def load_map(owner_id):
+    """
+    The live nodes of ``owner_id`` as ``(ids, positions, edges)``: node ids
+    in ascending order, their positions (n × 2) and the edges between them
+    as index pairs.
+    """
+    rows = list(Node.objects.filter(owner_id=owner_id).order_by("pk").values_list("pk", "x", "y"))
+    ids = [pk for pk, _, _ in rows]
+    index = {pk: i for i, pk in enumerate(ids)}
+    pos = np.array([(x, y) for _, x, y in rows], dtype=float).reshape(-1, 2)
+    pairs = Edge.objects.filter(node_a__owner_id=owner_id, node_b__owner_id=owner_id).values_list(
+        "node_a_id", "node_b_id"
+    )
+    edges = np.array([(index[a], index[b]) for a, b in pairs], dtype=np.int64).reshape(-1, 2)
+    return ids, pos, edges
+
+
+def _write_back(ids, pos, new):
+    """
+    Store the positions in ``new`` of the nodes that moved, except those
+    whose stored position is no longer ``pos``: a drag (``moveNodes``) made
+    while the layout ran wins over it. Returns the nodes written.
+    """
+    changed = np.flatnonzero((np.abs(new - pos) > 0.5).any(axis=1))
+    current = {}
+    for lo in range(0, len(changed), 500):
+        batch = [ids[i] for i in changed[lo:lo + 500]]
+        # locked, so nothing moves them between this check and the update
+        current.update(
+            (pk, (x, y)) for pk, x, y in Node.objects.select_for_update().filter(pk__in=batch).values_list("pk", "x", "y")
+        )
+    moved = [
+        Node(pk=ids[i], x=float(new[i, 0]), y=float(new[i, 1]))
+        for i in changed
+        if current.get(ids[i]) == (pos[i, 0], pos[i, 1])
+    ]
+    # bulk_update skips post_save; one notification per node instead
+    Node.objects.bulk_update(moved, ["x", "y"], batch_size=500)
+    transaction.on_commit(lambda: NodeUpdates.notify_many({node.pk for node in moved}))
+    return moved
+
+
+def _piled_on(pos, seeds):
+    """Boolean mask of the nodes closer than ``IDEAL_EDGE`` to any of ``seeds``."""
+    distance, _ = cKDTree(pos[seeds]).query(pos, distance_upper_bound=IDEAL_EDGE)
+    return distance < IDEAL_EDGE
+
+
+def _layout_generation(owner_id):
+    stats, _ = MapStats.objects.get_or_create(owner_id=owner_id)
+    return stats.layout_generation
+
+
+def relayout(owner_id, node_ids=None):
+    """
+    Lay out the map of ``owner_id`` (its live nodes and the edges between
+    them), all of it or only around ``node_ids``; store the positions and
+    return the ids of the nodes that moved.
+
+    The positions are computed without holding any lock. The owner's
+    ``MapStats`` row is locked only to write the result, and only if no
+    other layout of the map was written since this one read it; otherwise
+    the layout is queued again to run on the newer positions.
+    """
+    generation = _layout_generation(owner_id)
+    ids, pos, edges = load_map(owner_id)
+    if not ids:
+        return []
+    index = {pk: i for i, pk in enumerate(ids)}
+
+    seeds = None if node_ids is None else [index[pk] for pk in node_ids if pk in index]
+    if seeds is None or len(seeds) > INCREMENTAL_MAX_SEEDS:
+        new = force_layout(pos, edges, gravity=GRAVITY)
+    elif seeds:
+        movable = neighbourhood(len(ids), edges, seeds)
+        # whatever sits on top of a new node gets pushed off it
+        movable |= _piled_on(pos, seeds)
+        new = force_layout(pos, edges, movable, INCREMENTAL_ITERATIONS, temperature=IDEAL_EDGE)
+    else:
+        return []
+
+    with transaction.atomic():
+        stats = MapStats.objects.select_for_update().get(owner_id=owner_id)
+        if stats.layout_generation == generation:
+            MapStats.objects.filter(pk=stats.pk).update(layout_generation=F("layout_generation") + 1)
+            return [node.pk for node in _write_back(ids, pos, new)]
+    # another layout of the map was written meanwhile; redo this one on top of it
+    schedule(owner_id, node_ids)
+    return []
+
+
+@task(queue="layout")
+def layout_map(owner_id, node_ids=None):
+    from graph.analytics import note_changes
+    from graph.clusters import recluster
+
+    relayout(owner_id, node_ids)
+    # the coarse levels group unlinked nodes by where they now sit
+    recluster(owner_id, node_ids)
+    if node_ids:
+        note_changes(owner_id, len(node_ids))
+
+
+def schedule(owner_id, node_ids=None):
+    """
+    Queue a layout of the map of ``owner_id`` around ``node_ids``, or all of
+    it for ``None``. A layout of the same map still waiting to run absorbs
+    the request, so a burst of edits is laid out once.
+    """
+    node_ids = None if node_ids is None else sorted({int(pk) for pk in node_ids})
+    pending = Job.objects.filter(task=layout_map.task_name, status=Job.QUEUED, args__0=owner_id).first()
+    if pending is not None:
+        queued = pending.args[1] if len(pending.args) > 1 else None
+        merged = None if queued is None or node_ids is None else sorted(set(queued) | set(node_ids))
+        # a worker may have claimed it meanwhile; then queue a new one
+        if Job.objects.filter(pk=pending.pk, status=Job.QUEUED).update(args=[owner_id, merged]):
+            return
+    enqueue(
+        layout_map,
+        args=(owner_id, node_ids),
+        run_at=timezone.now() + timedelta(seconds=settings.LAYOUT_DEBOUNCE_SECONDS),
+    )
@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from graph import transfer
+
+
+class Command(BaseCommand):
+    help = "Write a user's map as JSON Lines or GraphML."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="Whose map to export.")
+        parser.add_argument("--output", "-o", default="-", help="File to write; standard output by default.")
+        parser.add_argument("--format", choices=transfer.FORMATS, help="Guessed from the output name by default.")
+
+    def handle(self, *args, username, output, format, **options):
+        user = get_user_model().objects.filter(username=username).first()
+        if user is None:
+            raise CommandError(f"No such user: {username}")
+        fmt = format or transfer.format_for(output)
+        if output == "-":
+            for chunk in transfer.export(user, fmt):
+                self.stdout.write(chunk, ending="")
+            return
+        with open(output, "w", encoding="utf-8") as stream:
+            for chunk in transfer.export(user, fmt):
+                stream.write(chunk)
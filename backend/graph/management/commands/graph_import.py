@@ -0,0 +1,33 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from graph import transfer
+
+
+class Command(BaseCommand):
+    help = "Add the nodes, edges and file links of a JSON Lines or GraphML file to a user's map."
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="Whose map to import into.")
+        parser.add_argument("path", help="File to read; - for standard input.")
+        parser.add_argument("--format", choices=transfer.FORMATS, help="Guessed from the file name by default.")
+
+    def handle(self, *args, username, path, format, **options):
+        user = get_user_model().objects.filter(username=username).first()
+        if user is None:
+            raise CommandError(f"No such user: {username}")
+        fmt = format or transfer.format_for(path)
+        try:
+            if path == "-":
+                counts = transfer.import_graph(user, transfer.read(sys.stdin.buffer, fmt))
+            else:
+                with open(path, "rb") as stream:
+                    counts = transfer.import_graph(user, transfer.read(stream, fmt))
+        except (OSError, transfer.GraphImportError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(
+            f"Imported {counts['nodes']} node(s), {counts['edges']} edge(s) and {counts['files']} file link(s); "
+            f"skipped {counts['skipped_files']} unreadable file link(s)."
+        )
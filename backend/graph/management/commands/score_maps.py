@@ -0,0 +1,25 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from graph.analytics import score_map
+from graph.models import Node
+
+
+class Command(BaseCommand):
+    help = "Recompute the importance scores of users' maps, in this process rather than on the layout queue."
+
+    def add_arguments(self, parser):
+        parser.add_argument("usernames", nargs="*", help="Whose maps; every map with nodes by default.")
+
+    def handle(self, *args, usernames, **options):
+        if usernames:
+            owners = dict(get_user_model().objects.filter(username__in=usernames).values_list("username", "pk"))
+            missing = set(usernames) - owners.keys()
+            if missing:
+                raise CommandError(f"No such user(s): {', '.join(sorted(missing))}")
+            owner_ids = list(owners.values())
+        else:
+            owner_ids = list(Node.objects.values_list("owner_id", flat=True).distinct().order_by("owner_id"))
+        for owner_id in owner_ids:
+            score_map(owner_id)
+        self.stdout.write(f"Scored {len(owner_ids)} map(s).")
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 08:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:00
+
+from django.db import migrations, models
+
+
+def grid_layout(apps, schema_editor):
+    # the map used to keep positions in the browser; start every owner's
+    # nodes on the grid it fell back to, five to a row
+    Node = apps.get_model("graph", "Node")
+    nodes = list(Node.objects.order_by("owner_id", "id"))
+    index = {}
+    for node in nodes:
+        i = index[node.owner_id] = index.get(node.owner_id, -1) + 1
+        node.x = 50 + (i % 5) * 200
+        node.y = 50 + (i // 5) * 200
+    Node.objects.bulk_update(nodes, ["x", "y"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0002_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='layer',
+            field=models.IntegerField(default=0, help_text='Stacking order on the map; higher is drawn on top'),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='x',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='y',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['x', 'y'], name='node_position_idx'),
+        ),
+        migrations.RunPython(grid_layout, migrations.RunPython.noop),
+    ]
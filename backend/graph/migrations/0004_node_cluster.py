@@ -0,0 +1,27 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0003_node_position'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeCluster',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.PositiveSmallIntegerField()),
+                ('cluster', models.BigIntegerField()),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='clusters', to='graph.node')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['level', 'cluster'], name='nodecluster_level_idx')],
+                'unique_together': {('node', 'level')},
+            },
+        ),
+    ]
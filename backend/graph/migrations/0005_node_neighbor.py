@@ -0,0 +1,42 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_neighbors(apps, schema_editor):
+    Edge = apps.get_model("graph", "Edge")
+    NodeNeighbor = apps.get_model("graph", "NodeNeighbor")
+    rows = []
+    for pk, a, b in Edge.objects.values_list("pk", "node_a_id", "node_b_id").iterator():
+        rows.append(NodeNeighbor(node_id=a, neighbor_id=b, edge_id=pk))
+        if a != b:
+            rows.append(NodeNeighbor(node_id=b, neighbor_id=a, edge_id=pk))
+        if len(rows) >= 1000:
+            NodeNeighbor.objects.bulk_create(rows)
+            rows = []
+    NodeNeighbor.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0004_node_cluster'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('edge', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ends', to='graph.edge')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='graph.node')),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbor_links', to='graph.node')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['node', 'neighbor'], name='nodeneighbor_node_idx')],
+                'unique_together': {('node', 'edge')},
+            },
+        ),
+        migrations.RunPython(fill_neighbors, migrations.RunPython.noop),
+    ]
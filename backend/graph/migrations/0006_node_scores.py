@@ -0,0 +1,57 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('graph', '0005_node_neighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MapStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('changes', models.PositiveIntegerField(default=0, help_text='Nodes touched by edits since the last scoring')),
+                ('nodes', models.PositiveIntegerField(default=0, help_text='Nodes in the map when it was last scored')),
+                ('scored_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='betweenness',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='degree',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='node',
+            name='pagerank',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['owner', '-pagerank', 'id'], name='node_pagerank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['owner', '-degree', 'id'], name='node_degree_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['owner', '-betweenness', 'id'], name='node_betweenness_idx'),
+        ),
+        migrations.AddField(
+            model_name='mapstats',
+            name='owner',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='map_stats', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 09:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0006_node_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='node',
+            name='import_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0007_node_import_key'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='node',
+            name='node_position_idx',
+        ),
+        migrations.AddIndex(
+            model_name='node',
+            index=models.Index(fields=['owner', 'x', 'y'], name='node_position_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-19 10:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('graph', '0008_node_owner_position_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mapstats',
+            name='layout_generation',
+            field=models.PositiveIntegerField(default=0, help_text='Layouts written to the map; a layout computed from older positions is redone'),
+        ),
+    ]
@@ -4,8 +4,27 @@ from django.utils import timezone
 
 User = settings.AUTH_USER_MODEL
 
+class LiveNodeManager(models.Manager):
+    """Nodes that are not in the trash."""
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+class LiveNodeFileManager(models.Manager):
+    """Node files whose node and file are both out of the trash."""
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            node__deleted_at__isnull=True, file__deleted_at__isnull=True
+        )
+
+class LiveEdgeManager(models.Manager):
+    """Edges whose endpoints are both out of the trash."""
+    def get_queryset(self):
+        return super().get_queryset().filter(
+            node_a__deleted_at__isnull=True, node_b__deleted_at__isnull=True
+        )
+
 class Node(models.Model):
-    """A container of files, owned by a user."""
+    """A container of files, owned by a user, placed at (x, y) on the map."""
     name        = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     owner       = models.ForeignKey(
@@ -13,7 +32,31 @@ class Node(models.Model):
         on_delete=models.CASCADE,
         related_name="nodes"
     )
+    x           = models.FloatField(default=0)
+    y           = models.FloatField(default=0)
+    layer       = models.IntegerField(default=0, help_text="Stacking order on the map; higher is drawn on top")
+    # importance within the owner's map, kept up to date by graph.analytics
+    pagerank    = models.FloatField(default=0)
+    degree      = models.PositiveIntegerField(default=0)
+    betweenness = models.FloatField(default=0)
+    # set only while a bulk import resolves the ids of the rows it inserted
+    import_key  = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
     created_at  = models.DateTimeField(auto_now_add=True)
+    deleted_at  = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects     = LiveNodeManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # bounding-box lookups narrow to one owner's map, range over x,
+            # then filter y from the index
+            models.Index(fields=["owner", "x", "y"], name="node_position_idx"),
+            # myNodes(orderBy: ...) reads the top of a map straight off these
+            models.Index(fields=["owner", "-pagerank", "id"], name="node_pagerank_idx"),
+            models.Index(fields=["owner", "-degree", "id"], name="node_degree_idx"),
+            models.Index(fields=["owner", "-betweenness", "id"], name="node_betweenness_idx"),
+        ]
 
     def __str__(self):
         return f"Node {self.id}: {self.name}"
@@ -33,6 +76,9 @@ class NodeFile(models.Model):
     note      = models.TextField(blank=True)
     added_at  = models.DateTimeField(auto_now_add=True)
 
+    objects     = LiveNodeFileManager()
+    all_objects = models.Manager()
+
     class Meta:
         unique_together = ("node", "file")
 
@@ -54,12 +100,93 @@ class Edge(models.Model):
     label      = models.CharField(max_length=100, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects     = LiveEdgeManager()
+    all_objects = models.Manager()
+
     class Meta:
         unique_together = (("node_a", "node_b"), ("node_b", "node_a"))
 
     def __str__(self):
         return f"Edge {self.id}: {self.node_a_id} ↔ {self.node_b_id}"
 
+class NodeNeighbor(models.Model):
+    """
+    One direction of an edge: ``node`` is linked to ``neighbor`` by ``edge``.
+    Every edge has a row per end (one for a loop), so the edges of a node,
+    or between two nodes, are a single index range scan whichever end they
+    were stored under. Rows are written by ``graph.signals`` for saved edges,
+    and with ``for_edges`` wherever edges are bulk created.
+    """
+    node     = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name="neighbor_links"
+    )
+    neighbor = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name="+"
+    )
+    edge     = models.ForeignKey(
+        Edge,
+        on_delete=models.CASCADE,
+        related_name="ends"
+    )
+
+    class Meta:
+        unique_together = ("node", "edge")
+        indexes = [models.Index(fields=["node", "neighbor"], name="nodeneighbor_node_idx")]
+
+    @classmethod
+    def for_edges(cls, edges):
+        """Unsaved rows for both ends of ``edges``."""
+        rows = []
+        for edge in edges:
+            rows.append(cls(node_id=edge.node_a_id, neighbor_id=edge.node_b_id, edge_id=edge.pk))
+            if edge.node_a_id != edge.node_b_id:
+                rows.append(cls(node_id=edge.node_b_id, neighbor_id=edge.node_a_id, edge_id=edge.pk))
+        return rows
+
+    def __str__(self):
+        return f"NodeNeighbor: {self.node_id} → {self.neighbor_id} (edge {self.edge_id})"
+
+class NodeCluster(models.Model):
+    """
+    The community a node belongs to at one level of its owner's map
+    (1 is the finest), named by the smallest node id in it.
+    """
+    node    = models.ForeignKey(
+        Node,
+        on_delete=models.CASCADE,
+        related_name="clusters"
+    )
+    level   = models.PositiveSmallIntegerField()
+    cluster = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ("node", "level")
+        indexes = [models.Index(fields=["level", "cluster"], name="nodecluster_level_idx")]
+
+    def __str__(self):
+        return f"NodeCluster: node={self.node_id}, level={self.level}, cluster={self.cluster}"
+
+class MapStats(models.Model):
+    """How much an owner's map has changed since it was last scored, and how often it was laid out."""
+    owner     = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        related_name="map_stats"
+    )
+    changes   = models.PositiveIntegerField(default=0, help_text="Nodes touched by edits since the last scoring")
+    nodes     = models.PositiveIntegerField(default=0, help_text="Nodes in the map when it was last scored")
+    scored_at = models.DateTimeField(null=True, blank=True)
+    layout_generation = models.PositiveIntegerField(
+        default=0, help_text="Layouts written to the map; a layout computed from older positions is redone"
+    )
+
+    def __str__(self):
+        return f"MapStats: owner={self.owner_id}, changes={self.changes}"
+
 class NodeShare(models.Model):
     """Grants read/write access to a Node."""
     READ  = "R"
@@ -1,12 +1,112 @@
 import graphene
+import numpy as np
 from graphql import GraphQLError
 from graphene_django import DjangoObjectType
-from django.db.models import Q
+from graphene_file_upload.scalars import Upload
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q, prefetch_related_objects
+from django.urls import reverse
 
-from .models import Node, NodeFile, Edge, NodeShare
+from .models import Node, NodeFile, NodeNeighbor, Edge, NodeShare
 from accounts.schema import UserType
-from files.schema import FileType
+from files import usage
+from graph import adjacency, analytics, bulk, clusters, layout, transfer
+from files.schema import FileType, discard_uploads
 from accounts.models import Group
+from vault.deletion import trash_nodes
+from vault.subscriptions import NodeUpdates
+
+# ── Helpers ──────────────────────────────────────────────────────────────────
+
+def _shared_with(user):
+    """Condition on nodes the user has READ/WRITE access to through a share."""
+    allowed_perms = [NodeShare.READ, NodeShare.WRITE]
+    shared = Q(shares__is_public=True, shares__permission__in=allowed_perms)
+    if user.is_anonymous:
+        return shared
+    groups = user.group_memberships.values_list("group", flat=True)
+    return (
+        shared
+        | Q(shares__shared_with_user=user, shares__permission__in=allowed_perms)
+        | Q(shares__shared_with_group__in=groups, shares__permission__in=allowed_perms)
+    )
+
+
+def readable_nodes(user):
+    """Nodes the user owns or has READ/WRITE access to through a share."""
+    if user.is_anonymous:
+        return Node.objects.filter(_shared_with(user)).distinct()
+    return Node.objects.filter(Q(owner=user) | _shared_with(user)).distinct()
+
+
+def readable_parts_in(user, x_range, y_range):
+    """
+    The readable nodes inside a box, as querysets to union: the user's own
+    nodes and the ones shared with them. ``readable_nodes`` ORs the owner
+    test with the share joins, which keeps the database off the (owner, x, y)
+    index; apart, the own part is read straight from it.
+    """
+    box = Q(x__range=x_range, y__range=y_range)
+    parts = [Node.objects.filter(box).filter(_shared_with(user)).distinct().order_by()]
+    if not user.is_anonymous:
+        parts.insert(0, Node.objects.filter(box, owner=user).order_by())
+    return parts
+
+
+def readable_mask(user):
+    """
+    Traversal filter for ``adjacency.Graph``: a mask of the given node ids
+    the user may read. Their own nodes are told apart by the owners the
+    traversal passes along; only the rest are looked up.
+    """
+    def allowed(ids, owners):
+        ok = owners == (user.pk or 0)
+        rest = ids[~ok].tolist()
+        if rest:
+            shared = readable_nodes(user).filter(pk__in=rest).values_list("pk", flat=True)
+            ok |= np.isin(ids, list(shared))
+        return ok
+
+    return allowed
+
+
+def _start(graph, allowed, user, node_id):
+    """``(node id, owner id)`` of a readable node to start a traversal from."""
+    try:
+        node_id = int(node_id)
+    except (TypeError, ValueError):
+        raise GraphQLError("Node not found.")
+    owner_id = graph.owner_of(node_id, likely=user.pk)
+    if owner_id is None or not allowed(np.array([node_id]), np.array([owner_id]))[0]:
+        raise GraphQLError("Node not found.")
+    return node_id, owner_id
+
+
+def _nodes_in_order(ids):
+    nodes = Node.objects.select_related("owner").in_bulk(ids)
+    return [nodes[pk] for pk in ids if pk in nodes]
+
+
+def _id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _owned(user, node_ids):
+    """The ids among ``node_ids`` of live nodes ``user`` owns, in one query."""
+    node_ids = {pk for pk in node_ids if pk is not None}
+    return set(Node.objects.filter(pk__in=node_ids, owner=user).values_list("pk", flat=True))
+
+
+def _check_batch(user, items):
+    if user.is_anonymous:
+        raise GraphQLError("Authentication required.")
+    if len(items) > settings.GRAPH_BATCH_MAX_ITEMS:
+        raise GraphQLError(f"At most {settings.GRAPH_BATCH_MAX_ITEMS} items can be sent at once.")
+
 
 # ── Types ────────────────────────────────────────────────────────────────────
 
@@ -29,14 +129,18 @@ class NodeShareType(DjangoObjectType):
 
 
 class NodeType(DjangoObjectType):
-    owner  = graphene.Field(UserType)
-    files  = graphene.List(NodeFileType)
-    edges  = graphene.List(EdgeType)
-    shares = graphene.List(NodeShareType)
+    owner      = graphene.Field(UserType)
+    files      = graphene.List(NodeFileType)
+    edges      = graphene.List(EdgeType)
+    shares     = graphene.List(NodeShareType)
+    export_url = graphene.String(description="ZIP of every file in the node you can read")
 
     class Meta:
         model  = Node
-        fields = ("id", "name", "description", "created_at", "owner", "files", "edges", "shares")
+        fields = (
+            "id", "name", "description", "x", "y", "layer", "pagerank", "degree", "betweenness", "created_at",
+            "deleted_at", "owner", "files", "edges", "shares",
+        )
 
     def resolve_owner(self, info):
         return self.owner
@@ -45,7 +149,10 @@ class NodeType(DjangoObjectType):
         return self.node_files.select_related("file").all()
 
     def resolve_edges(self, info):
-        return Edge.objects.filter(Q(node_a=self) | Q(node_b=self))
+        return Edge.objects.filter(ends__node=self)
+
+    def resolve_export_url(self, info):
+        return info.context.build_absolute_uri(reverse("graph:node-export", args=[self.pk]))
 
     def resolve_shares(self, info):
         user = info.context.user
@@ -74,6 +181,90 @@ class NodeType(DjangoObjectType):
         # Access confirmed → return all shares on the node
         return NodeShare.objects.filter(node=self)
 
+
+class BoundingBox(graphene.InputObjectType):
+    """A rectangle in map coordinates."""
+    min_x = graphene.Float(required=True)
+    min_y = graphene.Float(required=True)
+    max_x = graphene.Float(required=True)
+    max_y = graphene.Float(required=True)
+
+
+class MapClusterType(graphene.ObjectType):
+    id   = graphene.ID(description="Smallest node id in the cluster")
+    size = graphene.Int(description="Nodes of the cluster you can read inside the box")
+    x    = graphene.Float()
+    y    = graphene.Float()
+
+
+class MapLinkType(graphene.ObjectType):
+    source = graphene.ID()
+    target = graphene.ID()
+    edges  = graphene.Int()
+
+
+class MapViewType(graphene.ObjectType):
+    """Clusters and the links between them when zoomed out, real nodes when zoomed in."""
+    level    = graphene.Int()
+    clusters = graphene.List(MapClusterType)
+    links    = graphene.List(MapLinkType)
+    nodes    = graphene.List(NodeType)
+
+
+class NodeMoveInput(graphene.InputObjectType):
+    node_id = graphene.ID(required=True)
+    x       = graphene.Float(required=True)
+    y       = graphene.Float(required=True)
+    layer   = graphene.Int()
+
+class NodeInput(graphene.InputObjectType):
+    name        = graphene.String(required=True)
+    description = graphene.String()
+    x           = graphene.Float()
+    y           = graphene.Float()
+    layer       = graphene.Int()
+
+
+class EdgeInput(graphene.InputObjectType):
+    node_a_id = graphene.ID(required=True)
+    node_b_id = graphene.ID(required=True)
+    label     = graphene.String()
+
+
+class FileLinkInput(graphene.InputObjectType):
+    node_id = graphene.ID(required=True)
+    file_id = graphene.ID(required=True)
+    note    = graphene.String()
+
+
+class FileMoveInput(graphene.InputObjectType):
+    from_node = graphene.ID(required=True)
+    to_node   = graphene.ID(required=True)
+    file_id   = graphene.ID(required=True)
+
+
+class NodeResultType(graphene.ObjectType):
+    node  = graphene.Field(NodeType)
+    error = graphene.String()
+
+
+class EdgeResultType(graphene.ObjectType):
+    edge  = graphene.Field(EdgeType)
+    error = graphene.String()
+
+
+class FileLinkResultType(graphene.ObjectType):
+    node_file = graphene.Field(NodeFileType)
+    error     = graphene.String()
+
+
+class FileMoveResultType(graphene.ObjectType):
+    ok    = graphene.Boolean()
+    error = graphene.String()
+
+# scores myNodes can be ordered by, each with an index per owner
+NODE_SCORES = ("pagerank", "degree", "betweenness")
+
 # ── Queries ──────────────────────────────────────────────────────────────────
 
 class GraphQuery(graphene.ObjectType):
@@ -83,6 +274,7 @@ class GraphQuery(graphene.ObjectType):
         limit=graphene.Int(default_value=20),
         offset=graphene.Int(default_value=0),
         name_contains=graphene.String(),
+        order_by=graphene.String(description=f"Most important first by one of: {', '.join(NODE_SCORES)}"),
     )
     node_files   = graphene.List(
         NodeFileType,
@@ -101,28 +293,60 @@ class GraphQuery(graphene.ObjectType):
         limit=graphene.Int(default_value=20),
         offset=graphene.Int(default_value=0),
     )
+    nodes_in_viewport = graphene.List(
+        NodeType,
+        bbox=BoundingBox(required=True),
+        zoom=graphene.Float(default_value=1.0),
+        limit=graphene.Int(),
+        description="Readable nodes inside bbox, plus a margin that shrinks as zoom grows; top layers first",
+    )
+    map_at_zoom = graphene.Field(
+        MapViewType,
+        level=graphene.Int(required=True),
+        bbox=BoundingBox(required=True),
+        description=f"Zoom level 0 (everything) to {clusters.LEVELS} (single nodes) of the readable map in bbox",
+    )
+    neighbors = graphene.List(
+        NodeType,
+        node_id=graphene.ID(required=True),
+        depth=graphene.Int(default_value=1),
+        limit=graphene.Int(),
+        description=f"Readable nodes within depth (at most {adjacency.MAX_DEPTH}) hops over readable nodes, nearest first",
+    )
+    shortest_path = graphene.List(
+        NodeType,
+        a=graphene.ID(required=True),
+        b=graphene.ID(required=True),
+        description="Nodes along a shortest path from a to b over readable nodes; null if there is none",
+    )
+    connected_component = graphene.List(
+        NodeType,
+        node_id=graphene.ID(required=True),
+        limit=graphene.Int(),
+        description="The node and every readable node reachable from it over readable nodes, nearest first",
+    )
+
+    map_export_url = graphene.String(
+        format=graphene.String(default_value="jsonl"),
+        description=f"Download of your whole map, as one of: {', '.join(transfer.FORMATS)}",
+    )
 
     def resolve_ping(self, info):
         return "pong"
 
-    def resolve_my_nodes(self, info, limit, offset, name_contains=None):
+    def resolve_my_nodes(self, info, limit, offset, name_contains=None, order_by=None):
         user = info.context.user
         if user.is_anonymous:
             raise GraphQLError("Authentication required.")
 
-        # Allow both READ and WRITE permissions
-        allowed_perms = [NodeShare.READ, NodeShare.WRITE]
-        groups = user.group_memberships.values_list("group", flat=True)
-
-        qs = Node.objects.filter(
-            Q(owner=user)
-            | Q(shares__is_public=True, shares__permission__in=allowed_perms)
-            | Q(shares__shared_with_user=user, shares__permission__in=allowed_perms)
-            | Q(shares__shared_with_group__in=groups, shares__permission__in=allowed_perms)
-        ).distinct()
+        qs = readable_nodes(user)
 
         if name_contains:
             qs = qs.filter(name__icontains=name_contains)
+        if order_by:
+            if order_by not in NODE_SCORES:
+                raise GraphQLError(f"orderBy must be one of: {', '.join(NODE_SCORES)}.")
+            qs = qs.order_by(f"-{order_by}", "id")
 
         return qs[offset : offset + limit]
 
@@ -137,7 +361,7 @@ class GraphQuery(graphene.ObjectType):
         node = Node.objects.filter(pk=node_id).first()
         if not node:
             raise GraphQLError("Node not found.")
-        qs = Edge.objects.filter(Q(node_a=node) | Q(node_b=node))
+        qs = Edge.objects.filter(ends__node=node)
         return qs[offset : offset + limit]
 
     def resolve_public_nodes(self, info, limit, offset):
@@ -146,6 +370,76 @@ class GraphQuery(graphene.ObjectType):
         ).distinct()
         return qs[offset : offset + limit]
 
+    def resolve_nodes_in_viewport(self, info, bbox, zoom, limit=None):
+        if bbox.min_x > bbox.max_x or bbox.min_y > bbox.max_y:
+            raise GraphQLError("bbox min must not exceed max.")
+        if zoom <= 0:
+            raise GraphQLError("zoom must be positive.")
+        margin = settings.MAP_VIEWPORT_MARGIN_PX / zoom
+        limit = min(limit or settings.MAP_VIEWPORT_MAX_NODES, settings.MAP_VIEWPORT_MAX_NODES)
+        first, *rest = readable_parts_in(
+            info.context.user,
+            (bbox.min_x - margin, bbox.max_x + margin),
+            (bbox.min_y - margin, bbox.max_y + margin),
+        )
+        nodes = list(first.union(*rest).order_by("-layer", "id")[:limit])
+        prefetch_related_objects(nodes, "owner")
+        return nodes
+
+    def resolve_map_at_zoom(self, info, level, bbox):
+        if bbox.min_x > bbox.max_x or bbox.min_y > bbox.max_y:
+            raise GraphQLError("bbox min must not exceed max.")
+        level = max(0, min(level, clusters.LEVELS))
+        first, *rest = (
+            part.values("pk")
+            for part in readable_parts_in(info.context.user, (bbox.min_x, bbox.max_x), (bbox.min_y, bbox.max_y))
+        )
+        visible = Node.objects.filter(pk__in=first.union(*rest))
+        limit = settings.MAP_VIEWPORT_MAX_NODES
+        if level == clusters.LEVELS:
+            nodes = visible.select_related("owner").order_by("-layer", "id")[:limit]
+            return MapViewType(level=level, clusters=[], links=[], nodes=nodes)
+        groups, links = clusters.summarise(visible, clusters.LEVELS - level, limit)
+        return MapViewType(
+            level=level,
+            clusters=[MapClusterType(id=g["cluster"], size=g["size"], x=g["x"], y=g["y"]) for g in groups],
+            links=[MapLinkType(source=a, target=b, edges=count) for a, b, count in links],
+            nodes=[],
+        )
+
+    def resolve_neighbors(self, info, node_id, depth, limit=None):
+        user = info.context.user
+        graph = adjacency.current()
+        allowed = readable_mask(user)
+        start, owner_id = _start(graph, allowed, user, node_id)
+        depth = max(1, min(depth, adjacency.MAX_DEPTH))
+        limit = min(limit or settings.GRAPH_TRAVERSAL_MAX_NODES, settings.GRAPH_TRAVERSAL_MAX_NODES)
+        return _nodes_in_order(graph.reach(start, owner_id, allowed, depth, limit))
+
+    def resolve_shortest_path(self, info, a, b):
+        user = info.context.user
+        graph = adjacency.current()
+        allowed = readable_mask(user)
+        source, owner_id = _start(graph, allowed, user, a)
+        target, _ = _start(graph, allowed, user, b)
+        path = graph.path(source, owner_id, target, allowed)
+        return None if path is None else _nodes_in_order(path)
+
+    def resolve_connected_component(self, info, node_id, limit=None):
+        user = info.context.user
+        graph = adjacency.current()
+        allowed = readable_mask(user)
+        start, owner_id = _start(graph, allowed, user, node_id)
+        limit = min(limit or settings.GRAPH_TRAVERSAL_MAX_NODES, settings.GRAPH_TRAVERSAL_MAX_NODES)
+        return _nodes_in_order([start] + graph.reach(start, owner_id, allowed, limit=limit - 1))
+
+    def resolve_map_export_url(self, info, format):
+        if info.context.user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        if format not in transfer.FORMATS:
+            raise GraphQLError(f"format must be one of: {', '.join(transfer.FORMATS)}.")
+        return info.context.build_absolute_uri(reverse("graph:map-export", args=[format]))
+
 
 # ── Mutations ────────────────────────────────────────────────────────────────
 
@@ -155,12 +449,17 @@ class CreateNode(graphene.Mutation):
     class Arguments:
         name        = graphene.String(required=True)
         description = graphene.String()
+        x           = graphene.Float()
+        y           = graphene.Float()
+        layer       = graphene.Int()
 
-    def mutate(self, info, name, description=""):
+    def mutate(self, info, name, description="", x=0, y=0, layer=0):
         user = info.context.user
         if user.is_anonymous:
             raise GraphQLError("Authentication required.")
-        node = Node.objects.create(owner=user, name=name, description=description)
+        with transaction.atomic():
+            node = Node.objects.create(owner=user, name=name, description=description, x=x, y=y, layer=layer)
+            layout.schedule(user.pk, [node.pk])
         return CreateNode(node=node)
 
 
@@ -185,6 +484,118 @@ class RenameNode(graphene.Mutation):
         return RenameNode(node=node)
 
 
+class MoveNodes(graphene.Mutation):
+    """Reposition many of your nodes at once, all or nothing."""
+    nodes = graphene.List(NodeType)
+
+    class Arguments:
+        moves = graphene.List(graphene.NonNull(NodeMoveInput), required=True)
+
+    def mutate(self, info, moves):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        if len(moves) > settings.MAP_MOVE_MAX_NODES:
+            raise GraphQLError(f"At most {settings.MAP_MOVE_MAX_NODES} nodes can be moved at once.")
+        by_id = {str(move.node_id): move for move in moves}
+        nodes = list(Node.objects.filter(pk__in=by_id, owner=user))
+        if len(nodes) != len(by_id):
+            raise GraphQLError("Permission denied.")
+        for node in nodes:
+            move = by_id[str(node.pk)]
+            node.x, node.y = move.x, move.y
+            if move.layer is not None:
+                node.layer = move.layer
+        with transaction.atomic():
+            # bulk_update skips post_save; one notification per node instead
+            Node.objects.bulk_update(nodes, ["x", "y", "layer"], batch_size=500)
+            transaction.on_commit(lambda: NodeUpdates.notify_many({node.pk for node in nodes}))
+        return MoveNodes(nodes=nodes)
+
+
+class CreateNodes(graphene.Mutation):
+    """Create many nodes in one transaction; a result per input, in order."""
+    results = graphene.List(NodeResultType)
+
+    class Arguments:
+        nodes = graphene.List(graphene.NonNull(NodeInput), required=True)
+
+    def mutate(self, info, nodes):
+        user = info.context.user
+        _check_batch(user, nodes)
+        max_length = Node._meta.get_field("name").max_length
+        results, new = [], []
+        for item in nodes:
+            if not item.name or len(item.name) > max_length:
+                results.append(NodeResultType(error=f"Name must be 1 to {max_length} characters."))
+                continue
+            node = Node(
+                owner=user,
+                name=item.name,
+                description=item.description or "",
+                x=item.x or 0,
+                y=item.y or 0,
+                layer=item.layer or 0,
+            )
+            new.append(node)
+            results.append(NodeResultType(node=node))
+        with transaction.atomic():
+            bulk.insert_nodes(new)
+            if new:
+                created = [node.pk for node in new]
+                layout.schedule(user.pk, created)
+                transaction.on_commit(lambda: NodeUpdates.notify_created(created))
+        return CreateNodes(results=results)
+
+
+class LayoutMap(graphene.Mutation):
+    """Queue a fresh layout of all your nodes; positions arrive through nodeUpdates."""
+    ok = graphene.Boolean()
+
+    def mutate(self, info):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        layout.schedule(user.pk)
+        return LayoutMap(ok=True)
+
+
+class MapImportType(graphene.ObjectType):
+    nodes         = graphene.Int()
+    edges         = graphene.Int()
+    files         = graphene.Int()
+    skipped_files = graphene.Int(description="File links left out because you cannot read the file")
+
+
+class ImportMap(graphene.Mutation):
+    """
+    Add the nodes, edges and file links of an uploaded document to your map.
+
+    The document streams in like any upload, so it has to fit in what is
+    left of your storage quota while the request runs; it is removed again
+    afterwards. Larger maps can be loaded with ``manage.py graph_import``.
+    """
+    result = graphene.Field(MapImportType)
+
+    class Arguments:
+        upload = Upload(required=True)
+        format = graphene.String(description="jsonl or graphml; guessed from the file name by default")
+
+    def mutate(self, info, upload, format=None):
+        user = info.context.user
+        try:
+            if user.is_anonymous:
+                raise GraphQLError("Authentication required.")
+            counts = transfer.import_graph(user, transfer.read(upload, format or transfer.format_for(upload.name)))
+        except transfer.GraphImportError as exc:
+            raise GraphQLError(str(exc))
+        finally:
+            # only read, never kept
+            upload.close()
+            discard_uploads([upload])
+        return ImportMap(result=MapImportType(**counts))
+
+
 class DeleteNode(graphene.Mutation):
     ok = graphene.Boolean()
 
@@ -196,7 +607,8 @@ class DeleteNode(graphene.Mutation):
         node = Node.objects.filter(pk=node_id, owner=user).first()
         if not node:
             raise GraphQLError("Only owner can delete node.")
-        node.delete()
+        trash_nodes([node.pk])
+        analytics.note_changes(user.pk, 1)
         return DeleteNode(ok=True)
 
 
@@ -213,14 +625,64 @@ class AddFileToNode(graphene.Mutation):
         node = Node.objects.filter(pk=node_id, owner=user).first()
         if not node:
             raise GraphQLError("Permission denied.")
-        nf, _ = NodeFile.objects.update_or_create(
-            node=node,
-            file_id=file_id,
-            defaults={"note": note},
-        )
+        with transaction.atomic():
+            nf, created = NodeFile.objects.update_or_create(
+                node=node,
+                file_id=file_id,
+                defaults={"note": note},
+            )
+            if created:
+                usage.files_linked(node.pk, [nf.file_id])
         return AddFileToNode(node_file=nf)
 
 
+class AddFilesToNodes(graphene.Mutation):
+    """
+    Put many files you can read into your nodes in one transaction; a result
+    per input, in order. A file already in the node gets the new note.
+    """
+    results = graphene.List(FileLinkResultType)
+
+    class Arguments:
+        links = graphene.List(graphene.NonNull(FileLinkInput), required=True)
+
+    def mutate(self, info, links):
+        from files.schema import readable_files
+
+        user = info.context.user
+        _check_batch(user, links)
+        keys = [(_id(item.node_id), _id(item.file_id)) for item in links]
+        owned = _owned(user, [node_id for node_id, _ in keys])
+        readable = set(
+            readable_files(user).filter(pk__in={f for _, f in keys if f is not None}).values_list("pk", flat=True)
+        )
+        with transaction.atomic():
+            existing = {
+                (nf.node_id, nf.file_id): nf
+                for nf in NodeFile.objects.filter(
+                    node_id__in=owned, file_id__in=readable
+                ).select_related("file")
+            }
+            results, new, changed = [], {}, {}
+            for item, (node_id, file_id) in zip(links, keys):
+                if node_id not in owned or file_id not in readable:
+                    results.append(FileLinkResultType(error="Permission denied."))
+                    continue
+                nf = existing.get((node_id, file_id)) or new.get((node_id, file_id))
+                if nf is None:
+                    nf = new[node_id, file_id] = NodeFile(node_id=node_id, file_id=file_id, note=item.note or "")
+                elif item.note is not None:
+                    nf.note = item.note
+                    if nf.pk:
+                        changed[nf.pk] = nf
+                results.append(FileLinkResultType(node_file=nf))
+            bulk.link_files(list(new.values()))
+            NodeFile.objects.bulk_update(list(changed.values()), ["note"], batch_size=500)
+            touched = {node_id for node_id, _ in new} | {nf.node_id for nf in changed.values()}
+            transaction.on_commit(lambda: NodeUpdates.notify_many(touched))
+        return AddFilesToNodes(results=results)
+
+
 class RemoveFileFromNode(graphene.Mutation):
     ok = graphene.Boolean()
 
@@ -235,7 +697,9 @@ class RemoveFileFromNode(graphene.Mutation):
         ).first()
         if not nf:
             raise GraphQLError("Permission denied or not found.")
-        nf.delete()
+        with transaction.atomic():
+            usage.files_unlinked(nf.node_id, [nf.file_id])
+            nf.delete()
         return RemoveFileFromNode(ok=True)
 
 
@@ -254,11 +718,64 @@ class MoveFileBetweenNodes(graphene.Mutation):
         ).first()
         if not rf:
             raise GraphQLError("Permission denied on source.")
-        rf.node_id = to_node
-        rf.save()
+        with transaction.atomic():
+            usage.files_unlinked(rf.node_id, [rf.file_id])
+            rf.node_id = to_node
+            rf.save()
+            usage.files_linked(rf.node_id, [rf.file_id])
         return MoveFileBetweenNodes(ok=True)
 
 
+class MoveFiles(graphene.Mutation):
+    """
+    Move many files between your nodes in one transaction; a result per
+    input, in order. A file its target already holds is only taken out of
+    the source. Each link may take part in one move per call.
+    """
+    results = graphene.List(FileMoveResultType)
+
+    class Arguments:
+        moves = graphene.List(graphene.NonNull(FileMoveInput), required=True)
+
+    def mutate(self, info, moves):
+        user = info.context.user
+        _check_batch(user, moves)
+        keys = [(_id(item.from_node), _id(item.to_node), _id(item.file_id)) for item in moves]
+        owned = _owned(user, [pk for source, target, _ in keys for pk in (source, target)])
+        file_ids = {file_id for _, _, file_id in keys if file_id is not None}
+        with transaction.atomic():
+            links = {
+                (nf.node_id, nf.file_id): nf
+                for nf in NodeFile.objects.filter(node_id__in=owned, file_id__in=file_ids).select_for_update()
+            }
+            results, moved, merged, involved = [], [], [], set()
+            for source, target, file_id in keys:
+                if source not in owned or target not in owned:
+                    results.append(FileMoveResultType(ok=False, error="Permission denied."))
+                    continue
+                nf = links.get((source, file_id))
+                if nf is None:
+                    results.append(FileMoveResultType(ok=False, error="File not found in the source node."))
+                    continue
+                if {(source, file_id), (target, file_id)} & involved:
+                    results.append(FileMoveResultType(ok=False, error="File already moved in this batch."))
+                    continue
+                if source != target:
+                    involved.update({(source, file_id), (target, file_id)})
+                    (merged if (target, file_id) in links else moved).append((nf, target))
+                results.append(FileMoveResultType(ok=True))
+
+            touched = {pk for nf, target in moved + merged for pk in (nf.node_id, target)}
+            bulk.unlink_files([nf for nf, _ in merged])
+            bulk.uncount_links([nf for nf, _ in moved])
+            for nf, target in moved:
+                nf.node_id = target
+            NodeFile.objects.bulk_update([nf for nf, _ in moved], ["node"], batch_size=500)
+            bulk.count_links([nf for nf, _ in moved])
+            transaction.on_commit(lambda: NodeUpdates.notify_many(touched))
+        return MoveFiles(results=results)
+
+
 class CreateEdge(graphene.Mutation):
     edge = graphene.Field(EdgeType)
 
@@ -269,17 +786,73 @@ class CreateEdge(graphene.Mutation):
 
     def mutate(self, info, node_a_id, node_b_id, label=""):
         user = info.context.user
+        try:
+            # as numbers: "10" sorts before "9"
+            node_a_id, node_b_id = sorted((int(node_a_id), int(node_b_id)))
+        except (TypeError, ValueError):
+            raise GraphQLError("Permission denied.")
         nodes = Node.objects.filter(pk__in=[node_a_id, node_b_id], owner=user)
         if nodes.count() != 2:
             raise GraphQLError("Permission denied.")
-        edge, _ = Edge.objects.get_or_create(
-            node_a_id=min(node_a_id, node_b_id),
-            node_b_id=max(node_a_id, node_b_id),
-            defaults={"label": label},
-        )
+        with transaction.atomic():
+            # older edges may be stored either way round
+            link = NodeNeighbor.objects.filter(node_id=node_a_id, neighbor_id=node_b_id).select_related("edge").first()
+            if link is not None:
+                return CreateEdge(edge=link.edge)
+            edge, created = Edge.objects.get_or_create(
+                node_a_id=node_a_id, node_b_id=node_b_id, defaults={"label": label}
+            )
+            if created:
+                layout.schedule(user.pk, [node_a_id, node_b_id])
         return CreateEdge(edge=edge)
 
 
+class CreateEdges(graphene.Mutation):
+    """
+    Link many pairs of your nodes in one transaction; a result per input, in
+    order. A pair that is already linked gives back its existing edge.
+    """
+    results = graphene.List(EdgeResultType)
+
+    class Arguments:
+        edges = graphene.List(graphene.NonNull(EdgeInput), required=True)
+
+    def mutate(self, info, edges):
+        user = info.context.user
+        _check_batch(user, edges)
+        pairs = [(_id(item.node_a_id), _id(item.node_b_id)) for item in edges]
+        owned = _owned(user, [pk for pair in pairs for pk in pair])
+        wanted = {tuple(sorted(pair)) for pair in pairs if pair[0] in owned and pair[1] in owned}
+        with transaction.atomic():
+            existing = {
+                (link.node_id, link.neighbor_id): link.edge
+                for link in NodeNeighbor.objects.filter(
+                    node_id__in={a for a, _ in wanted}, neighbor_id__in={b for _, b in wanted}
+                ).select_related("edge")
+            }
+            results, new = [], {}
+            for item, (a, b) in zip(edges, pairs):
+                if a not in owned or b not in owned:
+                    results.append(EdgeResultType(error="Permission denied."))
+                    continue
+                if a == b:
+                    results.append(EdgeResultType(error="An edge needs two different nodes."))
+                    continue
+                a, b = sorted((a, b))
+                edge = existing.get((a, b))
+                if edge is None:
+                    edge = new.get((a, b))
+                if edge is None:
+                    edge = new[a, b] = Edge(node_a_id=a, node_b_id=b, label=item.label or "")
+                results.append(EdgeResultType(edge=edge))
+            bulk.insert_edges(list(new.values()))
+            if new:
+                touched = {pk for pair in new for pk in pair}
+                layout.schedule(user.pk, sorted(touched))
+                transaction.on_commit(lambda: NodeUpdates.notify_many(touched))
+        return CreateEdges(results=results)
+
+
 class DeleteEdge(graphene.Mutation):
     ok = graphene.Boolean()
 
@@ -291,7 +864,10 @@ class DeleteEdge(graphene.Mutation):
         edge = Edge.objects.filter(pk=edge_id).first()
         if not edge or edge.node_a.owner_id != user.id or edge.node_b.owner_id != user.id:
             raise GraphQLError("Permission denied.")
-        edge.delete()
+        with transaction.atomic():
+            edge.delete()
+            # may split a cluster
+            layout.schedule(user.pk, [edge.node_a_id, edge.node_b_id])
         return DeleteEdge(ok=True)
 
 
@@ -402,11 +978,18 @@ class RevokeNodeShare(graphene.Mutation):
 class GraphMutation(graphene.ObjectType):
     createNode          = CreateNode.Field()
     renameNode          = RenameNode.Field()
+    moveNodes           = MoveNodes.Field()
+    createNodes         = CreateNodes.Field()
+    layoutMap           = LayoutMap.Field()
+    importMap           = ImportMap.Field()
     deleteNode          = DeleteNode.Field()
     addFileToNode       = AddFileToNode.Field()
     removeFileFromNode  = RemoveFileFromNode.Field()
     moveFileBetweenNodes= MoveFileBetweenNodes.Field()
+    addFilesToNodes     = AddFilesToNodes.Field()
+    moveFiles           = MoveFiles.Field()
     createEdge          = CreateEdge.Field()
+    createEdges         = CreateEdges.Field()
     deleteEdge          = DeleteEdge.Field()
     shareNodeWithUser   = ShareNodeWithUser.Field()
     shareNodeWithGroup  = ShareNodeWithGroup.Field()
@@ -1,7 +1,9 @@
+from django.db import transaction
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
-from .models import Node, NodeFile, NodeShare, Edge
+from . import adjacency
+from .models import Node, NodeFile, NodeNeighbor, NodeShare, Edge
 from vault.subscriptions import NodeUpdates
 
 
@@ -32,3 +34,31 @@ def broadcast_edge_update(sender, instance, **kwargs):
     """Notify subscribers when edges are created or removed."""
     NodeUpdates.notify(instance.node_a_id)
     NodeUpdates.notify(instance.node_b_id)
+
+
+@receiver(post_save, sender=Edge)
+def index_edge_ends(sender, instance, created, **kwargs):
+    """Write both directions of a new edge to the neighbor table."""
+    if created:
+        NodeNeighbor.objects.bulk_create(NodeNeighbor.for_edges([instance]))
+
+
+@receiver(post_save, sender=Edge)
+def add_edge_to_adjacency(sender, instance, created, **kwargs):
+    """Keep the traversal cache in step with new edges."""
+    if created:
+        edge = (
+            instance.pk, instance.node_a_id, instance.node_b_id,
+            instance.node_a.owner_id, instance.node_b.owner_id,
+        )
+        transaction.on_commit(lambda: adjacency.edge_added(*edge))
+
+
+@receiver(post_delete, sender=Edge)
+def remove_edge_from_adjacency(sender, instance, **kwargs):
+    """Keep the traversal cache in step with deleted edges."""
+    edge_id = instance.pk
+    owner_ids = list(
+        Node.all_objects.filter(pk__in=(instance.node_a_id, instance.node_b_id)).values_list("owner_id", flat=True)
+    )
+    transaction.on_commit(lambda: adjacency.edge_removed(edge_id, owner_ids))
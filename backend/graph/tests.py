@@ -3,7 +3,7 @@ from types import SimpleNamespace
 from django.contrib.auth import get_user_model
 
 from accounts.models import Group, GroupMember
-from .models import Node, NodeShare
+from .models import Node, NodeNeighbor, NodeShare
 from .schema import NodeType
 
 
@@ -36,3 +36,880 @@ class NodeShareResolverTests(TestCase):
 
         shares = NodeType.resolve_shares(self.node, self._info_for(viewer))
         self.assertEqual(set(shares), {s1, s2})
+
+
+class DeleteNodeTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.node = Node.objects.create(owner=self.owner, name="n")
+        self.neighbour = Node.objects.create(owner=self.owner, name="m")
+
+    def test_delete_removes_dependents_and_notifies_once_per_node(self):
+        from unittest import mock
+
+        from chat.models import Channel, ChannelMembership, Message
+        from vault.deletion import delete_nodes
+        from .models import Edge
+
+        Edge.objects.create(node_a=self.node, node_b=self.neighbour)
+        channel = Channel.objects.create(channel_type=Channel.NODE, node=self.node)
+        ChannelMembership.objects.create(channel=channel, user=self.owner)
+        Message.objects.create(channel=channel, sender=self.owner, text="hi")
+        NodeShare.objects.create(node=self.node, is_public=True, permission=NodeShare.READ)
+
+        with mock.patch("vault.deletion.NodeUpdates.notify") as per_row, \
+                mock.patch("vault.deletion.NodeUpdates.notify_many") as notify_many, \
+                mock.patch("vault.deletion.MessageUpdates.notify") as notify_channel, \
+                self.captureOnCommitCallbacks(execute=True):
+            delete_nodes([self.node.pk])
+
+        self.assertFalse(Node.all_objects.filter(pk=self.node.pk).exists())
+        self.assertFalse(Edge.all_objects.exists())
+        self.assertFalse(NodeNeighbor.objects.exists())
+        self.assertFalse(Channel.objects.filter(pk=channel.pk).exists())
+        self.assertFalse(Message.objects.exists())
+        self.assertFalse(NodeShare.objects.exists())
+        self.assertTrue(Node.objects.filter(pk=self.neighbour.pk).exists())
+        per_row.assert_not_called()
+        notify_many.assert_called_once_with({self.node.pk, self.neighbour.pk})
+        notify_channel.assert_called_once_with(channel.pk)
+
+    def test_delete_mutation_trashes_and_hides_edges(self):
+        from .models import Edge
+        from .schema import DeleteNode
+
+        Edge.objects.create(node_a=self.node, node_b=self.neighbour)
+        info = SimpleNamespace(context=SimpleNamespace(user=self.owner))
+        DeleteNode().mutate(info, node_id=self.node.id)
+
+        self.assertFalse(Node.objects.filter(pk=self.node.pk).exists())
+        self.assertIsNotNone(Node.all_objects.get(pk=self.node.pk).deleted_at)
+        self.assertFalse(Edge.objects.exists())
+        self.assertEqual(Edge.all_objects.count(), 1)
+
+
+class NodeExportTests(TestCase):
+    def test_export_skips_unreadable_files_and_dedupes_names(self):
+        import io
+        import shutil
+        import tempfile
+        import zipfile
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+
+        from files.schema import AddFileVersion, UploadFile
+        from .models import NodeFile
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        User = get_user_model()
+        owner = User.objects.create_user(username="owner", password="pw")
+        other = User.objects.create_user(username="other", password="pw")
+        node = Node.objects.create(owner=owner, name="Trip")
+
+        def upload(user, content):
+            info = SimpleNamespace(context=SimpleNamespace(user=user))
+            return UploadFile().mutate(info, name="a.txt", upload=SimpleUploadedFile("a.txt", content)).file
+
+        with override_settings(MEDIA_ROOT=media_root):
+            for f in (upload(owner, b"first"), upload(owner, b"second"), upload(other, b"private")):
+                NodeFile.objects.create(node=node, file=f)
+            first = NodeFile.objects.filter(node=node).order_by("pk").first().file
+            AddFileVersion().mutate(
+                SimpleNamespace(context=SimpleNamespace(user=owner)),
+                file_id=first.pk, upload=SimpleUploadedFile("a.txt", b"first, edited"),
+            )
+
+            self.client.force_login(owner)
+            response = self.client.get(f"/nodes/{node.id}/export.zip")
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('filename="Trip.zip"', response["Content-Disposition"])
+            archive = zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content)))
+
+        self.assertEqual(archive.namelist(), ["a.txt", "a (2).txt"])
+        self.assertEqual(archive.read("a.txt"), b"first, edited")
+        self.assertEqual(archive.read("a (2).txt"), b"second")
+
+
+class NodePositionTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.other = User.objects.create_user(username="other", password="pw")
+        self.info = SimpleNamespace(context=SimpleNamespace(user=self.owner))
+
+    def _bbox(self, min_x, min_y, max_x, max_y):
+        return SimpleNamespace(min_x=min_x, min_y=min_y, max_x=max_x, max_y=max_y)
+
+    def test_viewport_returns_readable_nodes_in_the_box(self):
+        from .schema import GraphQuery
+
+        inside = Node.objects.create(owner=self.owner, name="in", x=100, y=100)
+        on_top = Node.objects.create(owner=self.owner, name="top", x=150, y=120, layer=2)
+        near = Node.objects.create(owner=self.owner, name="near", x=-150, y=100)
+        Node.objects.create(owner=self.owner, name="far", x=5000, y=100)
+        Node.objects.create(owner=self.other, name="private", x=100, y=100)
+
+        found = GraphQuery.resolve_nodes_in_viewport(None, self.info, self._bbox(0, 0, 400, 300), zoom=1.0)
+        # the margin is 200 screen pixels: 200 map units at zoom 1, 100 at zoom 2
+        self.assertEqual(list(found), [on_top, inside, near])
+        found = GraphQuery.resolve_nodes_in_viewport(None, self.info, self._bbox(0, 0, 400, 300), zoom=2.0)
+        self.assertEqual(list(found), [on_top, inside])
+        found = GraphQuery.resolve_nodes_in_viewport(
+            None, self.info, self._bbox(0, 0, 400, 300), zoom=1.0, limit=1
+        )
+        self.assertEqual(list(found), [on_top])
+
+    def test_viewport_merges_own_and_shared_nodes(self):
+        from django.contrib.auth.models import AnonymousUser
+
+        from .schema import GraphQuery
+
+        mine = Node.objects.create(owner=self.owner, name="mine", x=10, y=10)
+        shared = Node.objects.create(owner=self.other, name="shared", x=20, y=20, layer=1)
+        public = Node.objects.create(owner=self.owner, name="public", x=30, y=30)
+        Node.objects.create(owner=self.other, name="outside", x=5000, y=5000, layer=3)
+        NodeShare.objects.create(node=shared, shared_with_user=self.owner, permission=NodeShare.READ)
+        NodeShare.objects.create(node=public, is_public=True, permission=NodeShare.READ)
+
+        with self.assertNumQueries(2):
+            found = GraphQuery.resolve_nodes_in_viewport(None, self.info, self._bbox(0, 0, 100, 100), zoom=1.0)
+            # owners come with the nodes
+            self.assertEqual([(node, node.owner) for node in found], [
+                (shared, self.other), (mine, self.owner), (public, self.owner),
+            ])
+        anonymous = SimpleNamespace(context=SimpleNamespace(user=AnonymousUser()))
+        found = GraphQuery.resolve_nodes_in_viewport(None, anonymous, self._bbox(0, 0, 100, 100), zoom=1.0)
+        self.assertEqual(found, [public])
+
+    def test_move_nodes_is_all_or_nothing(self):
+        from unittest import mock
+
+        from graphql import GraphQLError
+
+        from .schema import MoveNodes
+
+        a = Node.objects.create(owner=self.owner, name="a")
+        b = Node.objects.create(owner=self.owner, name="b")
+        theirs = Node.objects.create(owner=self.other, name="c")
+        move = lambda node, x, y, layer=None: SimpleNamespace(node_id=str(node.pk), x=x, y=y, layer=layer)
+
+        with self.assertRaises(GraphQLError):
+            MoveNodes().mutate(self.info, moves=[move(a, 1, 1), move(theirs, 2, 2)])
+        self.assertEqual(Node.objects.get(pk=a.pk).x, 0)
+
+        with mock.patch("graph.schema.NodeUpdates.notify_many") as notify_many, \
+                self.captureOnCommitCallbacks(execute=True):
+            MoveNodes().mutate(self.info, moves=[move(a, 10, 20), move(b, -5, 7.5, layer=3)])
+        notify_many.assert_called_once_with({a.pk, b.pk})
+        self.assertEqual(
+            list(Node.objects.order_by("pk").filter(owner=self.owner).values_list("x", "y", "layer")),
+            [(10, 20, 0), (-5, 7.5, 3)],
+        )
+
+
+class LayoutTests(TestCase):
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username="owner", password="pw")
+        self.info = SimpleNamespace(context=SimpleNamespace(user=self.owner))
+
+    def test_grid_repulsion_approximates_exact_forces(self):
+        import numpy as np
+
+        from .layout import IDEAL_EDGE, _repulsion
+
+        pos = np.random.default_rng(1).uniform(0, 5000, size=(600, 2))
+        d = pos[:, None, :] - pos[None, :, :]
+        dist2 = np.maximum((d ** 2).sum(axis=2), 1.0)
+        np.fill_diagonal(dist2, np.inf)
+        exact = (d * (IDEAL_EDGE ** 2 / dist2)[:, :, None]).sum(axis=1)
+
+        approx = _repulsion(pos, np.arange(len(pos)), IDEAL_EDGE)
+        error = np.linalg.norm(approx - exact, axis=1) / np.linalg.norm(exact, axis=1)
+        self.assertLess(np.median(error), 0.05)
+
+    def test_layout_untangles_a_pile(self):
+        import numpy as np
+
+        from .layout import IDEAL_EDGE, force_layout
+
+        # two rings of 20, all starting on one spot
+        edges = [(i, (i + 1) % 20) for i in range(20)] + [(20 + i, 20 + (i + 1) % 20) for i in range(20)]
+        pos = force_layout(np.zeros((40, 2)), edges, gravity=1.0)
+
+        gaps = np.sqrt(((pos[:, None, :] - pos[None, :, :]) ** 2).sum(axis=2))
+        np.fill_diagonal(gaps, np.inf)
+        self.assertGreater(gaps.min(), IDEAL_EDGE / 5)
+        linked = np.mean([gaps[a, b] for a, b in edges])
+        self.assertLess(linked, np.median(gaps[np.isfinite(gaps)]))
+
+    def test_incremental_layout_only_moves_the_neighbourhood(self):
+        from .layout import relayout
+        from .models import Edge
+
+        chain = [Node.objects.create(owner=self.owner, name=f"c{i}", x=i * 200.0, y=0) for i in range(5)]
+        for a, b in zip(chain, chain[1:]):
+            Edge.objects.create(node_a=a, node_b=b)
+        apart = Node.objects.create(owner=self.owner, name="apart", x=0, y=3000)
+        new = Node.objects.create(owner=self.owner, name="new", x=0, y=0)
+        Edge.objects.create(node_a=chain[0], node_b=new)
+        before = dict(Node.objects.values_list("pk", "x"))
+
+        moved = set(relayout(self.owner.pk, [new.pk]))
+
+        self.assertIn(new.pk, moved)
+        # two hops from the new node: itself, c0 and c1
+        self.assertLessEqual(moved, {new.pk, chain[0].pk, chain[1].pk})
+        after = dict(Node.objects.values_list("pk", "x"))
+        for node in chain[2:] + [apart]:
+            self.assertEqual(after[node.pk], before[node.pk])
+
+    def test_layout_keeps_a_drag_made_while_it_ran(self):
+        from unittest import mock
+
+        from . import layout
+
+        pile = [Node.objects.create(owner=self.owner, name=f"p{i}", x=0, y=0) for i in range(4)]
+        real = layout.force_layout
+
+        def dragged_meanwhile(*args, **kwargs):
+            Node.objects.filter(pk=pile[0].pk).update(x=5000.0, y=5000.0)
+            return real(*args, **kwargs)
+
+        with mock.patch.object(layout, "force_layout", side_effect=dragged_meanwhile):
+            moved = layout.relayout(self.owner.pk)
+
+        self.assertNotIn(pile[0].pk, moved)
+        self.assertEqual(set(moved), {node.pk for node in pile[1:]})
+        pile[0].refresh_from_db()
+        self.assertEqual((pile[0].x, pile[0].y), (5000.0, 5000.0))
+
+    def test_layout_superseded_while_it_ran_is_queued_again(self):
+        from unittest import mock
+
+        from jobs.models import Job
+        from . import layout
+        from .models import MapStats
+
+        pile = [Node.objects.create(owner=self.owner, name=f"p{i}", x=0, y=0) for i in range(4)]
+        real = layout.force_layout
+
+        def other_layout_meanwhile(*args, **kwargs):
+            MapStats.objects.filter(owner=self.owner).update(layout_generation=5)
+            return real(*args, **kwargs)
+
+        with mock.patch.object(layout, "force_layout", side_effect=other_layout_meanwhile):
+            self.assertEqual(layout.relayout(self.owner.pk, [pile[0].pk]), [])
+
+        self.assertEqual(set(Node.objects.values_list("x", "y")), {(0, 0)})
+        job = Job.objects.get(task="graph.layout.layout_map")
+        self.assertEqual(job.args, [self.owner.pk, [pile[0].pk]])
+
+    def test_large_changes_get_a_full_layout(self):
+        from unittest import mock
+
+        from . import layout
+
+        pile = [Node.objects.create(owner=self.owner, name=f"p{i}", x=0, y=0) for i in range(4)]
+        with mock.patch.object(layout, "INCREMENTAL_MAX_SEEDS", 2), \
+                mock.patch.object(layout, "neighbourhood") as neighbourhood:
+            moved = layout.relayout(self.owner.pk, [node.pk for node in pile[:3]])
+        neighbourhood.assert_not_called()
+        self.assertTrue(moved)
+
+    def test_edits_queue_one_layout_per_map(self):
+        from django.test import override_settings
+
+        from jobs.models import Job
+        from jobs.queue import run_pending
+        from .schema import CreateEdge, CreateNode
+
+        with override_settings(LAYOUT_DEBOUNCE_SECONDS=0):
+            a = CreateNode().mutate(self.info, name="a").node
+            b = CreateNode().mutate(self.info, name="b").node
+            CreateEdge().mutate(self.info, node_a_id=str(a.pk), node_b_id=str(b.pk))
+
+        job = Job.objects.get(task="graph.layout.layout_map")
+        self.assertEqual(job.args, [self.owner.pk, sorted([a.pk, b.pk])])
+        self.assertEqual(run_pending(["layout"]), 1)
+        a.refresh_from_db()
+        b.refresh_from_db()
+        self.assertNotEqual((a.x, a.y), (b.x, b.y))
+
+
+class ClusterTests(TestCase):
+    def setUp(self):
+        from .models import Edge
+
+        User = get_user_model()
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.viewer = User.objects.create_user(username="viewer", password="pw")
+        # two tightly knit groups of four joined by one edge, and a loner far away
+        self.groups = [
+            [Node.objects.create(owner=self.owner, name=f"{g}{i}", x=g * 1000 + i * 100, y=0) for i in range(4)]
+            for g in range(2)
+        ]
+        for group in self.groups:
+            for i, a in enumerate(group):
+                for b in group[i + 1:]:
+                    Edge.objects.create(node_a=a, node_b=b)
+        Edge.objects.create(node_a=self.groups[0][0], node_b=self.groups[1][0])
+        self.loner = Node.objects.create(owner=self.owner, name="loner", x=100000, y=100000)
+
+    def _view(self, user, level):
+        from .schema import GraphQuery
+
+        bbox = SimpleNamespace(min_x=-1e6, min_y=-1e6, max_x=1e6, max_y=1e6)
+        return GraphQuery.resolve_map_at_zoom(None, SimpleNamespace(context=SimpleNamespace(user=user)), level, bbox)
+
+    def test_levels_group_communities_then_their_links(self):
+        import numpy as np
+
+        from .clusters import hierarchy
+
+        edges = [(i, j) for i in range(4) for j in range(i + 1, 4)]
+        edges += [(4 + i, 4 + j) for i, j in edges] + [(0, 4)]
+        pos = np.array([(i * 100, 0) for i in range(8)] + [(0, 50), (50, 50), (90000, 0)], dtype=float)
+
+        fine, middle, coarse = hierarchy(pos, np.array(edges))
+        self.assertEqual(list(fine), [0] * 4 + [4] * 4 + [8, 8, 10])
+        self.assertEqual(list(middle), [0] * 8 + [8, 8, 10])
+
+    def test_map_at_zoom_aggregates_what_the_viewer_can_read(self):
+        from .clusters import recluster
+
+        recluster(self.owner.pk)
+        first, second = (group[0].pk for group in self.groups)
+
+        view = self._view(self.owner, 2)
+        self.assertEqual(
+            sorted((int(c.id), c.size) for c in view.clusters), [(first, 4), (second, 4), (self.loner.pk, 1)]
+        )
+        self.assertEqual([(int(l.source), int(l.target), l.edges) for l in view.links], [(first, second, 1)])
+        self.assertEqual(view.nodes, [])
+
+        # a viewer with access to half of one group sees only that half
+        for node in self.groups[0][:2]:
+            NodeShare.objects.create(node=node, shared_with_user=self.viewer, permission=NodeShare.READ)
+        view = self._view(self.viewer, 2)
+        self.assertEqual([(int(c.id), c.size) for c in view.clusters], [(first, 2)])
+        self.assertEqual(view.links, [])
+
+        self.assertEqual(len(self._view(self.owner, 3).nodes), 9)
+
+    def test_edits_recluster_only_around_the_change(self):
+        from .clusters import recluster
+        from .models import Edge, NodeCluster
+
+        recluster(self.owner.pk)
+        newcomer = Node.objects.create(owner=self.owner, name="new", x=1200, y=0)
+        for node in self.groups[1]:
+            Edge.objects.create(node_a=node, node_b=newcomer)
+
+        recluster(self.owner.pk, [newcomer.pk])
+        fine = dict(NodeCluster.objects.filter(level=1).values_list("node_id", "cluster"))
+        self.assertEqual(fine[newcomer.pk], self.groups[1][0].pk)
+        self.assertEqual(fine[self.groups[0][1].pk], self.groups[0][0].pk)
+
+    def test_trashing_a_cluster_namesake_renames_it_and_purging_removes_its_rows(self):
+        from jobs.queue import run_pending
+        from vault.deletion import delete_nodes, trash_nodes
+
+        from .clusters import recluster
+        from .models import NodeCluster
+
+        recluster(self.owner.pk)
+        namesake = self.groups[0][0]
+        trash_nodes([namesake.pk])
+        run_pending()
+        fine = dict(NodeCluster.objects.filter(level=1).values_list("node_id", "cluster"))
+        self.assertEqual({fine[node.pk] for node in self.groups[0][1:]}, {self.groups[0][1].pk})
+
+        delete_nodes([namesake.pk])
+        self.assertFalse(Node.all_objects.filter(pk=namesake.pk).exists())
+        self.assertFalse(NodeCluster.objects.filter(node_id=namesake.pk).exists())
+
+
+class AdjacencyTests(TestCase):
+    def setUp(self):
+        from . import adjacency
+        from .models import Edge
+
+        User = get_user_model()
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.viewer = User.objects.create_user(username="viewer", password="pw")
+        # a - b - c - d, with a shortcut a - e - d through a node the viewer cannot read
+        self.a, self.b, self.c, self.d, self.e = (
+            Node.objects.create(owner=self.owner, name=name) for name in "abcde"
+        )
+        for x, y in ((self.a, self.b), (self.b, self.c), (self.c, self.d), (self.a, self.e), (self.e, self.d)):
+            Edge.objects.create(node_a=x, node_b=y)
+        for node in (self.a, self.b, self.c, self.d):
+            NodeShare.objects.create(node=node, shared_with_user=self.viewer, permission=NodeShare.READ)
+        self.loner = Node.objects.create(owner=self.owner, name="loner")
+        adjacency.invalidate()
+
+    def _info(self, user):
+        return SimpleNamespace(context=SimpleNamespace(user=user))
+
+    def test_owner_traverses_the_whole_map(self):
+        from . import adjacency
+        from .schema import GraphQuery
+
+        adjacency.shard(self.owner.pk)
+        info = self._info(self.owner)
+        # only the returned nodes are fetched
+        with self.assertNumQueries(1):
+            near = GraphQuery.resolve_neighbors(None, info, str(self.a.pk), depth=1)
+        self.assertEqual(near, [self.b, self.e])
+        self.assertEqual(
+            GraphQuery.resolve_neighbors(None, info, str(self.a.pk), depth=2), [self.b, self.e, self.c, self.d]
+        )
+        self.assertEqual(
+            GraphQuery.resolve_shortest_path(None, info, str(self.a.pk), str(self.d.pk)), [self.a, self.e, self.d]
+        )
+        self.assertIsNone(GraphQuery.resolve_shortest_path(None, info, str(self.a.pk), str(self.loner.pk)))
+        self.assertEqual(
+            GraphQuery.resolve_connected_component(None, info, str(self.c.pk)),
+            [self.c, self.b, self.d, self.a, self.e],
+        )
+        self.assertEqual(GraphQuery.resolve_connected_component(None, info, str(self.loner.pk)), [self.loner])
+
+    def test_traversals_only_pass_through_readable_nodes(self):
+        from graphql import GraphQLError
+
+        from .schema import GraphQuery
+
+        info = self._info(self.viewer)
+        self.assertEqual(
+            GraphQuery.resolve_shortest_path(None, info, str(self.a.pk), str(self.d.pk)),
+            [self.a, self.b, self.c, self.d],
+        )
+        self.assertEqual(
+            GraphQuery.resolve_connected_component(None, info, str(self.a.pk)), [self.a, self.b, self.c, self.d]
+        )
+        with self.assertRaises(GraphQLError):
+            GraphQuery.resolve_neighbors(None, info, str(self.e.pk), depth=1)
+
+    def test_traversals_work_before_the_first_edge(self):
+        from . import adjacency
+        from .models import Edge
+        from .schema import GraphQuery
+
+        Edge.all_objects.all().delete()
+        adjacency.invalidate()
+        info = self._info(self.owner)
+        self.assertEqual(GraphQuery.resolve_neighbors(None, info, str(self.a.pk), depth=1), [])
+        self.assertIsNone(GraphQuery.resolve_shortest_path(None, info, str(self.a.pk), str(self.b.pk)))
+        self.assertEqual(GraphQuery.resolve_connected_component(None, info, str(self.a.pk)), [self.a])
+
+        # the first edge only lives in the overlay
+        with self.captureOnCommitCallbacks(execute=True):
+            Edge.objects.create(node_a=self.a, node_b=self.b)
+        self.assertEqual(len(adjacency.shard(self.owner.pk).ids), 0)
+        self.assertEqual(GraphQuery.resolve_neighbors(None, info, str(self.a.pk), depth=1), [self.b])
+
+    def test_edits_reach_the_cache(self):
+        import numpy as np
+
+        from vault.deletion import trash_nodes
+
+        from . import adjacency
+        from .models import Edge
+
+        owner = self.owner.pk
+        graph = adjacency.shard(owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            edge = Edge.objects.create(node_a=self.c, node_b=self.loner)
+            Edge.objects.filter(node_a=self.a, node_b=self.e).get().delete()
+        # patched in place of a rebuild
+        with self.assertNumQueries(0):
+            patched = adjacency.shard(owner)
+        self.assertIs(patched.indices, graph.indices)
+        allow_all = lambda ids, owners: np.ones(len(ids), dtype=bool)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                adjacency.current().path(self.a.pk, owner, self.loner.pk, allow_all),
+                [self.a.pk, self.b.pk, self.c.pk, self.loner.pk],
+            )
+            self.assertEqual(adjacency.current().reach(self.a.pk, owner, allow_all, depth=1), [self.b.pk])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            trash_nodes([self.loner.pk])
+        rebuilt = adjacency.shard(owner)
+        self.assertIsNot(rebuilt, patched)
+        self.assertNotIn(self.loner.pk, adjacency.current().reach(self.c.pk, owner, allow_all))
+        self.assertTrue(Edge.all_objects.filter(pk=edge.pk).exists())
+
+    def test_shards_are_per_owner_and_joined_by_shared_edges(self):
+        from .models import Edge
+        from . import adjacency
+        from .schema import GraphQuery
+
+        other = get_user_model().objects.create_user(username="other", password="pw")
+        far = Node.objects.create(owner=other, name="far")
+        NodeShare.objects.create(node=far, shared_with_user=self.viewer, permission=NodeShare.READ)
+        theirs = adjacency.shard(other.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Edge.objects.create(node_a=self.d, node_b=far)
+        # both ends' shards learn of the edge without a rebuild
+        self.assertIs(adjacency.shard(other.pk).indices, theirs.indices)
+
+        mine = adjacency.shard(self.owner.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            Edge.objects.create(node_a=far, node_b=Node.objects.create(owner=other, name="near"))
+        # edits inside another map leave this one alone
+        self.assertIs(adjacency.shard(self.owner.pk), mine)
+
+        info = self._info(self.viewer)
+        self.assertEqual(
+            GraphQuery.resolve_shortest_path(None, info, str(self.a.pk), str(far.pk)),
+            [self.a, self.b, self.c, self.d, far],
+        )
+
+
+class EdgeIndexTests(TestCase):
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username="owner", password="pw")
+        self.info = SimpleNamespace(context=SimpleNamespace(user=self.owner))
+        self.nodes = {}
+        # ids 9 and 10 tell string ordering from numeric
+        for pk in range(1, 11):
+            self.nodes[pk] = Node.objects.create(pk=pk, owner=self.owner, name=str(pk))
+
+    def test_edges_are_indexed_both_ways(self):
+        from .models import Edge
+        from .schema import GraphQuery
+
+        edge = Edge.objects.create(node_a=self.nodes[1], node_b=self.nodes[2])
+        self.assertEqual(
+            set(NodeNeighbor.objects.values_list("node_id", "neighbor_id", "edge_id")),
+            {(1, 2, edge.pk), (2, 1, edge.pk)},
+        )
+        self.assertEqual(list(NodeType.resolve_edges(self.nodes[2], self.info)), [edge])
+        self.assertEqual(list(GraphQuery.resolve_node_edges(None, self.info, "1", limit=20, offset=0)), [edge])
+        edge.delete()
+        self.assertFalse(NodeNeighbor.objects.exists())
+
+    def test_create_edge_orders_ids_as_numbers_and_finds_either_orientation(self):
+        from .models import Edge
+        from .schema import CreateEdge
+
+        edge = CreateEdge().mutate(self.info, node_a_id="10", node_b_id="9").edge
+        self.assertEqual((edge.node_a_id, edge.node_b_id), (9, 10))
+        self.assertEqual(CreateEdge().mutate(self.info, node_a_id="9", node_b_id="10").edge, edge)
+
+        # stored the wrong way round by older code
+        legacy = Edge.objects.create(node_a=self.nodes[8], node_b=self.nodes[3])
+        self.assertEqual(CreateEdge().mutate(self.info, node_a_id="3", node_b_id="8").edge, legacy)
+        self.assertEqual(Edge.objects.count(), 2)
+
+
+class AnalyticsTests(TestCase):
+    def setUp(self):
+        self.owner = get_user_model().objects.create_user(username="owner", password="pw")
+        self.info = SimpleNamespace(context=SimpleNamespace(user=self.owner))
+
+    def test_scores_of_a_path(self):
+        import numpy as np
+
+        from .analytics import adjacency_matrix, pagerank, score
+
+        edges = np.array([(0, 1), (1, 2), (2, 3), (3, 4)])
+        rank, degree, between = score(5, edges)
+        self.assertAlmostEqual(rank.sum(), 1.0)
+        self.assertTrue(np.allclose(rank, rank[::-1]))
+        self.assertGreater(rank[1], rank[0])
+        self.assertEqual(list(degree), [1, 2, 2, 2, 1])
+        # the middle node is on 4 of the 6 paths between the others, its neighbours on 3
+        self.assertTrue(np.allclose(between, [0, 0.5, 4 / 6, 0.5, 0]))
+
+        cold, cold_iterations = pagerank(adjacency_matrix(5, edges))
+        _, warm_iterations = pagerank(adjacency_matrix(5, edges), start=cold)
+        self.assertLess(warm_iterations, cold_iterations)
+
+    def test_edits_queue_a_rescore_and_my_nodes_sorts_by_it(self):
+        from graphql import GraphQLError
+
+        from jobs.models import Job
+        from jobs.queue import run_pending
+
+        from .analytics import note_changes, score_map
+        from .models import Edge, MapStats
+        from .schema import GraphQuery
+
+        hub = Node.objects.create(owner=self.owner, name="hub")
+        spokes = [Node.objects.create(owner=self.owner, name=f"s{i}") for i in range(4)]
+        for spoke in spokes:
+            Edge.objects.create(node_a=hub, node_b=spoke)
+
+        with self.settings(GRAPH_SCORE_MIN_CHANGES=5):
+            note_changes(self.owner.pk, 4)
+            self.assertFalse(Job.objects.filter(task=score_map.task_name).exists())
+            note_changes(self.owner.pk, 2)
+            note_changes(self.owner.pk, 2)
+        self.assertEqual(Job.objects.filter(task=score_map.task_name).count(), 1)
+        self.assertEqual(run_pending(["layout"]), 1)
+
+        stats = MapStats.objects.get(owner=self.owner)
+        self.assertEqual((stats.changes, stats.nodes), (0, 5))
+        hub.refresh_from_db()
+        self.assertEqual(hub.degree, 4)
+        self.assertAlmostEqual(hub.betweenness, 1.0)
+
+        ranked = GraphQuery.resolve_my_nodes(None, self.info, limit=2, offset=0, order_by="pagerank")
+        self.assertEqual(list(ranked), [hub, spokes[0]])
+        with self.assertRaises(GraphQLError):
+            GraphQuery.resolve_my_nodes(None, self.info, limit=2, offset=0, order_by="name; drop")
+
+
+class TransferTests(TestCase):
+    def setUp(self):
+        from files.models import File
+
+        from .models import Edge, NodeFile
+
+        User = get_user_model()
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.other = User.objects.create_user(username="other", password="pw")
+        self.a = Node.objects.create(owner=self.owner, name="a & <b>", description="first", x=10, y=20, layer=1)
+        self.b = Node.objects.create(owner=self.owner, name="b", x=30, y=40)
+        self.c = Node.objects.create(owner=self.owner, name="c", x=50, y=60)
+        Edge.objects.create(node_a=self.a, node_b=self.b, label="ab")
+        Edge.objects.create(node_a=self.b, node_b=self.c)
+        self.file = File.objects.create(owner=self.owner, name="a.txt")
+        NodeFile.objects.create(node=self.a, file=self.file, note="see")
+
+    def _map(self, user):
+        from .models import Edge
+
+        nodes = {n.pk: n for n in Node.objects.filter(owner=user)}
+        edges = {
+            frozenset((nodes[a].name, nodes[b].name)): label
+            for a, b, label in Edge.objects.filter(node_a__owner=user).values_list("node_a_id", "node_b_id", "label")
+        }
+        return sorted((n.name, n.description, n.x, n.y, n.layer) for n in nodes.values()), edges
+
+    def _round_trip(self, fmt, user):
+        import io
+        from unittest import mock
+
+        from . import transfer
+
+        document = "".join(transfer.export(self.owner, fmt)).encode()
+        with mock.patch("graph.transfer.NodeUpdates.notify_created") as notify, \
+                self.captureOnCommitCallbacks(execute=True):
+            counts = transfer.import_graph(user, transfer.read(io.BytesIO(document), fmt))
+        notify.assert_called_once()
+        return counts
+
+    def test_jsonl_round_trip_copies_the_map(self):
+        from .models import NodeFile, NodeNeighbor
+
+        counts = self._round_trip("jsonl", self.owner)
+        self.assertEqual(counts, {"nodes": 3, "edges": 2, "files": 1, "skipped_files": 0})
+        nodes, edges = self._map(self.owner)
+        self.assertEqual(nodes, sorted(2 * [
+            ("a & <b>", "first", 10, 20, 1), ("b", "", 30, 40, 0), ("c", "", 50, 60, 0)
+        ]))
+        self.assertEqual(NodeNeighbor.objects.count(), 8)
+        copy = Node.objects.exclude(pk=self.a.pk).get(name="a & <b>")
+        self.assertEqual(
+            list(NodeFile.objects.filter(node=copy).values_list("file_id", "note")), [(self.file.pk, "see")]
+        )
+
+    def test_graphml_round_trip_without_returned_ids(self):
+        from unittest import mock
+
+        from django.db import connection
+
+        # as on MySQL
+        with mock.patch.dict(connection.features.__dict__, {"can_return_rows_from_bulk_insert": False}):
+            counts = self._round_trip("graphml", self.other)
+        # someone else's file is left out
+        self.assertEqual(counts, {"nodes": 3, "edges": 2, "files": 0, "skipped_files": 1})
+        nodes, edges = self._map(self.other)
+        self.assertEqual(nodes, [("a & <b>", "first", 10, 20, 1), ("b", "", 30, 40, 0), ("c", "", 50, 60, 0)])
+        self.assertEqual(edges, {frozenset(("a & <b>", "b")): "ab", frozenset(("b", "c")): ""})
+        self.assertFalse(Node.all_objects.filter(import_key__isnull=False).exists())
+
+    def test_bad_documents_import_nothing(self):
+        import io
+
+        from jobs.models import Job
+
+        from . import transfer
+
+        lines = [
+            '{"type": "node", "id": "x", "name": "x"}',
+            '{"type": "node", "id": "y", "name": "y"}',
+            '{"type": "edge", "source": "x", "target": "y"}',
+        ]
+        for bad in ('{"type": "edge", "source": "x", "target": "z"}', '{"type": "node", "id": "x", "name": "again"}'):
+            document = io.BytesIO("\n".join(lines + [bad]).encode())
+            with self.assertRaises(transfer.GraphImportError):
+                transfer.import_graph(self.other, transfer.read(document, "jsonl"))
+        self.assertFalse(Node.objects.filter(owner=self.other).exists())
+
+        # nodes without a position are laid out
+        counts = transfer.import_graph(self.other, transfer.read(io.BytesIO("\n".join(lines).encode()), "jsonl"))
+        self.assertEqual(counts["edges"], 1)
+        self.assertEqual(Job.objects.filter(status=Job.QUEUED, args__0=self.other.pk).count(), 1)
+
+    def test_import_mutation_leaves_nothing_in_storage(self):
+        import json
+        import os
+        import shutil
+        import tempfile
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import override_settings
+
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.client.force_login(self.other)
+        operations = {
+            "query": "mutation($upload: Upload!) { importMap(upload: $upload) { result { nodes } } }",
+            "variables": {"upload": None},
+        }
+        for document in (b'{"type": "node", "id": "x", "name": "x"}\n', b'{"type": "edge"}\n'):
+            with override_settings(MEDIA_ROOT=media_root):
+                response = self.client.post("/graphql/", data={
+                    "operations": json.dumps(operations),
+                    "map": json.dumps({"0": ["variables.upload"]}),
+                    "0": SimpleUploadedFile("map.jsonl", document),
+                })
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Node.objects.filter(owner=self.other).count(), 1)
+        self.assertEqual([name for _, _, names in os.walk(media_root) for name in names], [])
+
+    def test_export_view_streams_the_callers_map(self):
+        self.client.force_login(self.other)
+        Node.objects.create(owner=self.other, name="mine")
+        response = self.client.get("/nodes/export.jsonl")
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body.count("\n"), 1)
+        self.assertIn('"name": "mine"', body)
+        self.assertEqual(self.client.get("/nodes/export.csv").status_code, 404)
+
+
+def _node(name, x=None, y=None):
+    return SimpleNamespace(name=name, description=None, x=x, y=y, layer=None)
+
+
+def _edge(a, b, label=None):
+    return SimpleNamespace(node_a_id=str(a.pk), node_b_id=str(b.pk), label=label)
+
+
+def _link(node, file, note=None):
+    return SimpleNamespace(node_id=str(node.pk), file_id=str(file.pk), note=note)
+
+
+def _move(source, target, file):
+    return SimpleNamespace(from_node=str(source.pk), to_node=str(target.pk), file_id=str(file.pk))
+
+
+class BatchMutationTests(TestCase):
+    def setUp(self):
+        from files.models import File
+
+        User = get_user_model()
+        self.owner = User.objects.create_user(username="owner", password="pw")
+        self.other = User.objects.create_user(username="other", password="pw")
+        self.info = SimpleNamespace(context=SimpleNamespace(user=self.owner))
+        self.a = Node.objects.create(owner=self.owner, name="a")
+        self.b = Node.objects.create(owner=self.owner, name="b")
+        self.theirs = Node.objects.create(owner=self.other, name="theirs")
+        self.file = File.objects.create(owner=self.owner, name="a.txt")
+        self.private = File.objects.create(owner=self.other, name="private.txt")
+
+    def test_create_nodes_and_edges_report_each_item(self):
+        from unittest import mock
+
+        from django.db import connection
+
+        from .models import Edge
+        from .schema import CreateEdges, CreateNodes
+
+        # as on MySQL
+        with mock.patch.dict(connection.features.__dict__, {"can_return_rows_from_bulk_insert": False}), \
+                mock.patch("graph.schema.NodeUpdates.notify_created") as notify, \
+                self.captureOnCommitCallbacks(execute=True):
+            results = CreateNodes().mutate(
+                self.info, nodes=[_node("c", x=1, y=2), _node(""), _node("d")]
+            ).results
+        self.assertEqual([r.node.name for r in results[::2]], ["c", "d"])
+        self.assertIsNone(results[1].node)
+        self.assertIsNotNone(results[1].error)
+        c, d = results[0].node, results[2].node
+        self.assertEqual(Node.objects.get(pk=c.pk).x, 1)
+        notify.assert_called_once_with([c.pk, d.pk])
+
+        existing = Edge.objects.create(node_a=self.a, node_b=self.b)
+        with mock.patch.dict(connection.features.__dict__, {"can_return_rows_from_bulk_insert": False}):
+            results = CreateEdges().mutate(self.info, edges=[
+                _edge(self.b, self.a),
+                _edge(c, d, "cd"),
+                _edge(d, c),
+                _edge(c, c),
+                _edge(c, self.theirs),
+            ]).results
+        self.assertEqual(results[0].edge, existing)
+        self.assertEqual(results[1].edge.pk, results[2].edge.pk)
+        self.assertEqual(results[1].edge.label, "cd")
+        self.assertEqual([bool(r.error) for r in results], [False, False, False, True, True])
+        self.assertEqual(Edge.objects.count(), 2)
+        self.assertEqual(
+            set(NodeNeighbor.objects.filter(edge=results[1].edge).values_list("node_id", "neighbor_id")),
+            {(c.pk, d.pk), (d.pk, c.pk)},
+        )
+
+    def test_add_and_move_files_in_batches(self):
+        from unittest import mock
+
+        from .models import NodeFile
+        from .schema import AddFilesToNodes, MoveFiles
+
+        results = AddFilesToNodes().mutate(self.info, links=[
+            _link(self.a, self.file, "first"),
+            _link(self.a, self.file, "second"),
+            _link(self.b, self.private),
+            _link(self.theirs, self.file),
+        ]).results
+        self.assertEqual([bool(r.error) for r in results], [False, False, True, True])
+        self.assertEqual(list(NodeFile.objects.values_list("node_id", "note")), [(self.a.pk, "second")])
+
+        results = MoveFiles().mutate(self.info, moves=[
+            _move(self.a, self.b, self.file),
+            # the link has already moved in this batch
+            _move(self.b, self.a, self.file),
+            _move(self.a, self.theirs, self.file),
+        ]).results
+        self.assertEqual([r.ok for r in results], [True, False, False])
+        self.assertEqual(list(NodeFile.objects.values_list("node_id", flat=True)), [self.b.pk])
+
+        # a target that already has the file keeps its own link
+        NodeFile.objects.create(node=self.a, file=self.file, note="kept")
+        with mock.patch("graph.signals.NodeUpdates.notify") as notify, \
+                mock.patch("graph.schema.NodeUpdates.notify_many") as notify_many, \
+                self.captureOnCommitCallbacks(execute=True):
+            MoveFiles().mutate(self.info, moves=[
+                _move(self.b, self.a, self.file),
+            ])
+        self.assertEqual(list(NodeFile.objects.values_list("node_id", "note")), [(self.a.pk, "kept")])
+        # the merged link goes without a signal per row; one batched notification instead
+        notify.assert_not_called()
+        notify_many.assert_called_once_with({self.a.pk, self.b.pk})
+
+    def test_batches_are_capped(self):
+        from django.test import override_settings
+        from graphql import GraphQLError
+
+        from .schema import CreateNodes
+
+        with override_settings(GRAPH_BATCH_MAX_ITEMS=1), self.assertRaises(GraphQLError):
+            CreateNodes().mutate(self.info, nodes=[_node("x"), _node("y")])
+        self.assertEqual(Node.objects.count(), 3)
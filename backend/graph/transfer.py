@@ -0,0 +1,341 @@
+"""
+Bulk import and export of maps, as JSON Lines or GraphML.
+
+JSON Lines holds one record per line::
+
+    {"type": "node", "id": "a", "name": "...", "description": "...", "x": 0, "y": 0, "layer": 0}
+    {"type": "edge", "source": "a", "target": "b", "label": "..."}
+    {"type": "file", "node": "a", "file": 42, "note": "..."}
+
+Node ``id``s are keys local to the document; edges and file links refer to
+them, and come after the nodes they refer to. GraphML carries the same data
+as ``<data>`` on undirected ``<node>``/``<edge>`` elements, with a node's
+files as a space separated ``files`` list (notes are not kept).
+
+An import runs in one transaction. Rows are inserted ``CHUNK`` at a time
+through ``graph.bulk``, and subscribers hear one event for the whole
+import. Files are linked only if the importer can read them; the rest are
+counted as skipped. Nodes without a position are laid out afterwards.
+
+Exports stream the caller's own map from database iterators, so memory
+stays flat whatever the size of the map.
+"""
+
+import json
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+
+from django.db import transaction
+
+from graph import analytics, bulk, layout
+from graph.models import Edge, Node, NodeFile
+from vault.subscriptions import NodeUpdates
+
+FORMATS = ("jsonl", "graphml")
+CHUNK = 1000
+GRAPHML_NS = "http://graphml.graphdrawing.org/xmlns"
+
+_NAME_LENGTH = Node._meta.get_field("name").max_length
+_LABEL_LENGTH = Edge._meta.get_field("label").max_length
+
+
+class GraphImportError(ValueError):
+    """The document is malformed or refers to something that is not in it."""
+
+
+def format_for(filename, default="jsonl"):
+    """The format a file name suggests."""
+    return "graphml" if str(filename).lower().endswith((".graphml", ".xml")) else default
+
+
+# ── Reading ──────────────────────────────────────────────────────────────────
+
+def read_jsonl(stream):
+    """Records from a JSON Lines byte or text stream."""
+    for number, line in enumerate(stream, 1):
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            raise GraphImportError(f"Line {number}: {exc}") from exc
+        if not isinstance(record, dict):
+            raise GraphImportError(f"Line {number}: expected an object.")
+        yield record
+
+
+def _local(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_graphml(stream):
+    """Records from a GraphML stream, parsed incrementally."""
+    names = {}
+    try:
+        for event, element in iterparse(stream, events=("end",)):
+            tag = _local(element.tag)
+            if tag == "key":
+                names[element.get("id")] = element.get("attr.name") or element.get("id")
+                continue
+            if tag not in ("node", "edge"):
+                continue
+            data = {
+                names.get(d.get("key"), d.get("key")): d.text or ""
+                for d in element
+                if _local(d.tag) == "data"
+            }
+            if tag == "node":
+                files = data.pop("files", "")
+                yield {"type": "node", "id": element.get("id"), **data}
+                for file_id in files.split():
+                    yield {"type": "file", "node": element.get("id"), "file": file_id}
+            else:
+                yield {"type": "edge", "source": element.get("source"), "target": element.get("target"), **data}
+            # keep memory flat on large documents
+            element.clear()
+    except SyntaxError as exc:  # ParseError
+        raise GraphImportError(f"Invalid GraphML: {exc}") from exc
+
+
+def read(stream, fmt):
+    if fmt not in FORMATS:
+        raise GraphImportError(f"Format must be one of: {', '.join(FORMATS)}.")
+    return read_jsonl(stream) if fmt == "jsonl" else read_graphml(stream)
+
+
+# ── Import ───────────────────────────────────────────────────────────────────
+
+def _number(record, field, kind=float):
+    value = record.get(field)
+    if value in (None, ""):
+        return None
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise GraphImportError(f"Node {record.get('id')!r}: {field} must be a number.")
+
+
+class Importer:
+    """Buffers records and writes them ``CHUNK`` at a time for ``user``."""
+
+    def __init__(self, user):
+        self.user = user
+        self.keys = {}
+        self.nodes = []
+        self.edges = []
+        self.links = []
+        self.pending = set()
+        self.pairs = set()
+        self.unplaced = []
+        self.counts = {"nodes": 0, "edges": 0, "files": 0, "skipped_files": 0}
+
+    def add(self, record):
+        kind = record.get("type")
+        if kind == "node":
+            self._add_node(record)
+        elif kind == "edge":
+            label = str(record.get("label") or "")
+            if len(label) > _LABEL_LENGTH:
+                raise GraphImportError(f"Edge labels are at most {_LABEL_LENGTH} characters.")
+            self.edges.append((self._known(record.get("source")), self._known(record.get("target")), label))
+            if len(self.edges) >= CHUNK:
+                self._flush_edges()
+        elif kind == "file":
+            self.links.append((self._known(record.get("node")), record.get("file"), str(record.get("note") or "")))
+            if len(self.links) >= CHUNK:
+                self._flush_links()
+        else:
+            raise GraphImportError(f"Unknown record type {kind!r}.")
+
+    def _known(self, key):
+        key = str(key)
+        if key not in self.keys and key not in self.pending:
+            raise GraphImportError(f"Node {key!r} is referred to before it is defined.")
+        return key
+
+    def _add_node(self, record):
+        key = record.get("id")
+        if key in (None, ""):
+            raise GraphImportError("Every node needs an id.")
+        key = str(key)
+        if key in self.keys or key in self.pending:
+            raise GraphImportError(f"Node {key!r} appears twice.")
+        name = str(record.get("name") or "")
+        if not name or len(name) > _NAME_LENGTH:
+            raise GraphImportError(f"Node {key!r}: name must be 1 to {_NAME_LENGTH} characters.")
+        x, y, layer = _number(record, "x"), _number(record, "y"), _number(record, "layer", int)
+        node = Node(
+            owner=self.user,
+            name=name,
+            description=str(record.get("description") or ""),
+            x=x or 0,
+            y=y or 0,
+            layer=layer or 0,
+        )
+        node.placed = x is not None and y is not None
+        self.nodes.append((key, node))
+        self.pending.add(key)
+        if len(self.nodes) >= CHUNK:
+            self._flush_nodes()
+
+    def _flush_nodes(self):
+        if not self.nodes:
+            return
+        nodes = bulk.insert_nodes([node for _, node in self.nodes])
+        for key, node in self.nodes:
+            self.keys[key] = node.pk
+            if not node.placed:
+                self.unplaced.append(node.pk)
+        self.counts["nodes"] += len(nodes)
+        self.nodes = []
+        self.pending = set()
+
+    def _resolve(self, key):
+        if key not in self.keys:
+            self._flush_nodes()
+        return self.keys[key]
+
+    def _flush_edges(self):
+        edges = []
+        for source, target, label in self.edges:
+            a, b = sorted((self._resolve(source), self._resolve(target)))
+            if a == b or (a, b) in self.pairs:
+                continue
+            self.pairs.add((a, b))
+            edges.append(Edge(node_a_id=a, node_b_id=b, label=label))
+        self.edges = []
+        if not edges:
+            return
+        bulk.insert_edges(edges)
+        self.counts["edges"] += len(edges)
+
+    def _flush_links(self):
+        from files.schema import readable_files
+
+        links = {}
+        for key, file_id, note in self.links:
+            try:
+                file_id = int(file_id)
+            except (TypeError, ValueError):
+                raise GraphImportError(f"Node {key!r}: file must be an id.")
+            links[self._resolve(key), file_id] = note
+        self.links = []
+        readable = set(
+            readable_files(self.user).filter(pk__in={f for _, f in links}).values_list("pk", flat=True)
+        )
+        rows = [
+            NodeFile(node_id=node_id, file_id=file_id, note=note)
+            for (node_id, file_id), note in links.items()
+            if file_id in readable
+        ]
+        bulk.link_files(rows)
+        self.counts["files"] += len(rows)
+        self.counts["skipped_files"] += len(links) - len(rows)
+
+    def finish(self):
+        self._flush_nodes()
+        self._flush_edges()
+        self._flush_links()
+        return self.counts
+
+
+def import_graph(user, records):
+    """
+    Add the nodes, edges and file links in ``records`` to the map of
+    ``user``, all or nothing. Returns how many of each were created, and how
+    many file links were skipped.
+    """
+    importer = Importer(user)
+    with transaction.atomic():
+        for record in records:
+            importer.add(record)
+        counts = importer.finish()
+        created = list(importer.keys.values())
+
+        transaction.on_commit(lambda: NodeUpdates.notify_created(created))
+        if importer.unplaced:
+            # the layout job also counts the change towards rescoring
+            layout.schedule(user.pk, importer.unplaced)
+        elif created:
+            analytics.note_changes(user.pk, len(created))
+    return counts
+
+
+# ── Export ───────────────────────────────────────────────────────────────────
+
+def _map_rows(user):
+    nodes = (
+        Node.objects.filter(owner=user)
+        .order_by("pk")
+        .values_list("pk", "name", "description", "x", "y", "layer")
+        .iterator(chunk_size=CHUNK)
+    )
+    edges = (
+        Edge.objects.filter(node_a__owner=user, node_b__owner=user)
+        .order_by("pk")
+        .values_list("node_a_id", "node_b_id", "label")
+        .iterator(chunk_size=CHUNK)
+    )
+    links = (
+        NodeFile.objects.filter(node__owner=user)
+        .order_by("node_id", "pk")
+        .values_list("node_id", "file_id", "note")
+        .iterator(chunk_size=CHUNK)
+    )
+    return nodes, edges, links
+
+
+def export_jsonl(user):
+    """The map of ``user`` as JSON Lines, one line at a time."""
+    nodes, edges, links = _map_rows(user)
+    for pk, name, description, x, y, layer in nodes:
+        node = {"type": "node", "id": str(pk), "name": name, "description": description}
+        yield json.dumps({**node, "x": x, "y": y, "layer": layer}) + "\n"
+    for a, b, label in edges:
+        yield json.dumps({"type": "edge", "source": str(a), "target": str(b), "label": label}) + "\n"
+    for node_id, file_id, note in links:
+        yield json.dumps({"type": "file", "node": str(node_id), "file": file_id, "note": note}) + "\n"
+
+
+_GRAPHML_KEYS = (
+    ("name", "node", "string"),
+    ("description", "node", "string"),
+    ("x", "node", "double"),
+    ("y", "node", "double"),
+    ("layer", "node", "int"),
+    ("files", "node", "string"),
+    ("label", "edge", "string"),
+)
+
+
+def _data(key, value):
+    return f'<data key="{key}">{escape(str(value))}</data>'
+
+
+def export_graphml(user):
+    """The map of ``user`` as GraphML, one element at a time."""
+    nodes, edges, links = _map_rows(user)
+    yield f'<?xml version="1.0" encoding="UTF-8"?>\n<graphml xmlns="{GRAPHML_NS}">\n'
+    for key, scope, kind in _GRAPHML_KEYS:
+        yield f'  <key id="{key}" for="{scope}" attr.name="{key}" attr.type="{kind}"/>\n'
+    yield '  <graph edgedefault="undirected">\n'
+    # links come sorted by node, like the nodes: walk both together
+    link = next(links, None)
+    for pk, name, description, x, y, layer in nodes:
+        files = []
+        while link is not None and link[0] <= pk:
+            if link[0] == pk:
+                files.append(str(link[1]))
+            link = next(links, None)
+        data = [_data("name", name), _data("description", description), _data("x", x), _data("y", y)]
+        data += [_data("layer", layer)] + ([_data("files", " ".join(files))] if files else [])
+        yield f'    <node id={quoteattr(str(pk))}>{"".join(data)}</node>\n'
+    for a, b, label in edges:
+        yield f'    <edge source="{a}" target="{b}">{_data("label", label)}</edge>\n'
+    yield "  </graph>\n</graphml>\n"
+
+
+def export(user, fmt):
+    return export_jsonl(user) if fmt == "jsonl" else export_graphml(user)
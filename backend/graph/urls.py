@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = "graph"
+
+urlpatterns = [
+    path("<int:node_id>/export.zip", views.export_node, name="node-export"),
+    path("export.<str:fmt>", views.export_map, name="map-export"),
+]
@@ -0,0 +1,51 @@
+# graph/views.py
+
+from django.core.exceptions import PermissionDenied
+from django.db.models import OuterRef, Subquery
+from django.http import Http404, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+
+from files.export import unique_names
+from files.models import Version
+from files.schema import readable_files
+from files.views import request_user, zip_response
+from . import transfer
+from .models import NodeFile
+from .schema import readable_nodes
+
+CONTENT_TYPES = {"jsonl": "application/x-ndjson", "graphml": "application/graphml+xml"}
+
+
+def export_node(request, node_id):
+    """ZIP of the latest version of every file in a node the caller can read."""
+    user = request_user(request)
+    node = readable_nodes(user).filter(pk=node_id).first()
+    if not node:
+        raise Http404("Node not found.")
+
+    # permissions are settled here, once, not per entry while streaming;
+    # only each file's newest version is read, however long its history
+    latest = Version.objects.filter(file_id=OuterRef("file_id")).order_by("-created_at", "-id").values("pk")[:1]
+    node_files = list(
+        NodeFile.objects.filter(node=node, file__in=readable_files(user))
+        .annotate(latest_id=Subquery(latest))
+        .exclude(latest_id=None)
+        .select_related("file")
+        .order_by("added_at", "pk")
+    )
+    versions = Version.objects.in_bulk([nf.latest_id for nf in node_files])
+    names = unique_names(nf.file.name for nf in node_files)
+    entries = [(name, versions[nf.latest_id]) for name, nf in zip(names, node_files)]
+    return zip_response(request, entries, f"{node.name}.zip")
+
+
+def export_map(request, fmt):
+    """The caller's own map as JSON Lines or GraphML, streamed as it is read."""
+    user = request_user(request)
+    if user.is_anonymous:
+        raise PermissionDenied
+    if fmt not in transfer.FORMATS:
+        raise Http404("Unknown format.")
+    response = StreamingHttpResponse(transfer.export(user, fmt), content_type=CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = content_disposition_header(True, f"map.{fmt}")
+    return response
@@ -0,0 +1,46 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from jobs.worker import Worker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs. Start one or more per host; they "
+        "coordinate through the database. Each runs up to its queues' "
+        "configured concurrency on its own."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--queues",
+            default=",".join(settings.JOB_QUEUES),
+            help="Comma-separated queues to work on (default: all configured).",
+        )
+        parser.add_argument(
+            "--pool",
+            choices=["thread", "process"],
+            default="thread",
+            help="Run jobs in threads, or in processes for CPU-bound work.",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when no job is due.",
+        )
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once no job is due instead of polling forever.",
+        )
+
+    def handle(self, *args, queues, pool, poll_interval, burst, **options):
+        queues = [q.strip() for q in queues.split(",") if q.strip()]
+        worker = Worker(queues, pool=pool, poll_interval=poll_interval)
+        signal.signal(signal.SIGTERM, worker.stop)
+        signal.signal(signal.SIGINT, worker.stop)
+        self.stdout.write(f"Worker {worker.name} on {', '.join(queues)} ({pool} pool)")
+        worker.run(burst=burst)
@@ -0,0 +1,42 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Job(models.Model):
+    """
+    A unit of background work, claimed and run by ``manage.py run_worker``.
+
+    Successful jobs are deleted; failed ones stay with their traceback until
+    someone looks at them.
+    """
+    QUEUED  = "QUEUED"
+    RUNNING = "RUNNING"
+    FAILED  = "FAILED"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (FAILED, "Failed"),
+    ]
+
+    queue        = models.CharField(max_length=50, default="default")
+    task         = models.CharField(max_length=200)
+    args         = models.JSONField(default=list, blank=True)
+    kwargs       = models.JSONField(default=dict, blank=True)
+    priority     = models.SmallIntegerField(default=0, help_text="Higher runs first")
+    status       = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts     = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_at       = models.DateTimeField(default=timezone.now)
+    locked_by    = models.CharField(max_length=100, blank=True)
+    locked_at    = models.DateTimeField(null=True, blank=True)
+    last_error   = models.TextField(blank=True)
+    created_at   = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # matches the claim query: WHERE status, queue, run_at ORDER BY priority DESC
+            models.Index(fields=["status", "queue", "-priority", "run_at"], name="job_claim_idx"),
+        ]
+
+    def __str__(self):
+        return f"Job #{self.id} {self.task} [{self.queue}, {self.status}]"
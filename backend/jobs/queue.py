@@ -0,0 +1,180 @@
+"""
+Database-backed job queue.
+
+Jobs are rows in the ``Job`` table, so enqueueing inside a transaction is
+atomic with the rest of it: a rolled back mutation never leaves work behind
+and a committed one never loses it. Workers claim rows with
+``SELECT ... FOR UPDATE SKIP LOCKED`` where the database supports it (MySQL
+8, PostgreSQL) and with a conditional ``UPDATE`` per row elsewhere (SQLite
+in tests), so no two workers ever run the same job.
+
+A claimed job is leased to its worker, which renews the lease
+(``heartbeat``) for as long as the job runs. Jobs whose lease ran out are
+assumed lost and queued again (``requeue_stale``); should the first worker
+still finish, it only deletes or fails a job it still holds.
+
+Per-queue concurrency (``JOB_QUEUES``) is enforced by each worker for its
+own pool, so a queue runs up to that many jobs per worker process. Start
+workers for a queue accordingly; work that must never overlap takes a row
+lock of its own (a file's compaction, a map's layout write).
+
+Only functions decorated with ``@task`` can be run by a worker::
+
+    @task(queue="blobs")
+    def release(names):
+        ...
+
+    release.delay(["uploads/a.txt"])
+"""
+
+import logging
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from jobs.models import Job
+
+logger = logging.getLogger(__name__)
+
+# seconds before the first retry; doubles with every further attempt
+RETRY_DELAY = 30
+
+_registry = {}
+
+
+# ── Declaring and enqueueing ─────────────────────────────────────────────────
+
+def task(queue="default", priority=0, max_attempts=3):
+    """Register a function as a job a worker may run; adds ``.delay()``."""
+    def decorate(func):
+        name = f"{func.__module__}.{func.__qualname__}"
+        _registry[name] = func
+        func.task_name = name
+        func.task_options = {"queue": queue, "priority": priority, "max_attempts": max_attempts}
+        func.delay = lambda *args, **kwargs: enqueue(func, args=args, kwargs=kwargs)
+        return func
+    return decorate
+
+
+def enqueue(func, args=(), kwargs=None, queue=None, priority=None, max_attempts=None, run_at=None):
+    """
+    Queue a call of the ``@task`` function ``func``. Arguments must be JSON
+    serialisable; pass ids rather than model instances.
+    """
+    options = func.task_options
+    return Job.objects.create(
+        task=func.task_name,
+        args=list(args),
+        kwargs=kwargs or {},
+        queue=queue or options["queue"],
+        priority=options["priority"] if priority is None else priority,
+        max_attempts=max_attempts or options["max_attempts"],
+        run_at=run_at or timezone.now(),
+    )
+
+
+def resolve(name):
+    """The registered task called ``name``, importing its module on demand."""
+    if name not in _registry:
+        import_string(name)
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f"{name} is not a registered task.") from None
+
+
+# ── Claiming and running ─────────────────────────────────────────────────────
+
+def claim(queue, limit, worker):
+    """Mark up to ``limit`` due jobs of ``queue`` as running for ``worker``; return their ids."""
+    now = timezone.now()
+    due = (
+        Job.objects.filter(queue=queue, status=Job.QUEUED, run_at__lte=now)
+        .order_by("-priority", "run_at", "pk")
+    )
+    lock = {"status": Job.RUNNING, "locked_by": worker, "locked_at": now, "attempts": F("attempts") + 1}
+    with transaction.atomic():
+        if connection.features.has_select_for_update_skip_locked:
+            ids = list(due.select_for_update(skip_locked=True).values_list("pk", flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**lock)
+            return ids
+        # no row locks: only the worker whose UPDATE still sees QUEUED wins
+        return [
+            pk for pk in due.values_list("pk", flat=True)[:limit]
+            if Job.objects.filter(pk=pk, status=Job.QUEUED).update(**lock)
+        ]
+
+
+def run_job(job_id, worker):
+    """
+    Run a job claimed by ``worker``; delete it on success, schedule a retry
+    or fail it otherwise. A job requeued meanwhile belongs to whoever claimed
+    it since, and is left alone.
+    """
+    close_old_connections()
+    try:
+        held = Job.objects.filter(pk=job_id, status=Job.RUNNING, locked_by=worker)
+        job = held.first()
+        if job is None:
+            return False
+        try:
+            resolve(job.task)(*job.args, **job.kwargs)
+        except Exception:
+            logger.exception("Job %s (%s) failed on attempt %s", job.pk, job.task, job.attempts)
+            _fail(held, job, traceback.format_exc())
+            return False
+        held.delete()
+        return True
+    finally:
+        close_old_connections()
+
+
+def _fail(held, job, error):
+    if job.attempts < job.max_attempts:
+        delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+        held.update(
+            status=Job.QUEUED,
+            run_at=timezone.now() + timedelta(seconds=delay),
+            locked_by="",
+            locked_at=None,
+            last_error=error,
+        )
+    else:
+        held.update(status=Job.FAILED, last_error=error)
+
+
+def heartbeat(job_ids, worker):
+    """Renew the lease of the jobs in ``job_ids`` that ``worker`` still holds."""
+    return Job.objects.filter(pk__in=job_ids, status=Job.RUNNING, locked_by=worker).update(
+        locked_at=timezone.now()
+    )
+
+
+def requeue_stale(lease):
+    """
+    Put back jobs whose lease was last renewed longer than ``lease`` ago,
+    assuming their worker died. Jobs that already used up their attempts are
+    failed instead.
+    """
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=timezone.now() - lease)
+    stale.filter(attempts__gte=F("max_attempts")).update(
+        status=Job.FAILED, last_error="Worker lost while running the job."
+    )
+    return stale.update(status=Job.QUEUED, locked_by="", locked_at=None)
+
+
+def run_pending(queues=None, worker="inline"):
+    """Run every due job in the calling thread until none are left; returns how many ran."""
+    queues = queues or list(Job.objects.values_list("queue", flat=True).distinct())
+    ran = 0
+    while True:
+        claimed = [job_id for queue in queues for job_id in claim(queue, 100, worker)]
+        if not claimed:
+            return ran
+        for job_id in claimed:
+            run_job(job_id, worker)
+            ran += 1
@@ -0,0 +1,121 @@
+import time
+from datetime import timedelta
+
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Job
+from .queue import claim, enqueue, heartbeat, requeue_stale, run_job, run_pending, task
+from .worker import Worker
+
+calls = []
+
+
+@task()
+def record(value):
+    calls.append(value)
+
+
+@task(queue="flaky", max_attempts=2)
+def explode():
+    raise RuntimeError("boom")
+
+
+@task()
+def linger(value):
+    time.sleep(0.6)
+    calls.append(value)
+
+
+class QueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_successful_jobs_run_and_disappear(self):
+        record.delay("a")
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, ["a"])
+        self.assertFalse(Job.objects.exists())
+
+    def test_claim_order_and_limit(self):
+        low = enqueue(record, args=["low"])
+        high = enqueue(record, args=["high"], priority=5)
+        later = enqueue(record, args=["later"], run_at=timezone.now() + timedelta(hours=1))
+
+        self.assertEqual(claim("default", 1, "w1"), [high.pk])
+        self.assertEqual(claim("default", 5, "w2"), [low.pk])
+        self.assertEqual(claim("default", 5, "w3"), [])
+        high.refresh_from_db()
+        self.assertEqual((high.status, high.locked_by, high.attempts), (Job.RUNNING, "w1", 1))
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.QUEUED)
+
+    def test_failures_retry_with_backoff_then_fail(self):
+        job = explode.delay()
+        with self.assertLogs("jobs.queue", "ERROR"):
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertIn("boom", job.last_error)
+        self.assertGreater(job.run_at, timezone.now())
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs("jobs.queue", "ERROR"):
+            run_pending()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_stale_jobs_are_requeued(self):
+        job = record.delay("x")
+        claim("default", 1, "dead-worker")
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale(timedelta(minutes=15)), 1)
+        self.assertTrue(run_job(claim("default", 1, "w")[0], "w"))
+        self.assertEqual(calls, ["x"])
+
+    def test_only_the_current_holder_finishes_a_job(self):
+        job = record.delay("x")
+        claim("default", 1, "slow-worker")
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        requeue_stale(timedelta(minutes=15))
+        claim("default", 1, "w")
+
+        # the first worker's lease ran out; it neither runs nor removes the job
+        self.assertFalse(run_job(job.pk, "slow-worker"))
+        self.assertEqual(heartbeat([job.pk], "slow-worker"), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).locked_by, "w")
+        self.assertTrue(run_job(job.pk, "w"))
+        self.assertEqual(calls, ["x"])
+
+    def test_heartbeats_keep_long_jobs_from_being_requeued(self):
+        job = record.delay("x")
+        claim("default", 1, "w")
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(heartbeat([job.pk], "w"), 1)
+        self.assertEqual(requeue_stale(timedelta(minutes=15)), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+    def test_unregistered_tasks_are_refused(self):
+        job = Job.objects.create(task="os.getcwd")
+        claim("default", 1, "w")
+        with self.assertLogs("jobs.queue", "ERROR"):
+            self.assertFalse(run_job(job.pk, "w"))
+
+
+@override_settings(JOB_QUEUES={"default": {"concurrency": 2}}, JOB_LEASE_SECONDS=60)
+class WorkerTests(TransactionTestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_burst_runs_everything_on_the_thread_pool(self):
+        for i in range(5):
+            record.delay(i)
+        Worker(["default"], poll_interval=0.01).run(burst=True)
+        self.assertEqual(sorted(calls), [0, 1, 2, 3, 4])
+        self.assertFalse(Job.objects.exists())
+
+    def test_jobs_outlasting_the_lease_run_once(self):
+        linger.delay("slow")
+        with override_settings(JOB_LEASE_SECONDS=0.3):
+            Worker(["default"], poll_interval=0.01).run(burst=True)
+        self.assertEqual(calls, ["slow"])
+        self.assertFalse(Job.objects.exists())
@@ -0,0 +1,97 @@
+"""Polling worker that runs queued jobs on a thread or process pool."""
+
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from jobs.queue import claim, heartbeat, requeue_stale, run_job
+
+
+def _setup_process():
+    import django
+
+    django.setup()
+
+
+class Worker:
+    """
+    Claims jobs from ``queues`` while it has free slots and hands them to a
+    pool. Each queue gets the ``concurrency`` configured in ``JOB_QUEUES``
+    in this worker process, so slow queues cannot starve the others; other
+    workers add their own. The leases of running jobs are renewed every
+    third of ``JOB_LEASE_SECONDS``, however long the jobs take.
+    """
+
+    def __init__(self, queues, pool="thread", poll_interval=1.0, name=None):
+        configured = settings.JOB_QUEUES
+        self.limits = {q: configured.get(q, {}).get("concurrency", 1) for q in queues}
+        self.pool = pool
+        self.poll_interval = poll_interval
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+        self.lease = timedelta(seconds=settings.JOB_LEASE_SECONDS)
+        self.stopping = threading.Event()
+        # futures of the jobs in flight, by queue, mapped to their job ids
+        self.running = {q: {} for q in queues}
+
+    def _executor(self):
+        size = sum(self.limits.values())
+        if self.pool == "process":
+            # spawned children set Django up themselves and never share the
+            # parent's database connections
+            return ProcessPoolExecutor(
+                max_workers=size,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_setup_process,
+            )
+        return ThreadPoolExecutor(max_workers=size, thread_name_prefix="job")
+
+    def stop(self, *args):
+        """Finish the jobs in flight, then return from ``run``."""
+        self.stopping.set()
+
+    def run(self, burst=False):
+        """Work until stopped, or with ``burst`` until no job is due."""
+        executor = self._executor()
+        next_requeue = next_heartbeat = 0.0
+        try:
+            while not self.stopping.is_set():
+                for in_flight in self.running.values():
+                    for future in [f for f in in_flight if f.done()]:
+                        del in_flight[future]
+                if time.monotonic() >= next_heartbeat:
+                    job_ids = [pk for in_flight in self.running.values() for pk in in_flight.values()]
+                    if job_ids:
+                        heartbeat(job_ids, self.name)
+                    next_heartbeat = time.monotonic() + self.lease.total_seconds() / 3
+                if time.monotonic() >= next_requeue:
+                    requeue_stale(self.lease)
+                    next_requeue = time.monotonic() + self.lease.total_seconds() / 2
+
+                claimed = 0
+                for queue, limit in self.limits.items():
+                    in_flight = self.running[queue]
+                    free = limit - len(in_flight)
+                    if free <= 0:
+                        continue
+                    for job_id in claim(queue, free, self.name):
+                        in_flight[executor.submit(run_job, job_id, self.name)] = job_id
+                        claimed += 1
+                close_old_connections()
+
+                futures = {f for in_flight in self.running.values() for f in in_flight}
+                if burst and not claimed and all(f.done() for f in futures):
+                    break
+                if not claimed:
+                    if futures:
+                        wait(futures, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                    else:
+                        self.stopping.wait(self.poll_interval)
+        finally:
+            executor.shutdown(wait=True)
@@ -0,0 +1,284 @@
+"""
+Trash and fast-path deletion of nodes, files, versions and groups.
+
+User-facing deletes of files, versions and nodes only stamp ``deleted_at``;
+the default managers hide trashed rows and ``restore_*`` brings them back.
+``purge_trash`` later removes rows that have been in the trash longer than
+``TRASH_RETENTION_DAYS`` through the ``delete_*`` paths below.
+
+``Model.delete()`` runs Django's collector, which loads every dependent row
+into memory and fires ``post_delete`` for each one; our signal handlers then
+broadcast a subscription event per row. These helpers remove dependents with
+one ``DELETE`` per table and batch of ids, skip per-row signals, emit one
+notification per affected node or channel after commit, and queue blob
+removal as a job (``files.blobs.release_later``) in the same transaction.
+Storage usage counters (``files.usage``) drop the removed versions in that
+transaction too. Trashing, and deleting channels or groups, rotates the
+affected files' ``download_key`` so outstanding signed links stop working.
+"""
+
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import Group, GroupMember, Profile
+from chat.models import Channel, ChannelMembership, Message
+from files import delta, tokens, usage
+from files.blobs import release_later
+from files.models import File, FileShare, RetentionPolicy, StorageUsage, Version
+from graph import adjacency
+from graph.models import Edge, Node, NodeCluster, NodeFile, NodeNeighbor, NodeShare
+from vault.subscriptions import MessageUpdates, NodeUpdates
+
+BATCH_SIZE = 500
+
+
+def _batches(ids, size=BATCH_SIZE):
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+def _raw_delete(qs):
+    """Delete matching rows in SQL without collecting them or sending signals."""
+    return qs._raw_delete(qs.db)
+
+
+def _delete_channels(channel_ids):
+    # members lose the attachments with the channel
+    tokens.rotate_for_channels(channel_ids)
+    _raw_delete(Message.objects.filter(channel_id__in=channel_ids))
+    _raw_delete(ChannelMembership.objects.filter(channel_id__in=channel_ids))
+    _raw_delete(Channel.objects.filter(pk__in=channel_ids))
+
+
+def _notify_after_commit(node_ids=(), channel_ids=()):
+    node_ids, channel_ids = set(node_ids), set(channel_ids)
+
+    def send():
+        NodeUpdates.notify_many(node_ids)
+        for channel_id in sorted(channel_ids):
+            MessageUpdates.notify(channel_id)
+
+    if node_ids or channel_ids:
+        transaction.on_commit(send)
+
+
+def _invalidate_adjacency(node_ids):
+    # the traversal cache keeps an edge in the shards of both its ends' owners
+    owner_ids = set(Node.all_objects.filter(pk__in=node_ids).values_list("owner_id", flat=True))
+    transaction.on_commit(lambda: adjacency.invalidate(owner_ids))
+
+
+def delete_nodes(node_ids):
+    """Delete nodes with their files links, edges, shares and chat channels."""
+    touched_nodes, touched_channels = set(), set()
+    with transaction.atomic():
+        for batch in _batches(node_ids):
+            # neighbours lose an edge, so their subscribers need to hear about it
+            ends = set(batch)
+            ends.update(NodeNeighbor.objects.filter(node_id__in=batch).values_list("neighbor_id", flat=True))
+            touched_nodes.update(ends)
+            _invalidate_adjacency(ends)
+            channel_ids = list(Channel.objects.filter(node_id__in=batch).values_list("pk", flat=True))
+            touched_channels.update(channel_ids)
+
+            _delete_channels(channel_ids)
+            _raw_delete(NodeFile.all_objects.filter(node_id__in=batch))
+            _raw_delete(NodeNeighbor.objects.filter(node_id__in=batch))
+            _raw_delete(NodeNeighbor.objects.filter(neighbor_id__in=batch))
+            _raw_delete(Edge.all_objects.filter(node_a_id__in=batch))
+            _raw_delete(Edge.all_objects.filter(node_b_id__in=batch))
+            _raw_delete(NodeShare.objects.filter(node_id__in=batch))
+            _raw_delete(StorageUsage.objects.filter(node_id__in=batch))
+            _raw_delete(NodeCluster.objects.filter(node_id__in=batch))
+            _raw_delete(Node.all_objects.filter(pk__in=batch))
+        _notify_after_commit(touched_nodes, touched_channels)
+
+
+def delete_files(file_ids):
+    """Delete files with their versions and shares; blobs go in the background."""
+    touched_nodes, touched_channels, blob_names = set(), set(), set()
+    with transaction.atomic():
+        for batch in _batches(file_ids):
+            blob_names.update(File.all_objects.filter(pk__in=batch).values_list("upload", flat=True))
+            blob_names.update(Version.all_objects.filter(file_id__in=batch).values_list("upload", flat=True))
+            touched_nodes.update(
+                NodeFile.all_objects.filter(file_id__in=batch).values_list("node_id", flat=True)
+            )
+            attached = Message.objects.filter(attachment__file_id__in=batch)
+            touched_channels.update(attached.values_list("channel_id", flat=True))
+
+            attached.update(attachment=None)
+            Profile.objects.filter(avatar_file_id__in=batch).update(avatar_file=None)
+            usage.files_removed(batch)
+            _raw_delete(NodeFile.all_objects.filter(file_id__in=batch))
+            _raw_delete(FileShare.objects.filter(file_id__in=batch))
+            _raw_delete(RetentionPolicy.objects.filter(file_id__in=batch))
+            # delta chains only link versions of the same file; unlink them so
+            # the row-by-row FK checks of a single DELETE never trip
+            Version.all_objects.filter(file_id__in=batch, delta_base__isnull=False).update(delta_base=None)
+            _raw_delete(Version.all_objects.filter(file_id__in=batch))
+            _raw_delete(File.all_objects.filter(pk__in=batch))
+        _notify_after_commit(touched_nodes, touched_channels)
+        release_later(blob_names)
+
+
+def delete_versions(version_ids):
+    """Delete single versions; deltas built on them are stored whole first."""
+    touched_channels, blob_names = set(), set()
+    with transaction.atomic():
+        for batch in _batches(version_ids):
+            versions = list(Version.all_objects.filter(pk__in=batch))
+            delta.detach_dependents(versions)
+            blob_names.update(v.upload.name for v in versions)
+            attached = Message.objects.filter(attachment_id__in=batch)
+            touched_channels.update(attached.values_list("channel_id", flat=True))
+
+            attached.update(attachment=None)
+            usage.versions_removed(batch)
+            Version.all_objects.filter(pk__in=batch, delta_base__isnull=False).update(delta_base=None)
+            _raw_delete(Version.all_objects.filter(pk__in=batch))
+        _notify_after_commit(channel_ids=touched_channels)
+        release_later(blob_names)
+
+
+def delete_groups(group_ids):
+    """Delete groups with their memberships, shares and chat channels."""
+    touched_nodes, touched_channels = set(), set()
+    with transaction.atomic():
+        for batch in _batches(group_ids):
+            touched_nodes.update(
+                NodeShare.objects.filter(shared_with_group_id__in=batch).values_list("node_id", flat=True)
+            )
+            channel_ids = list(Channel.objects.filter(group_id__in=batch).values_list("pk", flat=True))
+            touched_channels.update(channel_ids)
+
+            _delete_channels(channel_ids)
+            tokens.rotate_for_groups(batch)
+            _raw_delete(GroupMember.objects.filter(group_id__in=batch))
+            _raw_delete(FileShare.objects.filter(shared_with_group_id__in=batch))
+            _raw_delete(NodeShare.objects.filter(shared_with_group_id__in=batch))
+            _raw_delete(Group.objects.filter(pk__in=batch))
+        _notify_after_commit(touched_nodes, touched_channels)
+
+
+# ── Trash ────────────────────────────────────────────────────────────────────
+
+def trash_files(file_ids):
+    """Move files to the trash; nodes listing them are told they changed."""
+    with transaction.atomic():
+        usage.files_removed(file_ids)
+        File.objects.filter(pk__in=file_ids).update(deleted_at=timezone.now())
+        tokens.rotate(file_ids)
+        _notify_after_commit(
+            NodeFile.all_objects.filter(file_id__in=file_ids).values_list("node_id", flat=True)
+        )
+
+
+def trash_versions(version_ids):
+    """Move single versions to the trash."""
+    with transaction.atomic():
+        usage.versions_removed(version_ids)
+        Version.objects.filter(pk__in=version_ids).update(deleted_at=timezone.now())
+        tokens.rotate(
+            Version.all_objects.filter(pk__in=version_ids).values_list("file_id", flat=True).distinct()
+        )
+
+
+def _recluster(node_ids, touched):
+    from graph.clusters import recluster_map
+
+    owners = Node.all_objects.filter(pk__in=node_ids).values_list("owner_id", flat=True).distinct()
+    for owner_id in owners:
+        recluster_map.delay(owner_id, sorted(touched))
+
+
+def trash_nodes(node_ids):
+    """Move nodes to the trash; their neighbours lose the edges to them."""
+    touched = set(node_ids)
+    with transaction.atomic():
+        Node.objects.filter(pk__in=node_ids).update(deleted_at=timezone.now())
+        touched.update(
+            NodeNeighbor.objects.filter(node_id__in=node_ids).values_list("neighbor_id", flat=True)
+        )
+        _notify_after_commit(touched)
+        # edges to trashed nodes drop out of the live graph
+        _invalidate_adjacency(touched)
+        # and clusters may be named after them
+        _recluster(node_ids, touched)
+
+
+def restore_files(file_ids):
+    """Take files out of the trash; returns how many were restored."""
+    with transaction.atomic():
+        trashed = list(File.all_objects.filter(pk__in=file_ids, deleted_at__isnull=False).values_list("pk", flat=True))
+        restored = File.all_objects.filter(pk__in=trashed).update(deleted_at=None)
+        usage.files_added(trashed)
+        _notify_after_commit(
+            NodeFile.all_objects.filter(file_id__in=file_ids).values_list("node_id", flat=True)
+        )
+    return restored
+
+
+def restore_versions(version_ids):
+    """Take versions out of the trash; returns how many were restored."""
+    with transaction.atomic():
+        trashed = list(
+            Version.all_objects.filter(pk__in=version_ids, deleted_at__isnull=False).values_list("pk", flat=True)
+        )
+        restored = Version.all_objects.filter(pk__in=trashed).update(deleted_at=None)
+        usage.versions_added(trashed)
+    return restored
+
+
+def restore_nodes(node_ids):
+    """Take nodes out of the trash; returns how many were restored."""
+    touched = set(node_ids)
+    with transaction.atomic():
+        restored = Node.all_objects.filter(pk__in=node_ids, deleted_at__isnull=False).update(deleted_at=None)
+        touched.update(
+            NodeNeighbor.objects.filter(node_id__in=node_ids).values_list("neighbor_id", flat=True)
+        )
+        _notify_after_commit(touched)
+        # their edges come back into the live graph
+        _invalidate_adjacency(touched)
+        _recluster(node_ids, touched)
+    return restored
+
+
+def purge_trash(retention=None, batch_size=BATCH_SIZE, pause=0.0, dry_run=False):
+    """
+    Permanently delete whatever has been in the trash longer than
+    ``retention`` (``TRASH_RETENTION_DAYS`` by default), ``batch_size`` rows
+    per transaction with ``pause`` seconds between batches.
+
+    Returns the number of nodes, files and versions removed (or, with
+    ``dry_run``, that would be).
+    """
+    if retention is None:
+        retention = timedelta(days=settings.TRASH_RETENTION_DAYS)
+    cutoff = timezone.now() - retention
+    report = {"nodes": 0, "files": 0, "versions": 0}
+    # files go before versions so versions of purged files are not handled twice
+    for key, model, delete in (
+        ("nodes", Node, delete_nodes),
+        ("files", File, delete_files),
+        ("versions", Version, delete_versions),
+    ):
+        expired = model.all_objects.filter(deleted_at__lt=cutoff)
+        if dry_run:
+            report[key] = expired.count()
+            continue
+        while True:
+            ids = list(expired.order_by("pk").values_list("pk", flat=True)[:batch_size])
+            if not ids:
+                break
+            delete(ids)
+            report[key] += len(ids)
+            if pause:
+                time.sleep(pause)
+    return report
@@ -5,7 +5,8 @@ from accounts.schema import AccountsQuery, AccountsMutation
 from files.schema import FilesQuery, FilesMutation
 from graph.schema import GraphQuery, GraphMutation
 from chat.schema import ChatQuery, ChatMutation
-from .subscriptions import NodeUpdates, MessageUpdates
+from .subscriptions import FileUpdates, NodeUpdates, MessageUpdates
+from .trash import TrashQuery, TrashMutation
 
 
 class Query(
@@ -13,6 +14,7 @@ class Query(
     FilesQuery,
     GraphQuery,
     ChatQuery,
+    TrashQuery,
     graphene.ObjectType,
 ):
     pass
@@ -23,6 +25,7 @@ class Mutation(
     FilesMutation,
     GraphMutation,
     ChatMutation,
+    TrashMutation,
     graphene.ObjectType,
 ):
     tokenAuth = graphql_jwt.ObtainJSONWebToken.Field()
@@ -32,6 +35,7 @@ class Mutation(
 
 class Subscription(graphene.ObjectType):
     node_updates = NodeUpdates.Field()
+    file_updates = FileUpdates.Field()
     message_updates = MessageUpdates.Field()
 
 
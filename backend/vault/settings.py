@@ -33,6 +33,7 @@ INSTALLED_APPS = [
     'files',
     'graph',
     'chat',
+    'jobs',
 ]
 
 # ─── MIDDLEWARE ──────────────────────────────────────────────────────
@@ -45,6 +46,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'files.middleware.DiscardUnusedUploadsMiddleware',
 ]
 
 # ─── CORS CONFIGURATION ─────────────────────────────────────────────
@@ -128,6 +130,100 @@ STATIC_ROOT = BASE_DIR / 'static_root'
 MEDIA_URL  = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Blob backend for File.upload/Version.upload: "local", "chunked"
+# (content-defined chunks with cross-version dedupe) or "s3"
+VAULT_BLOB_STORAGE = os.environ.get('VAULT_BLOB_STORAGE', 'local')
+
+# S3-protocol bucket for VAULT_BLOB_STORAGE=s3 (AWS, or MinIO locally)
+VAULT_S3 = {
+    'ENDPOINT_URL': os.environ.get('VAULT_S3_ENDPOINT_URL') or None,
+    # what browsers use to reach the same service, for presigned downloads
+    'PUBLIC_ENDPOINT_URL': os.environ.get('VAULT_S3_PUBLIC_ENDPOINT_URL') or None,
+    'BUCKET': os.environ.get('VAULT_S3_BUCKET', 'vault'),
+    'LOCATION': os.environ.get('VAULT_S3_LOCATION', ''),
+    'REGION': os.environ.get('VAULT_S3_REGION', 'us-east-1'),
+    'ACCESS_KEY': os.environ.get('VAULT_S3_ACCESS_KEY') or None,
+    'SECRET_KEY': os.environ.get('VAULT_S3_SECRET_KEY') or None,
+    # MinIO and most self-hosted services need "path"
+    'ADDRESSING_STYLE': os.environ.get('VAULT_S3_ADDRESSING_STYLE', 'auto'),
+    'MULTIPART_THRESHOLD': int(os.environ.get('VAULT_S3_MULTIPART_THRESHOLD', 16 * 1024 ** 2)),
+    'MULTIPART_CHUNKSIZE': int(os.environ.get('VAULT_S3_MULTIPART_CHUNKSIZE', 16 * 1024 ** 2)),
+    # parts of one upload sent in parallel
+    'MAX_CONCURRENCY': int(os.environ.get('VAULT_S3_MAX_CONCURRENCY', 8)),
+    'MAX_POOL_CONNECTIONS': int(os.environ.get('VAULT_S3_MAX_POOL_CONNECTIONS', 32)),
+    'PRESIGN_SECONDS': int(os.environ.get('VAULT_S3_PRESIGN_SECONDS', 300)),
+}
+
+# Reconstructed delta-compressed versions (LRU, local disk)
+VERSION_CACHE_DIR = BASE_DIR / 'cache' / 'versions'
+VERSION_CACHE_MAX_BYTES = int(os.environ.get('VERSION_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+# Versions larger than this stay whole; diffing runs at a few MB/s
+DELTA_MAX_BYTES = int(os.environ.get('DELTA_MAX_BYTES', 16 * 1024 ** 2))
+
+# Images resized on request by /media/resize/ (LRU, local disk)
+RESIZE_CACHE_DIR = BASE_DIR / 'cache' / 'resized'
+RESIZE_CACHE_MAX_BYTES = int(os.environ.get('RESIZE_CACHE_MAX_BYTES', 512 * 1024 ** 2))
+
+# Signed download links: lifetime, and the step expiries are rounded up to so
+# repeated resolves of downloadUrl give the same cacheable URL
+DOWNLOAD_LINK_SECONDS = int(os.environ.get('DOWNLOAD_LINK_SECONDS', 60 * 60))
+DOWNLOAD_LINK_ROUNDING = 5 * 60
+# How long a process trusts its cached copy of a file's link key generation
+DOWNLOAD_KEY_CACHE_SECONDS = 30
+
+# nodesInViewport: most nodes one call returns, and the margin (in screen
+# pixels, scaled by zoom) fetched around the viewport so small pans need no refetch
+MAP_VIEWPORT_MAX_NODES = int(os.environ.get('MAP_VIEWPORT_MAX_NODES', 2000))
+MAP_VIEWPORT_MARGIN_PX = 200
+# Most nodes one moveNodes call may reposition
+MAP_MOVE_MAX_NODES = 1000
+# Most items one createNodes, createEdges, addFilesToNodes or moveFiles call may carry
+GRAPH_BATCH_MAX_ITEMS = 1000
+# Wait before laying out a changed map, so a burst of edits is laid out once
+LAYOUT_DEBOUNCE_SECONDS = int(os.environ.get('LAYOUT_DEBOUNCE_SECONDS', 2))
+# How long a process trusts its in-memory adjacency of one owner's map without
+# hearing of edits (neighbors, shortestPath, connectedComponent)
+GRAPH_ADJACENCY_MAX_AGE_SECONDS = 60
+# Most nodes one neighbors or connectedComponent call returns
+GRAPH_TRAVERSAL_MAX_NODES = 1000
+# Fewest nodes touched by edits before a map's importance scores are recomputed
+GRAPH_SCORE_MIN_CHANGES = int(os.environ.get('GRAPH_SCORE_MIN_CHANGES', 20))
+
+# Days a deleted file, version or node stays restorable before purge_trash removes it
+TRASH_RETENTION_DAYS = int(os.environ.get('TRASH_RETENTION_DAYS', 30))
+
+# Background jobs (manage.py run_worker): concurrency is per worker process,
+# so each worker started on a queue adds that many more slots
+JOB_QUEUES = {
+    'default':  {'concurrency': 4},
+    'blobs':    {'concurrency': 2},
+    # compactions lock their file, so workers never compact one file at once
+    'versions': {'concurrency': 1},
+    'derivatives': {'concurrency': 2},
+    # layouts only write if no other layout of the map was written since they
+    # started (MapStats.layout_generation); one per process keeps the CPU for
+    # the others
+    'layout':   {'concurrency': 1},
+}
+# A running job whose worker has not renewed its lease for this long is
+# assumed lost and requeued; workers renew every third of it
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 15 * 60))
+
+# Bytes each user may store (live versions at full size); unset means no limit.
+# A user's StorageUsage.quota_bytes overrides it.
+STORAGE_QUOTA_BYTES = int(os.environ['STORAGE_QUOTA_BYTES']) if os.environ.get('STORAGE_QUOTA_BYTES') else None
+
+# Threads per request hashing and writing the files of an uploadFiles batch
+UPLOAD_WRITE_CONCURRENCY = int(os.environ.get('UPLOAD_WRITE_CONCURRENCY', 8))
+# Files Django accepts in one multipart request (its default is 100)
+DATA_UPLOAD_MAX_NUMBER_FILES = int(os.environ.get('DATA_UPLOAD_MAX_NUMBER_FILES', 1000))
+
+# Stream signed-in users' multipart uploads straight into MEDIA_ROOT, hashing
+# them on the way; DiscardUnusedUploadsMiddleware removes the ones left unused
+FILE_UPLOAD_HANDLERS = [
+    'files.uploadhandlers.StreamingUploadHandler',
+]
+
 # ─── AUTH BACKENDS ──────────────────────────────────────────────────
 AUTHENTICATION_BACKENDS = [
     'graphql_jwt.backends.JSONWebTokenBackend',  # for tokenAuth → request.user
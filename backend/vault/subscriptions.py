@@ -28,6 +28,48 @@ class NodeUpdates(channels_graphql_ws.Subscription):
             group=f"node_{node_id}", payload={"id": str(node_id)}
         )
 
+    @classmethod
+    def notify_many(cls, node_ids):
+        """One event per affected node, plus a single one on the shared group."""
+        node_ids = sorted({str(node_id) for node_id in node_ids})
+        if not node_ids:
+            return
+        async_to_sync(cls.broadcast)(group="nodes", payload={"id": node_ids[0]})
+        for node_id in node_ids:
+            async_to_sync(cls.broadcast)(group=f"node_{node_id}", payload={"id": node_id})
+
+
+    @classmethod
+    def notify_created(cls, node_ids):
+        """New nodes nobody can be watching yet: one event on the shared group."""
+        node_ids = sorted({str(node_id) for node_id in node_ids})
+        if node_ids:
+            async_to_sync(cls.broadcast)(group="nodes", payload={"id": node_ids[0]})
+
+
+class FileUpdates(channels_graphql_ws.Subscription):
+    """Broadcast changes to a user's file list."""
+
+    owner_id = graphene.ID()
+
+    class Arguments:
+        owner_id = graphene.ID(required=True)
+
+    @staticmethod
+    def subscribe(root, info, owner_id):
+        return [f"files_{owner_id}"]
+
+    @staticmethod
+    def publish(payload, info, owner_id):
+        return FileUpdates(owner_id=payload.get("owner_id"))
+
+    @classmethod
+    def notify(cls, owner_id):
+        async_to_sync(cls.broadcast)(
+            group=f"files_{owner_id}",
+            payload={"owner_id": str(owner_id)},
+        )
+
 
 class MessageUpdates(channels_graphql_ws.Subscription):
     """Broadcast chat message events for a channel."""
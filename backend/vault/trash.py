@@ -0,0 +1,75 @@
+# vault/trash.py
+
+import graphene
+from django.conf import settings
+from graphql import GraphQLError
+
+from files.models import File, Version
+from files.schema import FileType, VersionType
+from graph.models import Node
+from graph.schema import NodeType
+from vault.deletion import restore_files, restore_nodes, restore_versions
+
+
+# ── Types ────────────────────────────────────────────────────────────────────
+
+class TrashType(graphene.ObjectType):
+    files          = graphene.List(FileType)
+    versions       = graphene.List(VersionType, description="Trashed versions of files still in use")
+    nodes          = graphene.List(NodeType)
+    retention_days = graphene.Int(description="Days items stay restorable")
+
+
+# ── Queries ──────────────────────────────────────────────────────────────────
+
+class TrashQuery(graphene.ObjectType):
+    trash = graphene.Field(TrashType)
+
+    def resolve_trash(self, info):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        return TrashType(
+            files=File.all_objects.filter(owner=user, deleted_at__isnull=False).order_by("-deleted_at"),
+            versions=Version.all_objects.filter(
+                file__owner=user, file__deleted_at__isnull=True, deleted_at__isnull=False
+            ).order_by("-deleted_at"),
+            nodes=Node.all_objects.filter(owner=user, deleted_at__isnull=False).order_by("-deleted_at"),
+            retention_days=settings.TRASH_RETENTION_DAYS,
+        )
+
+
+# ── Mutations ────────────────────────────────────────────────────────────────
+
+class Restore(graphene.Mutation):
+    """Take files, versions and nodes you own out of the trash."""
+
+    restored = graphene.Int()
+
+    class Arguments:
+        file_ids    = graphene.List(graphene.ID)
+        version_ids = graphene.List(graphene.ID)
+        node_ids    = graphene.List(graphene.ID)
+
+    def mutate(self, info, file_ids=None, version_ids=None, node_ids=None):
+        user = info.context.user
+        if user.is_anonymous:
+            raise GraphQLError("Authentication required.")
+        restored = 0
+        if file_ids:
+            restored += restore_files(
+                list(File.all_objects.filter(pk__in=file_ids, owner=user).values_list("pk", flat=True))
+            )
+        if version_ids:
+            restored += restore_versions(list(
+                Version.all_objects.filter(pk__in=version_ids, file__owner=user).values_list("pk", flat=True)
+            ))
+        if node_ids:
+            restored += restore_nodes(
+                list(Node.all_objects.filter(pk__in=node_ids, owner=user).values_list("pk", flat=True))
+            )
+        return Restore(restored=restored)
+
+
+class TrashMutation(graphene.ObjectType):
+    restore = Restore.Field()
@@ -2,7 +2,7 @@
 
 import os
 from django.contrib import admin
-from django.urls import path, re_path
+from django.urls import include, path, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -12,6 +12,8 @@ from django.views.generic import TemplateView
 from graphene_file_upload.django import FileUploadGraphQLView
 from django.views.decorators.csrf import csrf_exempt
 
+from files.views import resize_image
+
 urlpatterns = [
     # Admin site
     path('admin/', admin.site.urls),
@@ -22,11 +24,18 @@ urlpatterns = [
         csrf_exempt(FileUploadGraphQLView.as_view(graphiql=True)),
         name='graphql',
     ),
+
+    # File downloads that need server-side work (e.g. rebuilding deltas)
+    path('files/', include('files.urls')),
+    path('nodes/', include('graph.urls')),
+
+    # Resized image variants (avatars, previews) from an LRU disk cache
+    path('media/resize/<int:file_id>', resize_image, name='media-resize'),
 ]
 
 # Catch-all: serve React app for any route not handled above
 urlpatterns += [
-    re_path(r'^(?!admin/|graphql/).*', TemplateView.as_view(template_name='index.html'), name='index'),
+    re_path(r'^(?!admin/|graphql/|files/|nodes/|media/).*', TemplateView.as_view(template_name='index.html'), name='index'),
 ]
 
 if settings.DEBUG:
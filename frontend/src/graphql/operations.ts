@@ -357,7 +357,7 @@ export const QUERY_FILE_VERSIONS = gql`
   query GetFileVersions($fileId: ID!, $limit: Int = 20, $offset: Int = 0) {
     fileVersions(fileId: $fileId, limit: $limit, offset: $offset) {
       id
-      uploadUrl: upload
+      uploadUrl: downloadUrl
       note
       fileName
       createdAt
@@ -388,7 +388,7 @@ export const MUTATION_UPLOAD_FILE = gql`
       }
       version {
         id
-        uploadUrl: upload
+        uploadUrl: downloadUrl
         note
         fileName
         createdAt
@@ -403,7 +403,7 @@ export const MUTATION_ADD_FILE_VERSION = gql`
     addFileVersion(fileId: $fileId, upload: $upload, note: $note) {
       version {
         id
-        uploadUrl: upload
+        uploadUrl: downloadUrl
         note
         fileName
         createdAt
@@ -516,7 +516,7 @@ export const MUTATION_KEEP_FILE = gql`
       }
       versions {
         id
-        uploadUrl: upload
+        uploadUrl: downloadUrl
         note
         createdAt
       }
@@ -597,7 +597,7 @@ export const QUERY_CHANNEL_MESSAGES = gql`
       text
       attachment {
         id
-        uploadUrl: upload
+        uploadUrl: downloadUrl
         note
         createdAt
       }
@@ -675,7 +675,7 @@ export const MUTATION_SEND_MESSAGE = gql`
         text
         attachment {
           id
-          uploadUrl: upload
+          uploadUrl: downloadUrl
           note
           createdAt
         }
@@ -700,11 +700,16 @@ export const QUERY_PING = gql`
 
 // 2) Nodes the user owns or can read (with pagination + optional name filter)
 export const QUERY_MY_NODES = gql`
-  query GetMyNodes($limit: Int = 20, $offset: Int = 0, $nameContains: String) {
-    myNodes(limit: $limit, offset: $offset, nameContains: $nameContains) {
+  query GetMyNodes($limit: Int = 20, $offset: Int = 0, $nameContains: String, $orderBy: String) {
+    myNodes(limit: $limit, offset: $offset, nameContains: $nameContains, orderBy: $orderBy) {
       id
       name
       description
+      x
+      y
+      layer
+      pagerank
+      degree
       createdAt
       owner {
         id
@@ -716,7 +721,7 @@ export const QUERY_MY_NODES = gql`
         file {
           id
           name
-          uploadUrl: upload
+          uploadUrl: downloadUrl
         }
       }
       edges {
@@ -758,7 +763,7 @@ export const QUERY_NODE_FILES = gql`
       file {
         id
         name
-        uploadUrl: upload
+        uploadUrl: downloadUrl
       }
     }
   }
@@ -804,16 +809,93 @@ export const QUERY_PUBLIC_NODES = gql`
   }
 `;
 
+// 5b) Readable nodes inside the visible part of the map
+export const QUERY_NODES_IN_VIEWPORT = gql`
+  query GetNodesInViewport($bbox: BoundingBox!, $zoom: Float = 1, $limit: Int) {
+    nodesInViewport(bbox: $bbox, zoom: $zoom, limit: $limit) {
+      id
+      name
+      description
+      x
+      y
+      layer
+      createdAt
+      owner {
+        id
+        username
+      }
+      files {
+        note
+        addedAt
+        file {
+          id
+          name
+          uploadUrl: downloadUrl
+        }
+      }
+      edges {
+        id
+        nodeA {
+          id
+          name
+        }
+        nodeB {
+          id
+          name
+        }
+        label
+        createdAt
+      }
+      shares {
+        id
+        permission
+        isPublic
+        sharedWithUser {
+          id
+          username
+        }
+        sharedWithGroup {
+          id
+          name
+        }
+      }
+    }
+  }
+`;
+
+// 5c) The map zoomed out: clusters of nodes and the links between them
+export const QUERY_MAP_AT_ZOOM = gql`
+  query GetMapAtZoom($level: Int!, $bbox: BoundingBox!) {
+    mapAtZoom(level: $level, bbox: $bbox) {
+      level
+      clusters {
+        id
+        size
+        x
+        y
+      }
+      links {
+        source
+        target
+        edges
+      }
+    }
+  }
+`;
+
 // — Mutations —
 
 // 6) Create a new node
 export const MUTATION_CREATE_NODE = gql`
-  mutation CreateNode($name: String!, $description: String) {
-    createNode(name: $name, description: $description) {
+  mutation CreateNode($name: String!, $description: String, $x: Float, $y: Float) {
+    createNode(name: $name, description: $description, x: $x, y: $y) {
       node {
         id
         name
         description
+        x
+        y
+        layer
         createdAt
         owner {
           id
@@ -838,6 +920,29 @@ export const MUTATION_RENAME_NODE = gql`
   }
 `;
 
+// 7b) Move many nodes on the map at once
+export const MUTATION_MOVE_NODES = gql`
+  mutation MoveNodes($moves: [NodeMoveInput!]!) {
+    moveNodes(moves: $moves) {
+      nodes {
+        id
+        x
+        y
+        layer
+      }
+    }
+  }
+`;
+
+// 7c) Lay out the whole map again on the server
+export const MUTATION_LAYOUT_MAP = gql`
+  mutation LayoutMap {
+    layoutMap {
+      ok
+    }
+  }
+`;
+
 // 8) Delete a node
 export const MUTATION_DELETE_NODE = gql`
   mutation DeleteNode($nodeId: ID!) {
@@ -857,7 +962,7 @@ export const MUTATION_ADD_FILE_TO_NODE = gql`
         file {
           id
           name
-          uploadUrl: upload
+          uploadUrl: downloadUrl
         }
       }
     }
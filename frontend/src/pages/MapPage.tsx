@@ -21,16 +21,20 @@ import ReactFlow, {
   type Connection,
   type Node,
   type Edge,
+  type Viewport,
 } from "reactflow";
 import { useQuery, useMutation, useSubscription } from "@apollo/client";
 import {
-  QUERY_MY_NODES,
+  QUERY_NODES_IN_VIEWPORT,
+  QUERY_MAP_AT_ZOOM,
   QUERY_MY_FILES,
   QUERY_NODE_FILES,
   QUERY_FRIENDS,
   QUERY_MY_GROUPS,
   MUTATION_CREATE_NODE,
   MUTATION_RENAME_NODE,
+  MUTATION_MOVE_NODES,
+  MUTATION_LAYOUT_MAP,
   MUTATION_DELETE_NODE,
   MUTATION_CREATE_EDGE,
   MUTATION_DELETE_EDGE,
@@ -60,6 +64,7 @@ import {
   Eye,
   Pen,
   MessageCircle,
+  Network,
 } from "lucide-react";
 import "reactflow/dist/style.css";
 import Header from "../components/Header";
@@ -89,13 +94,27 @@ interface NodeData {
   id: string;
   name: string;
   description: string;
+  x: number;
+  y: number;
+  layer: number;
   createdAt: string;
   owner: { id: string; username: string };
   files: FileOnNode[];
   edges: EdgeOnNode[];
   shares: NodeShare[];
 }
-interface QueryMyNodesResult { myNodes: NodeData[] }
+interface QueryNodesInViewportResult { nodesInViewport: NodeData[] }
+interface QueryMapAtZoomResult {
+  mapAtZoom: {
+    level: number;
+    clusters: { id: string; size: number; x: number; y: number }[];
+    links: { source: string; target: string; edges: number }[];
+  };
+}
+interface MapView {
+  bbox: { minX: number; minY: number; maxX: number; maxY: number };
+  zoom: number;
+}
 interface QueryMyFilesResult {
   myFiles: { id: string; name: string; downloadUrl: string }[];
 }
@@ -103,6 +122,25 @@ interface QueryMyGroupsResult { myGroups: Group[] }
 interface Friend { id: string; username: string }
 interface Group { id: string; name: string }
 
+// below zoom 1 each halving of the zoom shows one coarser level of clusters
+const CLUSTER_LEVELS = 3;
+const zoomLevel = (zoom: number) =>
+  Math.max(0, Math.min(CLUSTER_LEVELS, Math.floor(Math.log2(zoom)) + CLUSTER_LEVELS));
+
+function ClusterNode({ data }: NodeProps<{ size: number }>) {
+  const side = 40 + Math.min(Math.log2(data.size + 1) * 12, 120);
+  return (
+    <div
+      className="rounded-full bg-orange-500/80 text-white flex items-center justify-center font-semibold"
+      style={{ width: side, height: side, transform: "translate(-50%, -50%)" }}
+    >
+      {data.size}
+      <Handle type="target" position={Position.Top} isConnectable={false} style={{ opacity: 0 }} />
+      <Handle type="source" position={Position.Bottom} isConnectable={false} style={{ opacity: 0 }} />
+    </div>
+  );
+}
+
 export default function MapPage() {
   const [sidebarCollapsed, setSidebarCollapsed] = usePersistentState<boolean>(
     "sidebar-collapsed",
@@ -161,15 +199,56 @@ export default function MapPage() {
     }
   }, [friendsData]);
 
-  // nodes + files
+  // visible part of the map, in map coordinates
+  const canvasRef = useRef<HTMLDivElement>(null);
+  const [view, setView] = useState<MapView | null>(null);
+  const updateView = useCallback((vp: Viewport) => {
+    const el = canvasRef.current;
+    if (!el) return;
+    setView({
+      zoom: vp.zoom,
+      bbox: {
+        minX: -vp.x / vp.zoom,
+        minY: -vp.y / vp.zoom,
+        maxX: (el.clientWidth - vp.x) / vp.zoom,
+        maxY: (el.clientHeight - vp.y) / vp.zoom,
+      },
+    });
+  }, []);
+  useEffect(() => updateView({ x: 0, y: 0, zoom: 1 }), [updateView]);
+
+  const level = view ? zoomLevel(view.zoom) : CLUSTER_LEVELS;
+  const detailed = level === CLUSTER_LEVELS;
+
+  // nodes on screen + files
   const {
-    data: nodesData,
+    data: viewData,
+    previousData: previousViewData,
     loading: nodesLoading,
     error: nodesError,
-    refetch: refetchNodes,
-  } = useQuery<QueryMyNodesResult>(QUERY_MY_NODES, {
+    refetch: refetchViewport,
+  } = useQuery<QueryNodesInViewportResult>(QUERY_NODES_IN_VIEWPORT, {
+    variables: view ?? undefined,
+    skip: !view || !detailed,
     fetchPolicy: "network-only",
   });
+  // keep the old nodes on screen while a pan is being fetched
+  const nodesData = viewData ?? previousViewData;
+  // zoomed out: clusters instead of nodes
+  const {
+    data: zoomData,
+    previousData: previousZoomData,
+    refetch: refetchClusters,
+  } = useQuery<QueryMapAtZoomResult>(QUERY_MAP_AT_ZOOM, {
+    variables: view ? { level, bbox: view.bbox } : undefined,
+    skip: !view || detailed,
+    fetchPolicy: "network-only",
+  });
+  const clusterData = zoomData ?? previousZoomData;
+  const refetchNodes = useCallback(
+    () => (detailed ? refetchViewport() : refetchClusters()),
+    [detailed, refetchViewport, refetchClusters]
+  );
   const {
     data: filesData,
     loading: filesLoading,
@@ -198,14 +277,19 @@ export default function MapPage() {
       const n = res.createNode.node;
       setNodes(nds => [
         ...nds,
-        { id: n.id, type: "custom", position: { x:200,y:200 },
+        { id: n.id, type: "custom", position: { x:n.x,y:n.y },
           data: { id:n.id, name:n.name, description:"", files:[], shares:[] }
         }
       ]);
-      savePosition(n.id,200,200);
     }
   });
   const [renameNode]  = useMutation(MUTATION_RENAME_NODE);
+  // positions arrive through the node updates subscription when it is done
+  const [layoutMap]   = useMutation(MUTATION_LAYOUT_MAP);
+  const [moveNodes]   = useMutation(MUTATION_MOVE_NODES, {
+    // e.g. someone else's node: put everything back where the server has it
+    onError: () => refetchNodes(),
+  });
   const [deleteNode]  = useMutation(MUTATION_DELETE_NODE);
   const [createEdge]  = useMutation(MUTATION_CREATE_EDGE);
   const [deleteEdge]  = useMutation(MUTATION_DELETE_EDGE);
@@ -360,29 +444,26 @@ export default function MapPage() {
     };
   }, [touchDrag, touchPos, addFileToNode, shareNodeWithUser, shareNodeWithGroup]);
 
-  // persist positions
-  const getSavedPositions = () => {
-    try { return JSON.parse(localStorage.getItem("node-positions")||"{}") }
-    catch { return {} }
-  };
-  const savePosition = (id:string,x:number,y:number) => {
-    const all = getSavedPositions();
-    all[id] = { x,y };
-    localStorage.setItem("node-positions",JSON.stringify(all));
-  };
-
   // build graph
   const graphNodes:Node[] = useMemo(() => {
-    if (!nodesData?.myNodes) return [];
-    const saved = getSavedPositions();
-    return nodesData.myNodes.map((n,idx) => {
-      const defX = 50 + (idx%5)*200;
-      const defY = 50 + Math.floor(idx/5)*200;
-      const pos = saved[n.id] ?? { x:defX,y:defY };
+    if (!detailed) {
+      return (clusterData?.mapAtZoom.clusters ?? []).map(c => ({
+        id: `cluster-${c.id}`,
+        type: "cluster",
+        position: { x:c.x,y:c.y },
+        draggable: false,
+        connectable: false,
+        selectable: false,
+        data: { size: c.size },
+      }));
+    }
+    if (!nodesData?.nodesInViewport) return [];
+    return nodesData.nodesInViewport.map(n => {
       return {
         id: n.id,
         type: "custom",
-        position: pos,
+        position: { x:n.x,y:n.y },
+        zIndex: n.layer,
         data: {
           id: n.id,
           name: n.name,
@@ -392,14 +473,25 @@ export default function MapPage() {
         },
       };
     });
-  }, [nodesData]);
+  }, [nodesData, clusterData, detailed]);
   const graphEdges:Edge[] = useMemo(() => {
-    if (!nodesData?.myNodes) return [];
+    if (!detailed) {
+      return (clusterData?.mapAtZoom.links ?? []).map(l => ({
+        id: `link-${l.source}-${l.target}`,
+        source: `cluster-${l.source}`,
+        target: `cluster-${l.target}`,
+        label: String(l.edges),
+        style: { stroke:"#F97316",strokeWidth:Math.min(1 + Math.log2(l.edges), 8) },
+      }));
+    }
+    if (!nodesData?.nodesInViewport) return [];
     const seen = new Set<string>();
+    const shown = new Set(nodesData.nodesInViewport.map(n => n.id));
     const out:Edge[] = [];
-    nodesData.myNodes.forEach(node =>
+    nodesData.nodesInViewport.forEach(node =>
       node.edges.forEach(e => {
-        if (e.nodeA.id===node.id && !seen.has(e.id)) {
+        // edges to nodes off screen have nothing to attach to
+        if (e.nodeA.id===node.id && shown.has(e.nodeB.id) && !seen.has(e.id)) {
           seen.add(e.id);
           out.push({
             id: e.id,
@@ -412,23 +504,29 @@ export default function MapPage() {
       })
     );
     return out;
-  },[nodesData]);
+  },[nodesData, clusterData, detailed]);
 
   // ReactFlow state
   const [nodes, setNodes, onNodesChange] = useNodesState(graphNodes);
   const [edges, setEdges, onEdgesChange] = useEdgesState(graphEdges);
   useEffect(() => {
-    if (nodesData?.myNodes) {
+    if (detailed ? nodesData?.nodesInViewport : clusterData?.mapAtZoom) {
       setNodes(graphNodes);
       setEdges(graphEdges);
     }
-  },[nodesData,graphNodes,graphEdges]);
+  },[nodesData,clusterData,detailed,graphNodes,graphEdges]);
 
   const [selected, setSelected] = useState<{nodes:Node[];edges:Edge[]}>({nodes:[],edges:[]});
   const onSelectionChange = (s:{nodes:Node[];edges:Edge[]}) => setSelected(s);
 
   // add / delete
-  const handleAddNode = () => createNode({ variables:{ name:"New Node", description:"" }});
+  const handleAddNode = () => {
+    // drop it in the middle of what is on screen
+    const b = view?.bbox;
+    const x = b ? (b.minX + b.maxX) / 2 : 200;
+    const y = b ? (b.minY + b.maxY) / 2 : 200;
+    createNode({ variables:{ name:"New Node", description:"", x, y }});
+  };
   const handleDeleteSelected = () => {
     selected.nodes.forEach(n=>
       deleteNode({
@@ -436,8 +534,6 @@ export default function MapPage() {
         onCompleted:()=>{
           setNodes(nds=>nds.filter(x=>x.id!==n.id));
           setEdges(eds=>eds.filter(e=>e.source!==n.id&&e.target!==n.id));
-          const all=getSavedPositions(); delete all[n.id];
-          localStorage.setItem("node-positions",JSON.stringify(all));
         }
       })
     );
@@ -487,9 +583,12 @@ export default function MapPage() {
       }
     });
   };
-  const onNodeDragStop:NodeDragHandler = (_e,node)=>{
-    savePosition(node.id,node.position.x,node.position.y);
-    setNodes(nds=>nds.map(n=>n.id===node.id?{...n,position:node.position}:n));
+  const onNodeDragStop:NodeDragHandler = (_e,node,dragged)=>{
+    // a dragged selection is saved in one call
+    const moved = dragged.length ? dragged : [node];
+    moveNodes({ variables:{ moves: moved.map(n=>({ nodeId:n.id, x:n.position.x, y:n.position.y })) } });
+    const positions = new Map(moved.map(n=>[n.id,n.position]));
+    setNodes(nds=>nds.map(n=>positions.has(n.id)?{...n,position:positions.get(n.id)!}:n));
   };
 
   // custom node
@@ -789,9 +888,10 @@ export default function MapPage() {
     );
   }
 
-  const nodeTypes = useMemo(() => ({ custom: CustomNode }), []);
+  const nodeTypes = useMemo(() => ({ custom: CustomNode, cluster: ClusterNode }), []);
 
-  if (nodesLoading || filesLoading) return <div className="p-4">Loading…</div>;
+  // only the first load: unmounting the flow on every pan would reset its viewport
+  if ((nodesLoading && !nodesData) || (filesLoading && !filesData)) return <div className="p-4">Loading…</div>;
   if (nodesError) return <div className="p-4 text-red-500">Error: {nodesError.message}</div>;
 
   return (
@@ -810,6 +910,13 @@ export default function MapPage() {
         >
           <Minus size={16} className="text-white" />
         </button>
+        <button
+          onClick={() => layoutMap()}
+          title="Tidy up the map"
+          className="p-2 bg-orange-500 hover:bg-red-600 rounded"
+        >
+          <Network size={16} className="text-white" />
+        </button>
       </Header>
 
       {/* MAIN */}
@@ -1073,7 +1180,7 @@ export default function MapPage() {
         </aside>
 
         {/* CANVAS */}
-        <div className="flex-1 relative overscroll-none" style={{ touchAction:'none', background:'#2D2D2D' }}>
+        <div ref={canvasRef} className="flex-1 relative overscroll-none" style={{ touchAction:'none', background:'#2D2D2D' }}>
           <ReactFlowProvider>
             <ReactFlow
               nodes={nodes}
@@ -1083,6 +1190,8 @@ export default function MapPage() {
               onConnect={handleConnect}
               onEdgeClick={handleEdgeClick}
               onNodeDragStop={onNodeDragStop}
+              onMoveEnd={(_e,vp)=>updateView(vp)}
+              minZoom={0.05}
               onSelectionChange={onSelectionChange}
               nodeTypes={nodeTypes}
               style={{ background:"transparent" }}